@@ -7,6 +7,7 @@ Wires up:
 - Rate limiter applied per-endpoint from env-driven rules.
 - Uniform JSON error responses via ``errors.register_error_handlers``.
 - Sentry initialized if ``SENTRY_DSN`` is set.
+- Models load lazily on first use, or at boot with ``MODEL_WARMUP=1``.
 
 Routes live in blueprint modules under ``routes/v1/`` and are mounted at
 ``/api/v1/...``.
@@ -94,6 +95,11 @@ def create_app() -> Flask:
 
     register_error_handlers(app)
 
+    if os.getenv("MODEL_WARMUP") == "1":
+        from rag.models import warmup
+
+        warmup()
+
     return app
 
 
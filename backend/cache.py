@@ -1,18 +1,45 @@
 """Response & embedding cache with two layers: an exact SHA-256 key cache, and a
 semantic cache that reuses an answer when a query embedding is within
 ``SEMANTIC_SIM_THRESHOLD`` of a cached one. Uses Redis when ``REDIS_URL`` is set,
-otherwise a process-local LRU (single-process only).
+otherwise a process-local LRU (single-process only). With Redis, each process
+also keeps a small short-TTL L1 in front of it, kept coherent over pub/sub
+(``_TieredBackend``).
+
+The semantic layer keeps each user's recent query embeddings packed as one
+float16 blob (a row per entry) next to a list of entry ids, and only reads
+the winning entry's answer. Appends trim the blob to the newest
+``SEMANTIC_MAX_ENTRIES`` rows atomically (a Lua script on Redis), in bulk once
+it is a quarter over; lookups only search the newest ``SEMANTIC_MAX_ENTRIES``.
+
+With ``SEMANTIC_ANN=1`` (default) each process mirrors a namespace's rows in
+a FAISS index (``SEMANTIC_ANN_INDEX``: ``flat`` or ``hnsw``) held in the
+namespace cache. A lookup pulls only the rows appended since its last one,
+expires rows older than ``SEMANTIC_TTL`` and searches locally, so thousands
+of entries per user stay cheap. ``SEMANTIC_ANN=0`` fetches the whole blob and
+scores it with one matrix-vector product instead.
+
+Answer and semantic keys include the namespace's index generation, a counter
+that ``invalidate_user`` increments after every ingest or delete. Entries from
+the previous corpus become unreachable at once and age out by TTL / LRU, so
+TTLs can be long. Content-addressed caches (chunk embeddings, rerank scores)
+are keyed by model and text and never go stale, so they are not versioned.
+
+Backends hold bytes. Values go through ``encode_value`` (msgpack, zstd past
+``CACHE_COMPRESS_MIN_BYTES``; JSON / zlib when those aren't installed) and
+vectors through ``encode_array`` (raw little-endian rows, no text encoding).
 """
 from __future__ import annotations
 
 import hashlib
+import importlib.util
 import json
 import os
 import threading
 import time
+import zlib
 from collections import OrderedDict
 from dataclasses import dataclass
-from typing import Any, Iterable, Protocol
+from typing import Any, Callable, Iterable, Protocol
 
 import numpy as np
 
@@ -20,16 +47,131 @@ from logging_config import get_logger
 
 log = get_logger("cache")
 
-DEFAULT_TTL = 60 * 60  # 1h
-SEMANTIC_TTL = 60 * 30
+# Generation keys invalidate on re-ingest, so TTLs only bound memory.
+DEFAULT_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+SEMANTIC_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", str(6 * 60 * 60)))
 SEMANTIC_SIM_THRESHOLD = 0.93
+# The in-process ANN tier makes thousands of entries per user cheap to search;
+# without it every lookup fetches and scans the whole blob, so keep that short.
+SEMANTIC_ANN = os.getenv("SEMANTIC_ANN", "1") == "1"
+SEMANTIC_ANN_INDEX = os.getenv("SEMANTIC_ANN_INDEX", "flat")  # flat | hnsw
+SEMANTIC_MAX_ENTRIES = int(os.getenv("SEMANTIC_MAX_ENTRIES") or (4096 if SEMANTIC_ANN else 512))
+_SEMANTIC_DTYPE = np.dtype("<f2")
+_ANN_CANDIDATES = 8
+
+
+# ---------- Value codecs ----------------------------------------------------------
+#
+# Backends store bytes. A value is one header byte (serializer | compressor)
+# followed by the payload, so readers decode whatever a peer wrote even while
+# CACHE_CODEC is being rolled out. Payloads of CACHE_COMPRESS_MIN_BYTES or more
+# (long answers, job logs) are compressed; embeddings skip serialization and are
+# stored as raw little-endian rows (``encode_array``).
+
+_SER_JSON, _SER_MSGPACK = 0x01, 0x02
+_CMP_NONE, _CMP_ZLIB, _CMP_ZSTD = 0x00, 0x10, 0x20
+_CMP_MASK = 0xF0
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+_SERIALIZERS: dict[int, tuple[Callable[[Any], bytes], Callable[[bytes], Any]]] = {
+    _SER_JSON: (_json_dumps, json.loads),
+}
+_COMPRESSORS: dict[int, tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    _CMP_ZLIB: (lambda b: zlib.compress(b, 6), zlib.decompress),
+}
+try:
+    import msgpack  # type: ignore
+
+    _SERIALIZERS[_SER_MSGPACK] = (msgpack.packb, lambda b: msgpack.unpackb(b, raw=False))
+except ImportError:
+    pass
+try:
+    import zstandard  # type: ignore
+
+    # zstd contexts are costly to create and not thread-safe: one pair per thread.
+    _zstd = threading.local()
+
+    def _zstd_ctx() -> Any:
+        if not hasattr(_zstd, "c"):
+            _zstd.c, _zstd.d = zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor()
+        return _zstd
+
+    _COMPRESSORS[_CMP_ZSTD] = (lambda b: _zstd_ctx().c.compress(b), lambda b: _zstd_ctx().d.decompress(b))
+except ImportError:
+    pass
+
+_CODEC_NAMES = {"json": _SER_JSON, "msgpack": _SER_MSGPACK}
+_COMPRESSION_NAMES = {"none": _CMP_NONE, "zlib": _CMP_ZLIB, "zstd": _CMP_ZSTD}
+
+
+def _pick(names: dict[str, int], available: dict[int, Any], wanted: str, fallback: str) -> int:
+    tag = names.get(wanted)
+    if tag is None:
+        raise ValueError(f"unknown cache codec {wanted!r}; expected one of {sorted(names)}")
+    if tag and tag not in available:
+        log.warning("cache.codec.unavailable", wanted=wanted, using=fallback)
+        return names[fallback]
+    return tag
+
+
+CACHE_CODEC = os.getenv("CACHE_CODEC", "msgpack")  # msgpack | json
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zstd")  # zstd | zlib | none
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+_SER = _pick(_CODEC_NAMES, _SERIALIZERS, CACHE_CODEC, "json")
+_CMP = _pick(_COMPRESSION_NAMES, _COMPRESSORS, CACHE_COMPRESSION, "zlib")
+
+
+def encode_value(obj: Any) -> bytes:
+    """Serialize a JSON-shaped value for the cache backend."""
+    payload = _SERIALIZERS[_SER][0](obj)
+    if _CMP and len(payload) >= CACHE_COMPRESS_MIN_BYTES:
+        packed = _COMPRESSORS[_CMP][0](payload)
+        if len(packed) < len(payload):
+            return bytes([_SER | _CMP]) + packed
+    return bytes([_SER]) + payload
+
+
+def decode_value(raw: bytes | None) -> Any:
+    """Inverse of ``encode_value``; None for a miss or an unreadable value
+    (unknown header, codec not installed here, corrupt payload)."""
+    if not raw:
+        return None
+    ser, cmp = raw[0] & ~_CMP_MASK, raw[0] & _CMP_MASK
+    try:
+        payload = raw[1:]
+        if cmp:
+            payload = _COMPRESSORS[cmp][1](payload)
+        return _SERIALIZERS[ser][1](payload)
+    except Exception as e:  # KeyError for a codec we lack, plus each codec's own errors
+        log.warning("cache.codec.decode_failed", header=raw[0], error=str(e))
+        return None
+
+
+def encode_array(v: np.ndarray, dtype: str = "<f4") -> bytes:
+    return np.ascontiguousarray(v, dtype=dtype).tobytes()
+
+
+def decode_array(raw: bytes | None, dtype: str = "<f4") -> np.ndarray | None:
+    if not raw or len(raw) % np.dtype(dtype).itemsize:
+        return None
+    return np.frombuffer(raw, dtype=dtype)
 
 
 class CacheBackend(Protocol):
-    def get(self, key: str) -> str | None: ...
-    def set(self, key: str, value: str, ttl: int) -> None: ...
-    def zadd(self, zkey: str, member: str, score: float) -> None: ...
-    def zrange(self, zkey: str, count: int) -> list[str]: ...
+    def get(self, key: str) -> bytes | None: ...
+    def set(self, key: str, value: bytes, ttl: int) -> None: ...
+    def mget(self, keys: list[str]) -> list[bytes | None]: ...
+    def mset(self, items: dict[str, bytes], ttl: int) -> None: ...
+    # None when the backend can't be read: callers must then skip the cache.
+    def counter(self, key: str) -> int | None: ...
+    def incr(self, key: str) -> int | None: ...
+    def vec_append(self, key: str, member: str, row: bytes, *, max_rows: int, ttl: int) -> None: ...
+    def vec_fetch(self, key: str) -> tuple[bytes, list[str]]: ...
+    def vec_tail(self, key: str, seen: int, width: int) -> tuple[int, int, bytes, list[str]] | None: ...
 
 
 # ---------- In-memory fallback ----------------------------------------------------
@@ -40,11 +182,13 @@ class _InMemoryBackend:
 
     def __init__(self, maxsize: int = 2048) -> None:
         self._lock = threading.Lock()
-        self._kv: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
-        self._z: dict[str, list[tuple[float, str]]] = {}
+        self._kv: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+        self._vecs: dict[str, tuple[float, bytes, list[str], int]] = {}
+        # Counters sit outside the LRU: evicting one would resurrect stale entries.
+        self._counters: dict[str, int] = {}
         self._maxsize = maxsize
 
-    def get(self, key: str) -> str | None:
+    def get(self, key: str) -> bytes | None:
         with self._lock:
             hit = self._kv.get(key)
             if not hit:
@@ -56,61 +200,395 @@ class _InMemoryBackend:
             self._kv.move_to_end(key)
             return val
 
-    def set(self, key: str, value: str, ttl: int) -> None:
+    def set(self, key: str, value: bytes, ttl: int) -> None:
         with self._lock:
             self._kv[key] = (time.time() + ttl, value)
             self._kv.move_to_end(key)
             while len(self._kv) > self._maxsize:
                 self._kv.popitem(last=False)
 
-    def zadd(self, zkey: str, member: str, score: float) -> None:
+    def mget(self, keys: list[str]) -> list[bytes | None]:
+        return [self.get(k) for k in keys]
+
+    def mset(self, items: dict[str, bytes], ttl: int) -> None:
+        for k, v in items.items():
+            self.set(k, v, ttl)
+
+    def counter(self, key: str) -> int | None:
         with self._lock:
-            arr = self._z.setdefault(zkey, [])
-            arr.append((score, member))
-            if len(arr) > 512:
-                del arr[: len(arr) - 512]
+            return self._counters.get(key, 0)
 
-    def zrange(self, zkey: str, count: int) -> list[str]:
+    def incr(self, key: str) -> int | None:
         with self._lock:
-            return [m for _, m in list(self._z.get(zkey, []))[-count:]]
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def vec_append(self, key: str, member: str, row: bytes, *, max_rows: int, ttl: int) -> None:
+        with self._lock:
+            _, blob, ids, total = self._vec_live(key)
+            if blob and len(blob) != len(ids) * len(row):
+                blob, ids = b"", []  # row width changed (new embedding model): start over
+            blob, ids = blob + row, ids + [member]
+            if len(ids) > _vec_trim_at(max_rows):
+                drop = len(ids) - max_rows
+                blob, ids = blob[drop * len(row) :], ids[drop:]
+            self._vecs[key] = (time.time() + ttl, blob, ids, total + 1)
+
+    def vec_fetch(self, key: str) -> tuple[bytes, list[str]]:
+        with self._lock:
+            _, blob, ids, _ = self._vec_live(key)
+            return blob, list(ids)
+
+    def vec_tail(self, key: str, seen: int, width: int) -> tuple[int, int, bytes, list[str]] | None:
+        with self._lock:
+            _, blob, ids, total = self._vec_live(key)
+            if len(blob) != len(ids) * width:
+                return total, 0, b"", []
+            n = len(ids)
+            k = n if seen > total or total - seen > n else total - seen
+            return total, n, bytes(blob[(n - k) * width : n * width]), ids[n - k :]
+
+    def _vec_live(self, key: str) -> tuple[float, bytes, list[str], int]:
+        hit = self._vecs.get(key)
+        if hit is None or hit[0] < time.time():
+            self._vecs.pop(key, None)
+            return 0.0, b"", [], 0
+        return hit
+
+
+def _vec_trim_at(max_rows: int) -> int:
+    """Row count at which a packed index is cut back to ``max_rows``.
+
+    Trimming rewrites the whole blob, so a full index grows by a quarter
+    before it is cut in one go instead of being rewritten on every append.
+    Readers search only the newest ``max_rows`` of what is stored.
+    """
+    return max_rows + max(1, max_rows // 4)
 
 
 # ---------- Redis backend ---------------------------------------------------------
 
 
+# Append one packed row + its id; past ARGV[5] rows, trim both to the newest
+# ARGV[3]. KEYS: blob, ids, appended-count. ARGV: row bytes, id, max rows, ttl,
+# trim threshold. A blob whose length is not a whole number of rows (the
+# embedding width changed) is reset first. The count only grows, so readers can
+# ask for what they missed.
+_VEC_APPEND_LUA = """
+local width = string.len(ARGV[1])
+local size = redis.call('STRLEN', KEYS[1])
+if size ~= redis.call('LLEN', KEYS[2]) * width then
+  redis.call('DEL', KEYS[1], KEYS[2])
+end
+redis.call('APPEND', KEYS[1], ARGV[1])
+local n = redis.call('RPUSH', KEYS[2], ARGV[2])
+if n > tonumber(ARGV[5]) then
+  local drop = n - tonumber(ARGV[3])
+  redis.call('SET', KEYS[1], redis.call('GETRANGE', KEYS[1], drop * width, -1))
+  redis.call('LTRIM', KEYS[2], drop, -1)
+end
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+"""
+
+# Rows appended after the reader's first ARGV[1] (all retained rows if some of
+# those were trimmed or the key restarted). KEYS as above; ARGV[2] is the row
+# width, and rows of another width read as none. Returns {appended count,
+# retained rows, blob tail, id tail}.
+_VEC_TAIL_LUA = """
+local total = tonumber(redis.call('GET', KEYS[3]) or '0')
+local n = redis.call('LLEN', KEYS[2])
+local width = tonumber(ARGV[2])
+if redis.call('STRLEN', KEYS[1]) ~= n * width then return {total, 0, '', {}} end
+local seen = tonumber(ARGV[1])
+local k = total - seen
+if seen > total or k > n then k = n end
+if k <= 0 then return {total, n, '', {}} end
+return {total, n, redis.call('GETRANGE', KEYS[1], (n - k) * width, n * width - 1), redis.call('LRANGE', KEYS[2], -k, -1)}
+"""
+
+
 class _RedisBackend:
     def __init__(self, url: str) -> None:
         import redis  # type: ignore
 
-        self._r = redis.Redis.from_url(url, decode_responses=True, socket_timeout=0.5)
+        self._url = url
+        # Bytes mode: values are codec-framed and vector blobs are raw rows.
+        self._r = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._vec_append = self._r.register_script(_VEC_APPEND_LUA)
+        self._vec_tail = self._r.register_script(_VEC_TAIL_LUA)
 
-    def get(self, key: str) -> str | None:
+    def get(self, key: str) -> bytes | None:
         try:
             return self._r.get(key)
         except Exception as e:
             log.warning("cache.redis.get_failed", error=str(e))
             return None
 
-    def set(self, key: str, value: str, ttl: int) -> None:
+    def set(self, key: str, value: bytes, ttl: int) -> None:
         try:
             self._r.set(key, value, ex=ttl)
         except Exception as e:
             log.warning("cache.redis.set_failed", error=str(e))
 
-    def zadd(self, zkey: str, member: str, score: float) -> None:
+    def mget(self, keys: list[str]) -> list[bytes | None]:
+        if not keys:
+            return []
         try:
-            self._r.zadd(zkey, {member: score})
-            self._r.expire(zkey, SEMANTIC_TTL)
-            self._r.zremrangebyrank(zkey, 0, -513)  # keep newest 512
+            return list(self._r.mget(keys))
         except Exception as e:
-            log.warning("cache.redis.zadd_failed", error=str(e))
+            log.warning("cache.redis.mget_failed", error=str(e))
+            return [None] * len(keys)
 
-    def zrange(self, zkey: str, count: int) -> list[str]:
+    def mset(self, items: dict[str, bytes], ttl: int) -> None:
+        if not items:
+            return
         try:
-            return list(self._r.zrange(zkey, -count, -1) or [])
+            pipe = self._r.pipeline(transaction=False)
+            for k, v in items.items():
+                pipe.set(k, v, ex=ttl)
+            pipe.execute()
         except Exception as e:
-            log.warning("cache.redis.zrange_failed", error=str(e))
-            return []
+            log.warning("cache.redis.mset_failed", error=str(e))
+
+    def counter(self, key: str) -> int | None:
+        # 0 is a real generation (never invalidated), so a failed read is None.
+        try:
+            return int(self._r.get(key) or 0)
+        except Exception as e:
+            log.warning("cache.redis.counter_failed", error=str(e))
+            return None
+
+    def incr(self, key: str) -> int | None:
+        # No TTL: the counter must outlive every entry keyed by its value.
+        try:
+            return int(self._r.incr(key))
+        except Exception as e:
+            log.warning("cache.redis.incr_failed", error=str(e))
+            return None
+
+    def vec_append(self, key: str, member: str, row: bytes, *, max_rows: int, ttl: int) -> None:
+        try:
+            self._vec_append(
+                keys=[key, key + ":ids", key + ":n"],
+                args=[row, member, max_rows, ttl, _vec_trim_at(max_rows)],
+            )
+        except Exception as e:
+            log.warning("cache.redis.vec_append_failed", error=str(e))
+
+    def vec_fetch(self, key: str) -> tuple[bytes, list[str]]:
+        try:
+            pipe = self._r.pipeline(transaction=True)  # MULTI: blob and ids from one snapshot
+            pipe.get(key)
+            pipe.lrange(key + ":ids", 0, -1)
+            blob, ids = pipe.execute()
+        except Exception as e:
+            log.warning("cache.redis.vec_fetch_failed", error=str(e))
+            return b"", []
+        return blob or b"", [i.decode() for i in ids or []]
+
+    def vec_tail(self, key: str, seen: int, width: int) -> tuple[int, int, bytes, list[str]] | None:
+        try:
+            total, n, blob, ids = self._vec_tail(keys=[key, key + ":ids", key + ":n"], args=[seen, width])
+        except Exception as e:
+            log.warning("cache.redis.vec_tail_failed", error=str(e))
+            return None
+        return int(total), int(n), blob or b"", [i.decode() for i in ids or []]
+
+    def publish(self, channel: str, message: str) -> None:
+        try:
+            self._r.publish(channel, message)
+        except Exception as e:
+            log.warning("cache.redis.publish_failed", error=str(e))
+
+    def listen(self, channel: str, on_message: Callable[[str], None], on_subscribed: Callable[[], None]) -> None:
+        """Call ``on_message`` for each message on ``channel`` from a daemon
+        thread, resubscribing after errors; ``on_subscribed`` runs each time
+        the subscription is (re)established, since messages may have been lost."""
+        import redis  # type: ignore
+
+        def _run() -> None:
+            # Own client without socket_timeout: a subscriber idles on its socket.
+            client = redis.Redis.from_url(self._url)
+            while True:
+                try:
+                    pubsub = client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(channel)
+                    on_subscribed()
+                    for msg in pubsub.listen():
+                        if msg.get("type") == "message":
+                            on_message(msg["data"].decode())
+                except Exception as e:
+                    log.warning("cache.redis.subscribe_failed", channel=channel, error=str(e))
+                    time.sleep(1.0)
+
+        threading.Thread(target=_run, name="cache-invalidate", daemon=True).start()
+
+
+# ---------- Two-tier: in-process L1 over Redis ------------------------------------
+
+_L1_MAX_ENTRIES = int(os.getenv("L1_CACHE_MAX_ENTRIES", "4096"))
+_L1_TTL = float(os.getenv("L1_CACHE_TTL", "5"))
+_INVALIDATE_CHANNEL = "docai:cache:invalidate"
+_ABSENT = object()  # L1 remembers L2 misses too (the common case for answers)
+_L2_ONLY_PREFIX = "docai:emb:"  # embedding vectors: see ``_TieredBackend``
+
+
+def _tiered(keys: Iterable[str]) -> list[str]:
+    return [k for k in keys if not k.startswith(_L2_ONLY_PREFIX)]
+
+
+class _TieredBackend:
+    """Bounded, short-TTL process-local LRU in front of a shared L2 (Redis).
+
+    Reads of string keys and counters are served from L1 when fresh; L2 misses
+    are remembered too. Every write goes through to L2 and is published on
+    ``_INVALIDATE_CHANNEL``; each process drops the named keys from its L1 on
+    receipt, so peers see a write on their next read rather than after the TTL.
+    A fill is skipped when an invalidation arrived while its L2 read was in
+    flight, and L1 stays off until the subscription is up (and is flushed
+    whenever it is re-established), so a lost message costs at most one TTL.
+    Semantic vector ops pass straight through: the ANN mirror is their L1.
+    So do embedding vectors (``_L2_ONLY_PREFIX`` keys): an ingest writes
+    thousands of them, each read back at most once per process, so an L1
+    copy would only evict answer, generation and job keys, and publishing
+    them would flood every peer for content-addressed values that never go
+    stale.
+    """
+
+    def __init__(self, l2: Any, *, max_entries: int = _L1_MAX_ENTRIES, ttl: float = _L1_TTL) -> None:
+        self._l2 = l2
+        self._max = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._l1: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._epoch = 0
+        self._live = False
+        self._origin = f"{os.getpid()}:{id(self)}"
+        self._pid = 0
+        self._subscribe()
+
+    def _subscribe(self) -> None:
+        # Threads don't survive fork: a worker re-subscribes on first use.
+        self._pid = os.getpid()
+        self._live = False
+        self._origin = f"{self._pid}:{id(self)}"
+        self._l2.listen(_INVALIDATE_CHANNEL, self._on_message, self._on_subscribed)
+
+    def _on_subscribed(self) -> None:
+        with self._lock:
+            self._l1.clear()
+            self._epoch += 1
+            self._live = True
+
+    def _on_message(self, message: str) -> None:
+        origin, _, keys = message.partition("\n")
+        if origin == self._origin:
+            return
+        with self._lock:
+            self._epoch += 1
+            for key in keys.split("\n"):
+                self._l1.pop(key, None)
+
+    def _lookup(self, key: str) -> Any:
+        hit = self._l1.get(key)
+        if hit is None or hit[0] < time.monotonic():
+            return None
+        self._l1.move_to_end(key)
+        return hit
+
+    def _fill(self, items: dict[str, Any], epoch: int) -> None:
+        with self._lock:
+            if not self._live or epoch != self._epoch:
+                return
+            expires = time.monotonic() + self._ttl
+            for key, value in items.items():
+                self._l1[key] = (expires, _ABSENT if value is None else value)
+                self._l1.move_to_end(key)
+            while len(self._l1) > self._max:
+                self._l1.popitem(last=False)
+
+    def _written(self, items: dict[str, Any]) -> None:
+        items = {k: items[k] for k in _tiered(items)}
+        if not items:
+            return
+        with self._lock:
+            self._epoch += 1
+            for key in items:
+                self._l1.pop(key, None)
+        self._l2.publish(_INVALIDATE_CHANNEL, "\n".join([self._origin, *items]))
+        self._fill(items, self._epoch)
+
+    def mget(self, keys: list[str]) -> list[bytes | None]:
+        from metrics import CACHE_TIER_LOOKUPS
+
+        if os.getpid() != self._pid:
+            self._subscribe()
+        tiered = _tiered(keys)
+        if not tiered:
+            return self._l2.mget(keys)
+        found: dict[str, Any] = {}
+        with self._lock:
+            epoch = self._epoch
+            for key in tiered:
+                hit = self._lookup(key)
+                if hit is not None:
+                    found[key] = hit[1]
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        n_l1_hit = len(tiered) - sum(k not in found for k in tiered)
+        CACHE_TIER_LOOKUPS.labels(tier="l1", result="hit").inc(n_l1_hit)
+        CACHE_TIER_LOOKUPS.labels(tier="l1", result="miss").inc(len(tiered) - n_l1_hit)
+        if missing:
+            fetched = dict(zip(missing, self._l2.mget(missing)))
+            n_hit = sum(v is not None for v in fetched.values())
+            CACHE_TIER_LOOKUPS.labels(tier="l2", result="hit").inc(n_hit)
+            CACHE_TIER_LOOKUPS.labels(tier="l2", result="miss").inc(len(missing) - n_hit)
+            self._fill({k: fetched[k] for k in _tiered(fetched)}, epoch)
+            found.update(fetched)
+        return [None if found[k] is _ABSENT else found[k] for k in keys]
+
+    def get(self, key: str) -> bytes | None:
+        return self.mget([key])[0]
+
+    def set(self, key: str, value: bytes, ttl: int) -> None:
+        self._l2.set(key, value, ttl)
+        self._written({key: value})
+
+    def mset(self, items: dict[str, bytes], ttl: int) -> None:
+        if not items:
+            return
+        self._l2.mset(items, ttl)
+        self._written(items)
+
+    def counter(self, key: str) -> int | None:
+        if os.getpid() != self._pid:
+            self._subscribe()
+        with self._lock:
+            epoch = self._epoch
+            hit = self._lookup(key)
+        if hit is not None:
+            return hit[1]
+        value = self._l2.counter(key)
+        if value is not None:  # a failed read must not be served from L1 for a TTL
+            self._fill({key: value}, epoch)
+        return value
+
+    def incr(self, key: str) -> int | None:
+        value = self._l2.incr(key)
+        if value is not None:
+            self._written({key: value})
+        return value
+
+    def vec_append(self, key: str, member: str, row: bytes, *, max_rows: int, ttl: int) -> None:
+        self._l2.vec_append(key, member, row, max_rows=max_rows, ttl=ttl)
+
+    def vec_fetch(self, key: str) -> tuple[bytes, list[str]]:
+        return self._l2.vec_fetch(key)
+
+    def vec_tail(self, key: str, seen: int, width: int) -> tuple[int, int, bytes, list[str]] | None:
+        return self._l2.vec_tail(key, seen, width)
 
 
 # ---------- Public façade ---------------------------------------------------------
@@ -124,7 +602,9 @@ def _select_backend() -> CacheBackend:
     try:
         backend = _RedisBackend(url)
         backend._r.ping()  # type: ignore[attr-defined]
-        log.info("cache.backend", kind="redis", url=url)
+        log.info("cache.backend", kind="redis", url=url, l1_entries=_L1_MAX_ENTRIES, l1_ttl_s=_L1_TTL)
+        if _L1_MAX_ENTRIES > 0:
+            return _TieredBackend(backend)
         return backend
     except Exception as e:
         log.warning("cache.redis.unavailable_fallback_memory", error=str(e))
@@ -141,9 +621,13 @@ def _b() -> CacheBackend:
     return _backend
 
 
-def _key(parts: Iterable[Any]) -> str:
+def _key(parts: Iterable[Any], prefix: str = "docai:") -> str:
     raw = json.dumps(list(parts), sort_keys=True, default=str).encode()
-    return "docai:" + hashlib.sha256(raw).hexdigest()
+    return prefix + hashlib.sha256(raw).hexdigest()
+
+
+def _emb_key(model_name: str, key: str) -> str:
+    return _key(["emb", model_name, key], prefix=_L2_ONLY_PREFIX)
 
 
 @dataclass(frozen=True)
@@ -154,29 +638,50 @@ class CachedAnswer:
     ts: float
 
 
+def _gen_key(user_id: str | None) -> str:
+    return _key(["gen", user_id or "_anon"])
+
+
+def generation(user_id: str | None) -> int | None:
+    """The namespace's index generation; part of every answer / semantic key.
+
+    None when the backend can't be read. Callers then bypass the cache for the
+    request: guessing a generation could serve answers from a retired corpus.
+    """
+    return _b().counter(_gen_key(user_id))
+
+
+def _answer_key(user_id: str | None, gen: int, query: str, top_k: int) -> str:
+    return _key(["answer", user_id or "_anon", gen, query.strip().lower(), top_k])
+
+
 def get_exact(user_id: str | None, query: str, top_k: int) -> CachedAnswer | None:
     from metrics import CACHE_HIT, CACHE_MISS  # late import: avoids boot-order coupling
 
-    raw = _b().get(_key(["answer", user_id or "_anon", query.strip().lower(), top_k]))
-    if not raw:
+    gen = generation(user_id)
+    if gen is None:
         CACHE_MISS.labels(layer="exact").inc()
         return None
+    data = decode_value(_b().get(_answer_key(user_id, gen, query, top_k)))
     try:
-        data = json.loads(raw)
-        CACHE_HIT.labels(layer="exact").inc()
-        return CachedAnswer(**data)
-    except (ValueError, TypeError):
+        answer = CachedAnswer(**data)
+    except TypeError:  # miss (None) or a payload of another shape
         CACHE_MISS.labels(layer="exact").inc()
         return None
+    CACHE_HIT.labels(layer="exact").inc()
+    return answer
 
 
 def set_exact(
     user_id: str | None, query: str, top_k: int, answer: str, sources: list[str]
 ) -> None:
+    gen = generation(user_id)
+    if gen is None:
+        return
     payload = CachedAnswer(query=query, answer=answer, sources=sources, ts=time.time())
     _b().set(
-        _key(["answer", user_id or "_anon", query.strip().lower(), top_k]),
-        json.dumps(payload.__dict__),
+        _answer_key(user_id, gen, query, top_k),
+        encode_value(payload.__dict__),
         DEFAULT_TTL,
     )
 
@@ -184,56 +689,166 @@ def set_exact(
 # ---------- Semantic cache --------------------------------------------------------
 
 
-def _vec_key(user_id: str | None) -> str:
-    return _key(["sem-idx", user_id or "_anon"])
+def _vec_key(user_id: str | None, gen: int) -> str:
+    return _key(["sem-vecs", user_id or "_anon", gen])
 
 
-def _entry_key(user_id: str | None, h: str) -> str:
-    return _key(["sem-entry", user_id or "_anon", h])
+def _entry_key(user_id: str | None, gen: int, h: str) -> str:
+    return _key(["sem-entry", user_id or "_anon", gen, h])
 
 
 def _hash_vec(v: np.ndarray) -> str:
     return hashlib.sha1(v.astype("float32").tobytes(), usedforsecurity=False).hexdigest()
 
 
+def _unit(v: np.ndarray) -> np.ndarray:
+    q = v.astype("float32").flatten()
+    return q / (np.linalg.norm(q) + 1e-12)
+
+
+class _SemanticMirror:
+    """In-process FAISS copy of one namespace's packed semantic rows.
+
+    Rows only ever arrive at the tail and leave from the head (trimmed past
+    ``SEMANTIC_MAX_ENTRIES`` or older than ``SEMANTIC_TTL``), so the index is
+    append-only with a dead prefix that searches skip via an id-range
+    selector; it is rebuilt from the live rows once that prefix is the larger
+    half. ``seen`` is the namespace's appended-row count at the last sync.
+    """
+
+    def __init__(self, key: str, dim: int) -> None:
+        self.key = key
+        self.dim = dim
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.seen = 0
+        self.start = 0
+        self.ids: list[str] = []
+        self.born = np.zeros(0, dtype="float64")
+        self.index = self._new_index()
+
+    def _new_index(self):
+        import faiss  # type: ignore
+
+        if SEMANTIC_ANN_INDEX == "hnsw":
+            return faiss.IndexHNSWFlat(self.dim, 32, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexFlatIP(self.dim)
+
+    def nbytes(self) -> int:
+        return self.index.ntotal * self.dim * 4 + len(self.ids) * 64
+
+    def sync(self, total: int, retained: int, blob: bytes, ids: list[str]) -> None:
+        if self.seen > total or total - self.seen >= max(retained, 1):
+            self._reset()  # missed rows (or the key restarted): reload all retained
+        if ids:
+            rows = np.frombuffer(blob, dtype=_SEMANTIC_DTYPE).reshape(len(ids), self.dim)
+            self.index.add(np.ascontiguousarray(rows, dtype="float32"))
+            self.ids += ids
+            self.born = np.concatenate([self.born, [_member_ts(m) for m in ids]])
+        self.seen = total
+        self.start = max(self.start, len(self.ids) - min(retained, SEMANTIC_MAX_ENTRIES))
+        self.start = max(self.start, int(np.searchsorted(self.born, time.time() - SEMANTIC_TTL)))
+        if self.start and self.start * 2 >= len(self.ids):
+            self._compact()
+
+    def _compact(self) -> None:
+        live = self.index.reconstruct_n(self.start, len(self.ids) - self.start)
+        self.index = self._new_index()
+        self.index.add(live)
+        self.ids = self.ids[self.start :]
+        self.born = self.born[self.start :]
+        self.start = 0
+
+    def search(self, q: np.ndarray, k: int) -> list[tuple[float, str]]:
+        import faiss  # type: ignore
+
+        live = len(self.ids) - self.start
+        if live <= 0:
+            return []
+        params = faiss.SearchParameters(sel=faiss.IDSelectorRange(self.start, len(self.ids)))
+        sims, pos = self.index.search(q[None, :], min(k, live), params=params)
+        return [(float(sim), self.ids[p]) for sim, p in zip(sims[0], pos[0]) if p >= 0]
+
+
+def _member_ts(member: str) -> float:
+    _, _, ts = member.partition("@")
+    return float(ts) if ts else time.time()
+
+
+def _member_hash(member: str) -> str:
+    return member.partition("@")[0]
+
+
+def _ann_candidates(user_id: str | None, vkey: str, q: np.ndarray) -> tuple[list[tuple[float, str]], int]:
+    from rag.namespace_cache import get_cache
+
+    namespace = user_id or "_anon"
+    mirrors = get_cache()
+    mirror = mirrors.get(namespace, "semantic")
+    if mirror is None or mirror.key != vkey or mirror.dim != len(q):
+        mirror = _SemanticMirror(vkey, len(q))  # first use, new generation or new model
+    with mirror.lock:
+        tail = _b().vec_tail(vkey, mirror.seen, len(q) * _SEMANTIC_DTYPE.itemsize)
+        if tail is not None:
+            mirror.sync(*tail)
+        hits = mirror.search(q, _ANN_CANDIDATES)
+        size = len(mirror.ids) - mirror.start
+    mirrors.put(namespace, "semantic", mirror, mirror.nbytes())
+    return hits, size
+
+
+def _scan_candidates(vkey: str, q: np.ndarray) -> tuple[list[tuple[float, str]], int]:
+    blob, ids = _b().vec_fetch(vkey)
+    if not ids or len(blob) != len(ids) * len(q) * _SEMANTIC_DTYPE.itemsize:
+        return [], 0
+    if len(ids) > SEMANTIC_MAX_ENTRIES:  # stored rows include the trim slack
+        blob = blob[-SEMANTIC_MAX_ENTRIES * len(q) * _SEMANTIC_DTYPE.itemsize :]
+        ids = ids[-SEMANTIC_MAX_ENTRIES:]
+    sims = np.frombuffer(blob, dtype=_SEMANTIC_DTYPE).reshape(len(ids), len(q)).astype("float32") @ q
+    order = np.argsort(-sims, kind="stable")[:_ANN_CANDIDATES]
+    return [(float(sims[i]), ids[i]) for i in order], len(ids)
+
+
+def _ann_available() -> bool:
+    return importlib.util.find_spec("faiss") is not None
+
+
 def semantic_get(
     user_id: str | None, query_embedding: np.ndarray
 ) -> CachedAnswer | None:
     """Return a cached answer whose query embedding is cosine-close to this one."""
-    q = query_embedding.astype("float32").flatten()
-    q /= np.linalg.norm(q) + 1e-12
+    from metrics import CACHE_HIT, CACHE_MISS
 
-    members = _b().zrange(_vec_key(user_id), count=64)
-    if not members:
+    gen = generation(user_id)
+    if gen is None:
+        CACHE_MISS.labels(layer="semantic").inc()
         return None
-
-    best: tuple[float, CachedAnswer] | None = None
-    for m in members:
-        raw = _b().get(_entry_key(user_id, m))
-        if not raw:
+    q = _unit(query_embedding)
+    vkey = _vec_key(user_id, gen)
+    if SEMANTIC_ANN and _ann_available():
+        candidates, scanned = _ann_candidates(user_id, vkey, q)
+    else:
+        candidates, scanned = _scan_candidates(vkey, q)
+    # Best first; an entry can expire before its row is trimmed, so fall through.
+    close = [(sim, m) for sim, m in candidates if sim >= SEMANTIC_SIM_THRESHOLD]
+    for (sim, _), raw in zip(close, _b().mget([_entry_key(user_id, gen, _member_hash(m)) for _, m in close])):
+        entry = decode_value(raw)
+        if not entry:
             continue
         try:
-            entry = json.loads(raw)
-            emb = np.array(entry["emb"], dtype="float32")
-        except (ValueError, TypeError, KeyError):
-            continue
-        sim = float(np.dot(q, emb))
-        if sim >= SEMANTIC_SIM_THRESHOLD and (best is None or sim > best[0]):
-            best = (
-                sim,
-                CachedAnswer(
-                    query=entry["query"],
-                    answer=entry["answer"],
-                    sources=entry.get("sources", []),
-                    ts=entry.get("ts", 0.0),
-                ),
+            answer = CachedAnswer(
+                query=entry["query"],
+                answer=entry["answer"],
+                sources=entry.get("sources", []),
+                ts=entry.get("ts", 0.0),
             )
-    from metrics import CACHE_HIT, CACHE_MISS
-
-    if best:
+        except (TypeError, KeyError):
+            continue
         CACHE_HIT.labels(layer="semantic").inc()
-        log.info("cache.semantic.hit", sim=round(best[0], 4))
-        return best[1]
+        log.info("cache.semantic.hit", sim=round(sim, 4), scanned=scanned)
+        return answer
     CACHE_MISS.labels(layer="semantic").inc()
     return None
 
@@ -245,21 +860,33 @@ def semantic_set(
     answer: str,
     sources: list[str],
 ) -> None:
-    q = query_embedding.astype("float32").flatten()
-    q /= np.linalg.norm(q) + 1e-12
+    gen = generation(user_id)
+    if gen is None:
+        return
+    q = _unit(query_embedding)
     h = _hash_vec(q)
+    now = time.time()
     entry = {
         "query": query,
         "answer": answer,
         "sources": sources,
-        "emb": q.tolist(),
-        "ts": time.time(),
+        "ts": now,
     }
-    _b().set(_entry_key(user_id, h), json.dumps(entry), SEMANTIC_TTL)
-    _b().zadd(_vec_key(user_id), h, time.time())
+    _b().set(_entry_key(user_id, gen, h), encode_value(entry), SEMANTIC_TTL)
+    _b().vec_append(
+        _vec_key(user_id, gen),
+        f"{h}@{int(now)}",
+        q.astype(_SEMANTIC_DTYPE).tobytes(),
+        max_rows=SEMANTIC_MAX_ENTRIES,
+        ttl=SEMANTIC_TTL,
+    )
 
 
 def invalidate_user(user_id: str | None) -> None:
-    """Best-effort invalidation on re-ingest; in-memory relies on TTL expiry."""
-    # TODO: implement proper prefix deletion via Redis SCAN.
-    log.info("cache.invalidate", user_id=user_id)
+    """Retire the namespace's cached answers after its index changed: one
+    increment of its generation; the old entries expire on their own."""
+    gen = _b().incr(_gen_key(user_id))
+    if gen is None:
+        log.error("cache.invalidate_failed", user_id=user_id)
+        return
+    log.info("cache.invalidate", user_id=user_id, generation=gen)
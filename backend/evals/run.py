@@ -3,8 +3,17 @@
     python -m evals.run                            # retrieval-only over all rows
     python -m evals.run --judge                    # + LLM-as-judge (needs OPENAI_API_KEY)
     python -m evals.run --smoke --baseline-check   # CI smoke, fails on Recall@5 drop
+    python -m evals.run --parity-with results/<run>.json   # fails if Recall@5 trails that run
+    python -m evals.run --output results/torch.json         # fixed record path instead of a timestamp
 
-Writes a JSON record and a Markdown summary under ``evals/results/``.
+``--parity-with`` compares against an earlier run's JSON record instead of the
+checked-in baseline: run once on the PyTorch models, then again with
+``EMBEDDING_BACKEND=onnx RERANKER_BACKEND=onnx`` and the first record, and the
+quantized models must keep Recall@5 within ``_BASELINE_TOLERANCE``.
+
+Writes a JSON record and a Markdown summary under ``evals/results/``, named
+by timestamp unless ``--output`` gives the JSON path (the Markdown goes next
+to it).
 """
 from __future__ import annotations
 
@@ -52,6 +61,8 @@ class RowResult:
     recall_at_5: float
     reciprocal_rank: float
     hit: float
+    rerank_depth: Optional[int] = None
+    rerank_decision: Optional[str] = None
     predicted_answer: Optional[str] = None
     judge_score: Optional[int] = None
     judge_reason: Optional[str] = None
@@ -92,9 +103,10 @@ def _ingest(docs: Dict[str, str]) -> None:
 
 
 def _run_row(row: dict, *, judge: bool) -> RowResult:
-    from rag.retrieve import retrieve_top_chunks
+    from rag.retrieve import retrieve
 
-    chunks = retrieve_top_chunks(row["question"], top_k=_TOP_K, user_id=_EVAL_NAMESPACE)
+    trace: dict = {}
+    chunks = retrieve(row["question"], top_k=_TOP_K, user_id=_EVAL_NAMESPACE, trace=trace)
     retrieved_sources = [c["source"] for c in chunks]
     expected = row["source_docs"]
 
@@ -107,6 +119,8 @@ def _run_row(row: dict, *, judge: bool) -> RowResult:
         recall_at_5=recall_at_k(retrieved_sources, expected, k=5),
         reciprocal_rank=reciprocal_rank(retrieved_sources, expected),
         hit=hit_rate(retrieved_sources, expected),
+        rerank_depth=trace.get("rerank_depth"),
+        rerank_decision=trace.get("rerank_decision"),
     )
 
     if judge:
@@ -134,6 +148,11 @@ def _summary(rows: List[RowResult]) -> Dict[str, float]:
         }
         for r in dicts
     ])
+    # Rerank cost side of the adaptive-depth trade-off, next to the recall it buys.
+    depths = [r["rerank_depth"] for r in dicts if r["rerank_depth"] is not None]
+    if depths:
+        agg["rerank_depth_mean"] = sum(depths) / len(depths)
+        agg["rerank_skip_rate"] = sum(r["rerank_decision"] == "skip" for r in dicts) / len(depths)
     judge_scores = [r["judge_score"] for r in dicts if r["judge_score"] is not None]
     if judge_scores:
         agg["judge_mean"] = sum(judge_scores) / len(judge_scores)
@@ -158,23 +177,34 @@ def _render_markdown(summary: Dict[str, float], rows: List[RowResult], meta: Dic
         f"| MRR | {summary.get('reciprocal_rank', 0):.3f} |",
         f"| Hit rate (top-{_TOP_K}) | {summary.get('hit', 0):.3f} |",
     ]
+    if "rerank_depth_mean" in summary:
+        lines.append(f"| Rerank depth (mean) | {summary['rerank_depth_mean']:.1f} |")
+        lines.append(f"| Rerank skipped | {summary['rerank_skip_rate']:.3f} |")
     if "judge_mean" in summary:
         lines.append(f"| LLM-judge mean (0-5) | {summary['judge_mean']:.2f} (n={int(summary['judge_n'])}) |")
-    lines += ["", "## Per-row", "", "| id | Recall@1 | Recall@5 | RR | Judge |", "|---|---|---|---|---|"]
+    lines += [
+        "",
+        "## Per-row",
+        "",
+        "| id | Recall@1 | Recall@5 | RR | Rerank | Judge |",
+        "|---|---|---|---|---|---|",
+    ]
     for r in rows:
         judge_cell = "–" if r.judge_score is None else str(r.judge_score)
+        rerank_cell = "–" if r.rerank_decision is None else f"{r.rerank_decision} ({r.rerank_depth})"
         lines.append(
             f"| {r.id} | {r.recall_at_1:.2f} | {r.recall_at_5:.2f} | "
-            f"{r.reciprocal_rank:.2f} | {judge_cell} |"
+            f"{r.reciprocal_rank:.2f} | {rerank_cell} | {judge_cell} |"
         )
     return "\n".join(lines) + "\n"
 
 
-def _write_results(summary: Dict[str, float], rows: List[RowResult], meta: Dict) -> Path:
-    _RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-    ts = meta["timestamp"]
-    json_path = _RESULTS_DIR / f"{ts}.json"
-    md_path = _RESULTS_DIR / f"{ts}.md"
+def _write_results(
+    summary: Dict[str, float], rows: List[RowResult], meta: Dict, output: Optional[Path] = None
+) -> Path:
+    json_path = Path(output) if output is not None else _RESULTS_DIR / f"{meta['timestamp']}.json"
+    md_path = json_path.with_suffix(".md")
+    json_path.parent.mkdir(parents=True, exist_ok=True)
     payload = {"meta": meta, "summary": summary, "rows": [asdict(r) for r in rows]}
     json_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
     md_path.write_text(_render_markdown(summary, rows, meta), encoding="utf-8")
@@ -199,12 +229,40 @@ def _baseline_check(summary: Dict[str, float]) -> bool:
     return ok
 
 
+def _parity_check(summary: Dict[str, float], reference_path: Path) -> bool:
+    reference = json.loads(Path(reference_path).read_text(encoding="utf-8"))
+    expected = float(reference["summary"].get("recall_at_5", 0.0))
+    observed = float(summary.get("recall_at_5", 0.0))
+    ok = observed >= expected - _BASELINE_TOLERANCE
+    log.info(
+        "evals.parity_check",
+        observed=round(observed, 3),
+        reference=round(expected, 3),
+        reference_models=reference["meta"].get("models"),
+        tolerance=_BASELINE_TOLERANCE,
+        passed=ok,
+    )
+    return ok
+
+
 def main(argv: Optional[List[str]] = None) -> int:
     parser = argparse.ArgumentParser(description="Run the RAG evaluation harness.")
     parser.add_argument("--smoke", action="store_true", help="Run first 5 rows only (CI PR smoke).")
     parser.add_argument("--limit", type=int, default=None, help="Run only the first N rows.")
     parser.add_argument("--judge", action="store_true", help="Run LLM-as-judge pass (costs OpenAI tokens).")
     parser.add_argument("--baseline-check", action="store_true", help="Exit non-zero if Recall@5 drops below baseline.")
+    parser.add_argument(
+        "--parity-with",
+        type=Path,
+        default=None,
+        help="Earlier run's JSON record; exit non-zero if Recall@5 trails it by more than the tolerance.",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Write the JSON record here (Markdown alongside) instead of a timestamped file.",
+    )
     args = parser.parse_args(argv)
 
     limit = 5 if args.smoke else args.limit
@@ -213,6 +271,11 @@ def main(argv: Optional[List[str]] = None) -> int:
 
     _ingest(_load_docs())
 
+    from rag.models import loaded_models, warmup
+
+    # Load the reranker before timing so elapsed_seconds measures retrieval only.
+    warmup()
+
     t0 = time.time()
     results: list[RowResult] = []
     for row in rows_in:
@@ -226,13 +289,17 @@ def main(argv: Optional[List[str]] = None) -> int:
         "mode": "smoke" if args.smoke else ("full+judge" if args.judge else "full"),
         "elapsed_seconds": round(elapsed, 2),
         "top_k": _TOP_K,
+        "rerank_adaptive": os.getenv("RERANK_ADAPTIVE", "1") == "1",
+        "models": {role: asdict(stats) for role, stats in loaded_models().items()},
     }
-    json_path = _write_results(summary, results, meta)
+    json_path = _write_results(summary, results, meta, args.output)
     log.info("evals.done", summary=summary, output=str(json_path))
     print(json.dumps({"summary": summary, "output": str(json_path)}, indent=2))
 
     if args.baseline_check and not _baseline_check(summary):
         return 1
+    if args.parity_with is not None and not _parity_check(summary, args.parity_with):
+        return 1
     return 0
 
 
@@ -6,6 +6,11 @@ timeout and shutdown tuning so the Dockerfile CMD stays declarative.
 ``graceful_timeout`` covers clean rollouts: on SIGTERM, gunicorn stops
 accepting new connections and lets in-flight requests finish (up to 30s,
 enough for the slowest synchronous chat request) before killing workers.
+
+``GUNICORN_PRELOAD=1`` imports the app and loads the embedder + reranker in
+the master before forking, so workers share the weights copy-on-write instead
+of each loading a copy. Workers then run torch with ``TORCH_NUM_THREADS``
+(default 1) intra-op threads.
 """
 from __future__ import annotations
 
@@ -21,6 +26,10 @@ timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
 graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
 keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
 
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+# Must be set before any tokenizer runs in the master, or workers can deadlock.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
 accesslog = "-"
 errorlog = "-"
 access_log_format = (
@@ -28,6 +37,28 @@ access_log_format = (
 )
 
 
+def when_ready(server):
+    """Preload mode: load + warm models once in the master, before any fork."""
+    if not preload_app:
+        return
+    from rag.models import prepare_for_fork
+
+    for role, stats in prepare_for_fork().items():
+        server.log.info(
+            f"preloaded {role} {stats.name} in {stats.load_seconds:.1f}s "
+            f"({stats.resident_bytes / 2**20:.0f} MiB)"
+        )
+
+
+def post_fork(server, worker):
+    # Without preload the app (and sys.path setup) isn't imported yet here.
+    if not preload_app:
+        return
+    from rag.models import after_fork
+
+    after_fork()
+
+
 def worker_exit(server, worker):
     """Flush OTel spans before the worker dies so traces aren't lost on rollout."""
     try:
@@ -1,6 +1,6 @@
 """Prometheus metrics: HTTP histograms via prometheus-flask-exporter plus a few
-business counters (ingestion duration, cache hits, credit burn, external
-retries). No-ops if prometheus-client isn't installed.
+business counters (ingestion duration, cache hits and tiers, credit burn, external
+retries) and model-registry / model-server / ingest-embedding / namespace-cache / retrieval-leg / rerank-policy metrics. No-ops if prometheus-client isn't installed.
 """
 from __future__ import annotations
 
@@ -17,7 +17,7 @@ class _NoopMetric:
 
 
 try:
-    from prometheus_client import Counter, Histogram
+    from prometheus_client import Counter, Gauge, Histogram
 
     INGESTION_DURATION = Histogram(
         "docai_ingestion_duration_seconds",
@@ -26,7 +26,7 @@ try:
     )
     CACHE_HIT = Counter(
         "docai_cache_hit_total",
-        "Cache hits, labelled by layer (exact|semantic).",
+        "Cache hits, labelled by layer (exact|semantic|embedding|rerank).",
         ["layer"],
     )
     CACHE_MISS = Counter(
@@ -34,6 +34,11 @@ try:
         "Cache misses, labelled by layer.",
         ["layer"],
     )
+    CACHE_TIER_LOOKUPS = Counter(
+        "docai_cache_tier_lookups_total",
+        "Key lookups in the two-tier cache, labelled by tier (l1|l2) and result (hit|miss).",
+        ["tier", "result"],
+    )
     CREDIT_BURN = Counter(
         "docai_credit_burn_total",
         "Credits charged, labelled by route (chat|chat_upload).",
@@ -44,12 +49,83 @@ try:
         "Retry attempts against external services (openai|stripe|qdrant|s3).",
         ["service"],
     )
+    MODEL_LOAD_SECONDS = Gauge(
+        "docai_model_load_seconds",
+        "Wall time to load a model into this process, labelled by model (embedder|reranker).",
+        ["model"],
+    )
+    MODEL_RESIDENT_BYTES = Gauge(
+        "docai_model_resident_bytes",
+        "Parameter bytes held by a loaded model, labelled by model.",
+        ["model"],
+    )
+    MODEL_BATCH_SIZE = Histogram(
+        "docai_model_batch_size",
+        "Items per micro-batch run by the model server, labelled by model.",
+        ["model"],
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+    )
+    EMBED_CHUNKS_PER_SECOND = Gauge(
+        "docai_embed_chunks_per_second",
+        "Ingest embedding throughput of the most recent length-bucketed encode call.",
+    )
+    EMBED_PADDING_RATIO = Histogram(
+        "docai_embed_padding_ratio",
+        "Share of padded token positions per length-bucketed encode call.",
+        buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75),
+    )
+    NAMESPACE_CACHE_NAMESPACES = Gauge(
+        "docai_namespace_cache_namespaces",
+        "Namespaces with FAISS / BM25 indexes resident in this process.",
+    )
+    NAMESPACE_CACHE_BYTES = Gauge(
+        "docai_namespace_cache_bytes",
+        "Bytes accounted to resident namespace indexes in this process.",
+    )
+    NAMESPACE_CACHE_EVICTIONS = Counter(
+        "docai_namespace_cache_evictions_total",
+        "Namespaces evicted from the in-process index cache to stay under budget.",
+    )
+    RETRIEVAL_LEG_SECONDS = Histogram(
+        "docai_retrieval_leg_seconds",
+        "Latency of one retrieval leg, labelled by leg (vector|bm25). The vector leg includes query embedding.",
+        ["leg"],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    )
+    RETRIEVAL_LEG_TIMEOUTS = Counter(
+        "docai_retrieval_leg_timeouts_total",
+        "Retrieval legs dropped for missing RETRIEVE_LEG_TIMEOUT, labelled by leg.",
+        ["leg"],
+    )
+    RERANK_DECISIONS = Counter(
+        "docai_rerank_decisions_total",
+        "Adaptive rerank decisions, labelled by decision (full|partial|skip|off) and reason.",
+        ["decision", "reason"],
+    )
+    RERANK_DEPTH = Histogram(
+        "docai_rerank_depth",
+        "Fused candidates sent to the cross-encoder per query (0 when skipped).",
+        buckets=(0, 5, 10, 15, 20, 30, 40, 50, 100),
+    )
 except ImportError:
     INGESTION_DURATION = _NoopMetric()
     CACHE_HIT = _NoopMetric()
     CACHE_MISS = _NoopMetric()
+    CACHE_TIER_LOOKUPS = _NoopMetric()
     CREDIT_BURN = _NoopMetric()
     EXTERNAL_RETRY = _NoopMetric()
+    MODEL_LOAD_SECONDS = _NoopMetric()
+    MODEL_RESIDENT_BYTES = _NoopMetric()
+    MODEL_BATCH_SIZE = _NoopMetric()
+    EMBED_CHUNKS_PER_SECOND = _NoopMetric()
+    EMBED_PADDING_RATIO = _NoopMetric()
+    NAMESPACE_CACHE_NAMESPACES = _NoopMetric()
+    NAMESPACE_CACHE_BYTES = _NoopMetric()
+    NAMESPACE_CACHE_EVICTIONS = _NoopMetric()
+    RETRIEVAL_LEG_SECONDS = _NoopMetric()
+    RETRIEVAL_LEG_TIMEOUTS = _NoopMetric()
+    RERANK_DECISIONS = _NoopMetric()
+    RERANK_DEPTH = _NoopMetric()
     log.info("metrics.client_missing", hint="pip install prometheus-client")
 
 
@@ -0,0 +1,565 @@
+"""Vectorised BM25 (Okapi / ATIRE variant) over a CSR term → document matrix,
+persisted as a versioned, memory-mappable ``bm25.bin``.
+
+Matches ``rank_bm25.BM25Okapi`` scoring: ``k1=1.5``, ``b=0.75``, and terms whose
+IDF would go negative get ``epsilon × mean IDF`` instead. A query scatter-adds
+``idf · tf·(k1+1) / (tf + norm)`` over each query term's posting list into a
+score vector (``norm = k1·(1 − b + b·dl/avgdl)`` is stored per document), and
+top-k is an ``argpartition`` instead of a full sort.
+
+File (``rag.colfile``, magic ``DOCBM25\\0``, header ``version``/``k1``/``b``/
+``n_docs``): ``terms`` (UTF-8 blob, byte-sorted) + ``term_off``,
+``indptr``, postings ``docs`` / ``tf``, per-term ``idf``, per-document
+``doc_len`` / ``norm`` / ``rows`` (the document's stable chunk id). Opening maps
+the file; nothing is parsed but the header.
+
+``BM25Segments`` layers in-place updates over that base file: each ingest adds
+a small segment and tombstones removed chunk ids, with the collection
+statistics kept exact, and compaction folds segments back together.
+"""
+from __future__ import annotations
+
+import os
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from rag.colfile import ColumnFile, write_columns
+
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+FORMAT_VERSION = 1
+_MAGIC = b"DOCBM25\0"
+_SEGMENT_FILE = re.compile(r"bm25\.(\d+)\.bin")
+# Longest a query may take between reading the manifest and mapping its files.
+RETIRE_GRACE_SECONDS = 300.0
+
+
+class _MappedTerms:
+    """Term → CSR row by binary search over the byte-sorted term blob."""
+
+    def __init__(self, offsets: np.ndarray, blob: memoryview) -> None:
+        self._off = offsets
+        self._blob = blob
+
+    def _term(self, i: int) -> bytes:
+        return bytes(self._blob[self._off[i] : self._off[i + 1]])
+
+    def get(self, term: str) -> Optional[int]:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self._off) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self._off) - 1 and self._term(lo) == key else None
+
+
+class BM25Index:
+    """Immutable BM25 index; postings for term row ``t`` are
+    ``docs[indptr[t]:indptr[t+1]]`` with matching ``tf``."""
+
+    def __init__(
+        self,
+        terms,  # dict or _MappedTerms: term → row
+        indptr: np.ndarray,
+        docs: np.ndarray,
+        tf: np.ndarray,
+        idf: np.ndarray,
+        doc_len: np.ndarray,
+        norm: np.ndarray,
+        rows: np.ndarray,
+        *,
+        k1: float = K1,
+        b: float = B,
+        buffer=None,
+    ) -> None:
+        self.terms = terms
+        self.indptr = indptr
+        self.docs = docs
+        self.tf = tf
+        self.idf = idf
+        self.doc_len = doc_len
+        self.norm = norm
+        self.rows = rows
+        self.k1 = k1
+        self.b = b
+        self._buffer = buffer  # keeps the mapping alive as long as the views
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def build(
+        cls,
+        corpus: Sequence[Sequence[str]],
+        rows: Optional[Sequence[int]] = None,
+        *,
+        k1: float = K1,
+        b: float = B,
+        epsilon: float = EPSILON,
+    ) -> "BM25Index":
+        """Index ``corpus``; ``rows`` are the documents' chunk ids (default: position)."""
+        vocab: Dict[str, int] = {}
+        term_col: List[int] = []
+        doc_col: List[int] = []
+        tf_col: List[int] = []
+        doc_len = np.zeros(len(corpus), dtype="float32")
+        for d, tokens in enumerate(corpus):
+            doc_len[d] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_col.append(vocab.setdefault(term, len(vocab)))
+                doc_col.append(d)
+                tf_col.append(tf)
+
+        # Renumber terms in byte order so the on-disk vocab can be bisected.
+        ordered = sorted(vocab, key=lambda t: t.encode("utf-8"))
+        rank = np.empty(len(vocab), dtype="int64")
+        rank[[vocab[t] for t in ordered]] = np.arange(len(vocab))
+        terms = rank[np.asarray(term_col, dtype="int64")]
+        order = np.argsort(terms, kind="stable")  # docs stay ascending within a term
+        terms = terms[order]
+
+        n = len(corpus)
+        postings = np.bincount(terms, minlength=len(vocab))  # == document frequency
+        df = postings.astype("float64")
+        idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        avgdl = float(doc_len.mean()) if n else 0.0
+        indptr = np.zeros(len(vocab) + 1, dtype="int64")
+        np.cumsum(postings, out=indptr[1:])
+        return cls(
+            {t: i for i, t in enumerate(ordered)},
+            indptr,
+            np.asarray(doc_col, dtype="int32")[order],
+            np.asarray(tf_col, dtype="float32")[order],
+            idf.astype("float32"),
+            doc_len,
+            (k1 * (1 - b + b * doc_len / (avgdl or 1.0))).astype("float32"),
+            np.asarray(rows if rows is not None else range(n), dtype="int64"),
+            k1=k1,
+            b=b,
+        )
+
+    # ------------------------------------------------------------------ disk
+
+    def write(self, path: str) -> None:
+        """Serialise to ``path`` atomically (temp file + rename)."""
+        if isinstance(self.terms, dict):
+            ordered = sorted(self.terms, key=self.terms.__getitem__)
+            blob = [t.encode("utf-8") for t in ordered]
+            term_off = np.zeros(len(blob) + 1, dtype="<i8")
+            np.cumsum([len(t) for t in blob], out=term_off[1:])
+            term_cols = [("term_off", term_off.tobytes()), ("terms", b"".join(blob))]
+        else:
+            term_cols = [("term_off", self.terms._off.tobytes()), ("terms", bytes(self.terms._blob))]
+        meta = {"version": FORMAT_VERSION, "k1": self.k1, "b": self.b, "n_docs": self.n_docs}
+        write_columns(path, _MAGIC, meta, term_cols + [
+            ("indptr", self.indptr.astype("<i8").tobytes()),
+            ("docs", self.docs.astype("<i4").tobytes()),
+            ("tf", self.tf.astype("<f4").tobytes()),
+            ("idf", self.idf.astype("<f4").tobytes()),
+            ("doc_len", self.doc_len.astype("<f4").tobytes()),
+            ("norm", self.norm.astype("<f4").tobytes()),
+            ("rows", self.rows.astype("<i8").tobytes()),
+        ])
+
+    @classmethod
+    def open(cls, path: str) -> "BM25Index":
+        """Map ``path`` read-only. Raises ValueError for other formats/versions."""
+        f = ColumnFile(path, _MAGIC)
+        if f.header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported BM25 format version {f.header.get('version')}")
+        return cls(
+            _MappedTerms(f.array("term_off", "<i8"), f.raw("terms")),
+            f.array("indptr", "<i8"),
+            f.array("docs", "<i4"),
+            f.array("tf", "<f4"),
+            f.array("idf", "<f4"),
+            f.array("doc_len", "<f4"),
+            f.array("norm", "<f4"),
+            f.array("rows", "<i8"),
+            k1=f.header["k1"],
+            b=f.header["b"],
+            buffer=f.buffer,
+        )
+
+    # ----------------------------------------------------------------- query
+
+    def get_scores(self, query: Sequence[str]) -> np.ndarray:
+        """BM25 score of every document; a repeated query term counts each time."""
+        scores = np.zeros(self.n_docs, dtype="float32")
+        for term, mult in Counter(query).items():
+            t = self.terms.get(term)
+            if t is None:
+                continue
+            lo, hi = self.indptr[t], self.indptr[t + 1]
+            docs, tf = self.docs[lo:hi], self.tf[lo:hi]
+            # A term's postings name each document once, so fancy += is safe.
+            scores[docs] += mult * self.idf[t] * tf * (self.k1 + 1) / (tf + self.norm[docs])
+        return scores
+
+    def top_k(self, query: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Document indices and scores of the ``k`` best documents, best first."""
+        scores = self.get_scores(query)
+        k = min(k, self.n_docs)
+        if k <= 0:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        idx = np.argpartition(-scores, k - 1)[:k] if k < self.n_docs else np.arange(self.n_docs)
+        idx = idx[np.lexsort((idx, -scores[idx]))]  # score desc, then doc order
+        return idx, scores[idx]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            a.nbytes for a in (self.indptr, self.docs, self.tf, self.idf, self.doc_len, self.norm, self.rows)
+        )
+
+
+# ------------------------------------------------------------------ segments
+
+_MANIFEST_MAGIC = b"DOCBM25M"
+
+
+def _idf(df, n: int):
+    return np.log(n - df + 0.5) - np.log(df + 0.5)
+
+
+class BM25Segments:
+    """A namespace's BM25 index as immutable segments plus tombstones.
+
+    The base segment is ``bm25.bin``; each incremental update adds one small
+    ``bm25.<n>.bin`` segment for the new documents and tombstones the stable
+    ids of removed ones. Collection statistics stay exact without touching the
+    existing segments: the live document count and total length are kept in
+    the manifest, a term's document frequency is counted over its live
+    postings at query time, and the mean IDF used for the ``epsilon`` floor
+    comes from a histogram of document frequencies (``df → #terms``), which an
+    update adjusts only for the terms it touches.
+
+    Instances are immutable: ``add`` / ``remove`` return a new one (``add``
+    has already written its segment file), and ``commit`` publishes it by
+    atomically replacing ``bm25.manifest`` — the only commit point. Segment
+    files are write-once under names never reused in the namespace (a full
+    build writes its base as the next ``bm25.<n>.bin`` too), so a reader that
+    opened the previous manifest still finds every file it names; files no
+    longer referenced are deleted only after a grace period. A namespace with
+    a ``bm25.bin`` and no manifest predates this layout and is just that base.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segments: List[Tuple[str, BM25Index]],
+        deleted: np.ndarray,
+        *,
+        n_docs: int,
+        total_len: float,
+        df_hist: Dict[int, int],
+        next_segment: int,
+        epsilon: float = EPSILON,
+    ) -> None:
+        self.directory = directory
+        self.segments = segments
+        self.deleted = deleted  # sorted stable ids
+        self.n_docs = n_docs
+        self.total_len = total_len
+        self.df_hist = {k: v for k, v in df_hist.items() if k > 0 and v > 0}
+        self.next_segment = next_segment
+        self.epsilon = epsilon
+        self._live = [
+            ~np.isin(seg.rows, deleted, assume_unique=True) if len(deleted) else None for _, seg in segments
+        ]
+
+    # ------------------------------------------------------------------ disk
+
+    @staticmethod
+    def base_path(directory: str) -> str:
+        return os.path.join(directory, "bm25.bin")
+
+    @staticmethod
+    def manifest_path(directory: str) -> str:
+        return os.path.join(directory, "bm25.manifest")
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(BM25Segments.manifest_path(directory)) or os.path.exists(
+            BM25Segments.base_path(directory)
+        )
+
+    @classmethod
+    def from_index(
+        cls, directory: str, index: BM25Index, *, name: str = "bm25.bin", next_segment: int = 1
+    ) -> "BM25Segments":
+        """Wrap a freshly built or opened base segment."""
+        df = np.diff(index.indptr)
+        hist = np.bincount(df) if len(df) else np.zeros(0, dtype="int64")
+        return cls(
+            directory,
+            [(name, index)],
+            np.zeros(0, dtype="int64"),
+            n_docs=index.n_docs,
+            total_len=float(index.doc_len.sum(dtype="float64")),
+            df_hist={int(k): int(v) for k, v in enumerate(hist) if v},
+            next_segment=next_segment,
+        )
+
+    @classmethod
+    def build(cls, directory: str, corpus: Sequence[Sequence[str]], rows: Sequence[int]) -> "BM25Segments":
+        """A single-segment state for ``corpus`` under a fresh segment name;
+        ``commit`` publishes it (and retires whatever it replaces)."""
+        n = cls._next_free(directory)
+        name = f"bm25.{n}.bin"
+        BM25Index.build(corpus, rows).write(os.path.join(directory, name))
+        return cls.from_index(directory, BM25Index.open(os.path.join(directory, name)), name=name, next_segment=n + 1)
+
+    @classmethod
+    def _next_free(cls, directory: str) -> int:
+        header = cls._read_header(directory)
+        n = header["next_segment"] if header else 0
+        for name in os.listdir(directory):
+            m = _SEGMENT_FILE.fullmatch(name)
+            if m:
+                n = max(n, int(m.group(1)) + 1)
+        return n
+
+    @classmethod
+    def _read_header(cls, directory: str) -> Optional[Dict]:
+        try:
+            return ColumnFile(cls.manifest_path(directory), _MANIFEST_MAGIC).header
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def open(cls, directory: str) -> Optional["BM25Segments"]:
+        """Map the namespace's segments; None if it has no BM25 index."""
+        for attempt in range(3):
+            try:
+                return cls._open(directory)
+            except FileNotFoundError:
+                # A manifest read just before its files were retired: reread.
+                if attempt == 2:
+                    raise
+        return None
+
+    @classmethod
+    def _open(cls, directory: str) -> Optional["BM25Segments"]:
+        manifest = cls.manifest_path(directory)
+        if not os.path.exists(manifest):
+            base = cls.base_path(directory)
+            return cls.from_index(directory, BM25Index.open(base)) if os.path.exists(base) else None
+        f = ColumnFile(manifest, _MANIFEST_MAGIC)
+        h = f.header
+        if h.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{manifest}: unsupported BM25 manifest version {h.get('version')}")
+        return cls(
+            directory,
+            [(name, BM25Index.open(os.path.join(directory, name))) for name in h["segments"]],
+            f.array("deleted", "<i8"),
+            n_docs=h["n_docs"],
+            total_len=h["total_len"],
+            df_hist={int(k): v for k, v in h["df_hist"].items()},
+            next_segment=h["next_segment"],
+        )
+
+    @classmethod
+    def delete(cls, directory: str) -> None:
+        """Remove every BM25 file in ``directory``, the manifest first so
+        readers see no index rather than a half-deleted one."""
+        manifest = cls.manifest_path(directory)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        for name in os.listdir(directory):
+            if _SEGMENT_FILE.fullmatch(name) or name == "bm25.bin":
+                os.remove(os.path.join(directory, name))
+
+    def commit(self, *, grace: float = RETIRE_GRACE_SECONDS) -> None:
+        """Publish this state by replacing the manifest. Segment files it no
+        longer names are recorded as retired and deleted by the first commit
+        at least ``grace`` seconds later."""
+        now = time.time()
+        keep = {name for name, _ in self.segments}
+        previous = self._read_header(self.directory) or {}
+        retired = {n: t for n, t in previous.get("retired", {}).items() if n not in keep}
+        for name in os.listdir(self.directory):
+            if (_SEGMENT_FILE.fullmatch(name) or name == "bm25.bin") and name not in keep:
+                retired.setdefault(name, now)
+        expired = [n for n, t in retired.items() if now - t >= grace]
+        for name in expired:
+            del retired[name]
+        write_columns(self.manifest_path(self.directory), _MANIFEST_MAGIC, {
+            "version": FORMAT_VERSION,
+            "segments": [name for name, _ in self.segments],
+            "n_docs": self.n_docs,
+            "total_len": self.total_len,
+            "df_hist": {str(k): v for k, v in self.df_hist.items()},
+            "next_segment": self.next_segment,
+            "retired": retired,
+        }, [("deleted", self.deleted.astype("<i8").tobytes())])
+        for name in expired:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    # ------------------------------------------------------------- updates
+
+    def _replace(self, **changes) -> "BM25Segments":
+        state = {
+            "segments": self.segments,
+            "deleted": self.deleted,
+            "n_docs": self.n_docs,
+            "total_len": self.total_len,
+            "df_hist": self.df_hist,
+            "next_segment": self.next_segment,
+            "epsilon": self.epsilon,
+            **changes,
+        }
+        return BM25Segments(self.directory, state.pop("segments"), state.pop("deleted"), **state)
+
+    def _postings(self, term: str) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+        """``(segment, live docs, tf)`` for every segment holding ``term``."""
+        out = []
+        for i, (_, seg) in enumerate(self.segments):
+            t = seg.terms.get(term)
+            if t is None:
+                continue
+            docs, tf = seg.docs[seg.indptr[t] : seg.indptr[t + 1]], seg.tf[seg.indptr[t] : seg.indptr[t + 1]]
+            if self._live[i] is not None:
+                keep = self._live[i][docs]
+                docs, tf = docs[keep], tf[keep]
+            if len(docs):
+                out.append((i, docs, tf))
+        return out
+
+    def df(self, term: str) -> int:
+        return sum(len(docs) for _, docs, _ in self._postings(term))
+
+    def _shift_df(self, hist: Dict[int, int], changes: Dict[str, int]) -> Dict[int, int]:
+        hist = dict(hist)
+        for term, delta in changes.items():
+            before = self.df(term)
+            hist[before] = hist.get(before, 0) - 1
+            hist[before + delta] = hist.get(before + delta, 0) + 1
+        return hist
+
+    def add(self, corpus: Sequence[Sequence[str]], rows: Sequence[int]) -> "BM25Segments":
+        """Index new documents (fresh stable ids) as one new segment."""
+        if not len(corpus):
+            return self
+        seg = BM25Index.build(corpus, rows)
+        name = f"bm25.{self.next_segment}.bin"
+        seg.write(os.path.join(self.directory, name))
+        added = Counter(term for tokens in corpus for term in set(tokens))
+        return self._replace(
+            segments=self.segments + [(name, BM25Index.open(os.path.join(self.directory, name)))],
+            n_docs=self.n_docs + len(corpus),
+            total_len=self.total_len + float(seg.doc_len.sum(dtype="float64")),
+            df_hist=self._shift_df(self.df_hist, added),
+            next_segment=self.next_segment + 1,
+        )
+
+    def remove(self, corpus: Sequence[Sequence[str]], rows: Sequence[int]) -> "BM25Segments":
+        """Tombstone documents by stable id; ``corpus`` is their tokens, used to
+        update document frequencies. Ids that aren't live are ignored."""
+        rows_arr = np.asarray(rows, dtype="int64")
+        live = np.zeros(len(rows_arr), dtype=bool)
+        for i, (_, seg) in enumerate(self.segments):
+            indexed = seg.rows if self._live[i] is None else seg.rows[self._live[i]]
+            live |= np.isin(rows_arr, indexed)
+        if not live.any():
+            return self
+        gone = [tokens for tokens, keep in zip(corpus, live) if keep]
+        removed = Counter(term for tokens in gone for term in set(tokens))
+        return self._replace(
+            deleted=np.union1d(self.deleted, rows_arr[live]),
+            n_docs=self.n_docs - len(gone),
+            total_len=self.total_len - sum(len(tokens) for tokens in gone),
+            df_hist=self._shift_df(self.df_hist, {t: -c for t, c in removed.items()}),
+        )
+
+    def delta_rows(self) -> np.ndarray:
+        """Stable ids of the live documents outside the base segment."""
+        return np.concatenate([np.zeros(0, dtype="int64")] + [
+            seg.rows if live is None else seg.rows[live]
+            for (_, seg), live in zip(self.segments[1:], self._live[1:])
+        ])
+
+    def merge_deltas(self, corpus: Sequence[Sequence[str]], rows: Sequence[int]) -> "BM25Segments":
+        """Fold every segment after the base into one, built from ``corpus`` —
+        the tokens of ``delta_rows()``. The live set, and so every statistic,
+        is unchanged; tombstones that only covered merged segments are dropped."""
+        base_name, base = self.segments[0]
+        merged = self._replace(
+            segments=[(base_name, base)],
+            deleted=np.intersect1d(self.deleted, base.rows),
+        )
+        if not len(corpus):
+            return merged
+        name = f"bm25.{self.next_segment}.bin"
+        BM25Index.build(corpus, rows).write(os.path.join(self.directory, name))
+        return merged._replace(
+            segments=merged.segments + [(name, BM25Index.open(os.path.join(self.directory, name)))],
+            next_segment=self.next_segment + 1,
+        )
+
+    @property
+    def tombstone_ratio(self) -> float:
+        return len(self.deleted) / (self.n_docs + len(self.deleted)) if len(self.deleted) else 0.0
+
+    # ----------------------------------------------------------------- query
+
+    def _mean_idf(self) -> float:
+        n_terms = sum(self.df_hist.values())
+        if not n_terms:
+            return 0.0
+        df = np.fromiter(self.df_hist.keys(), dtype="float64", count=len(self.df_hist))
+        count = np.fromiter(self.df_hist.values(), dtype="float64", count=len(self.df_hist))
+        return float((count * _idf(df, self.n_docs)).sum() / n_terms)
+
+    def top_k(self, query: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Stable ids and scores of the ``k`` best live documents, best first."""
+        if len(self.segments) == 1 and not len(self.deleted):
+            seg = self.segments[0][1]
+            idx, scores = seg.top_k(query, k)  # precomputed idf / norms are exact here
+            return seg.rows[idx], scores
+
+        scores = [np.zeros(seg.n_docs, dtype="float32") for _, seg in self.segments]
+        if self.n_docs:
+            avgdl = self.total_len / self.n_docs
+            mean_idf = None
+            for term, mult in Counter(query).items():
+                postings = self._postings(term)
+                if not postings:
+                    continue
+                idf = float(_idf(sum(len(d) for _, d, _ in postings), self.n_docs))
+                if idf < 0:
+                    mean_idf = self._mean_idf() if mean_idf is None else mean_idf
+                    idf = self.epsilon * mean_idf
+                for i, docs, tf in postings:
+                    seg = self.segments[i][1]
+                    norm = seg.k1 * (1 - seg.b + seg.b * seg.doc_len[docs] / avgdl)
+                    scores[i][docs] += mult * idf * tf * (seg.k1 + 1) / (tf + norm)
+
+        live = [np.ones(seg.n_docs, dtype=bool) if m is None else m for m, (_, seg) in zip(self._live, self.segments)]
+        rows = np.concatenate([seg.rows[m] for m, (_, seg) in zip(live, self.segments)])
+        flat = np.concatenate([s[m] for s, m in zip(scores, live)])
+        k = min(k, len(rows))
+        if k <= 0:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        idx = np.argpartition(-flat, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        idx = idx[np.lexsort((rows[idx], -flat[idx]))]  # score desc, then stable id
+        return rows[idx], flat[idx]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(seg.nbytes for _, seg in self.segments) + self.deleted.nbytes
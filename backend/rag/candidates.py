@@ -0,0 +1,119 @@
+"""Struct-of-arrays candidate set for the retrieve → fuse → rerank pipeline.
+
+Each retrieval leg returns a ``Ranked`` pair: stable chunk ids (int64) best
+first, with the leg's scores. ``fuse_rrf`` merges two of them with Reciprocal
+Rank Fusion as a handful of numpy operations, and the result stays ids plus
+per-stage score columns until ``to_dicts`` hydrates the final top-k from the
+namespace's chunk table. Nothing here copies chunk text between stages.
+
+``to_dicts`` reproduces the dicts the dict-based pipeline returned:
+``chunk_id``, ``source``, ``text`` and ``score`` (the vector score, or the BM25
+score for a BM25-only hit), plus ``fused_score`` when BM25 contributed and
+``rerank_score`` when the cross-encoder scored that candidate.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from rag.chunk_store import ChunkTable
+
+Ranked = Tuple[np.ndarray, np.ndarray]  # (chunk ids, scores), best first
+
+_RRF_K = 60
+
+
+def empty_ranked() -> Ranked:
+    return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+
+
+@dataclass
+class CandidateBatch:
+    """Candidates in ranked order; absent per-stage scores are NaN."""
+
+    ids: np.ndarray
+    vector: np.ndarray
+    bm25: np.ndarray
+    fused: Optional[np.ndarray] = None
+    rerank: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_ranked(cls, ranked: Ranked, *, leg: str = "vector") -> "CandidateBatch":
+        """A single leg's ranking, unfused; ``leg`` is ``"vector"`` or ``"bm25"``."""
+        ids, scores = ranked
+        absent = np.full(len(ids), np.nan, dtype="float32")
+        return cls(ids, scores, absent) if leg == "vector" else cls(ids, absent, scores)
+
+    def take(self, idx: np.ndarray) -> "CandidateBatch":
+        return CandidateBatch(
+            self.ids[idx],
+            self.vector[idx],
+            self.bm25[idx],
+            None if self.fused is None else self.fused[idx],
+            None if self.rerank is None else self.rerank[idx],
+        )
+
+    def rows(self, chunks: ChunkTable) -> np.ndarray:
+        return np.fromiter((chunks.row(int(i)) for i in self.ids), dtype="int64", count=len(self.ids))
+
+    def to_dicts(self, chunks: ChunkTable) -> List[Dict]:
+        out: list[dict] = []
+        for i, row in enumerate(self.rows(chunks)):
+            if row < 0:
+                continue
+            score = self.vector[i] if not np.isnan(self.vector[i]) else self.bm25[i]
+            entry = {
+                "chunk_id": chunks.chunk_id(row),
+                "source": chunks.source(row),
+                "text": chunks.text(row),
+                "score": float(score),
+            }
+            if self.fused is not None:
+                entry["fused_score"] = float(self.fused[i])
+            if self.rerank is not None and not np.isnan(self.rerank[i]):
+                entry["rerank_score"] = float(self.rerank[i])
+            out.append(entry)
+        return out
+
+
+def _ranks(ids: np.ndarray, of: np.ndarray) -> np.ndarray:
+    """0-based position in ``of`` of each of ``ids``, or -1 if absent."""
+    out = np.full(len(ids), -1, dtype="int64")
+    if not len(of):
+        return out
+    sorter = np.argsort(of, kind="stable")
+    pos = np.searchsorted(of, ids, sorter=sorter).clip(max=len(of) - 1)
+    hit = of[sorter[pos]] == ids
+    out[hit] = sorter[pos[hit]]
+    return out
+
+
+def _gather(scores: np.ndarray, rank: np.ndarray) -> np.ndarray:
+    out = np.full(len(rank), np.nan, dtype="float32")
+    out[rank >= 0] = scores[rank[rank >= 0]]
+    return out
+
+
+def fuse_rrf(vector: Ranked, bm25: Ranked, *, top_k: int, k: int = _RRF_K) -> CandidateBatch:
+    """RRF over two ranked id lists: ``score(d) = Σ_r 1 / (k + rank_r(d))``.
+
+    Ties keep first-seen order (vector list, then BM25-only hits), like
+    ``rag.hybrid.rrf_fuse``.
+    """
+    both = np.concatenate([vector[0], bm25[0]])
+    _, first = np.unique(both, return_index=True)
+    ids = both[np.sort(first)]
+
+    v_rank = _ranks(ids, vector[0])
+    b_rank = _ranks(ids, bm25[0])
+    fused = np.zeros(len(ids), dtype="float64")
+    fused[v_rank >= 0] += 1.0 / (k + v_rank[v_rank >= 0] + 1)
+    fused[b_rank >= 0] += 1.0 / (k + b_rank[b_rank >= 0] + 1)
+
+    batch = CandidateBatch(ids, _gather(vector[1], v_rank), _gather(bm25[1], b_rank), fused)
+    return batch.take(np.argsort(-fused, kind="stable")[:top_k])
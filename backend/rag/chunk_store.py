@@ -0,0 +1,350 @@
+"""Per-namespace columnar chunk store (``chunks.bin``): the one copy of chunk
+text, shared by FAISS search, BM25 and the Qdrant path.
+
+Vector indexes and the BM25 file hold only integer chunk ids; results are
+hydrated from here, and only for the rows actually returned. Columns are laid
+out back to back so a reader maps the file and slices numpy views out of it:
+nothing is parsed up front, pages live in the OS page cache, and every worker
+process mapping the same namespace shares them. Older namespaces with a
+``metadata.json`` list are read through the same interface.
+
+Stored as a ``rag.colfile`` with magic ``DOCCHNK1``; the header lists the
+distinct sources. Columns: ``ids`` (int64, ascending stable chunk ids), ``source`` (int32 index
+into the header's sources), and ``text`` / ``chunk_id`` as UTF-8 blobs with
+int64 offset arrays (``n + 1`` entries).
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from rag.colfile import ColumnFile, write_columns
+from rag.namespace_cache import get_cache
+from rag.user_store import IndexPaths
+
+_MAGIC = b"DOCCHNK1"
+
+
+def _blob(values: Sequence[str]) -> tuple[np.ndarray, bytes]:
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype="<i8")
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, b"".join(encoded)
+
+
+class ChunkTable:
+    """Read-only view over a namespace's chunk metadata.
+
+    Rows are ordered by ascending stable id, so ``row(id)`` is a binary search
+    instead of a per-namespace dict.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        source_idx: np.ndarray,
+        sources: List[str],
+        text_off: np.ndarray,
+        text: "bytes | memoryview",
+        cid_off: np.ndarray,
+        cid: "bytes | memoryview",
+        *,
+        buffer: Optional[mmap.mmap] = None,
+    ) -> None:
+        self.ids = ids
+        self._source_idx = source_idx
+        self._sources = sources
+        self._text_off = text_off
+        self._text = text
+        self._cid_off = cid_off
+        self._cid = cid
+        self._buffer = buffer  # keeps the mapping alive as long as the views
+
+    # ------------------------------------------------------------ construct
+
+    @classmethod
+    def from_dicts(cls, metadata: Sequence[Dict]) -> "ChunkTable":
+        """In-memory table from metadata dicts; a missing ``id`` is the row position."""
+        ids = np.fromiter((m.get("id", i) for i, m in enumerate(metadata)), dtype="<i8", count=len(metadata))
+        order = np.argsort(ids, kind="stable")
+        rows = [metadata[i] for i in order]
+        sources = list(dict.fromkeys(m["source"] for m in rows))
+        lookup = {s: i for i, s in enumerate(sources)}
+        text_off, text = _blob([m["text"] for m in rows])
+        cid_off, cid = _blob([m["chunk_id"] for m in rows])
+        return cls(
+            ids[order],
+            np.fromiter((lookup[m["source"]] for m in rows), dtype="<i4", count=len(rows)),
+            sources,
+            text_off,
+            text,
+            cid_off,
+            cid,
+        )
+
+    @classmethod
+    def open(cls, path: str) -> "ChunkTable":
+        """Map ``path`` read-only; columns are zero-copy views into the mapping."""
+        f = ColumnFile(path, _MAGIC)
+        return cls(
+            f.array("ids", "<i8"),
+            f.array("source", "<i4"),
+            f.header["sources"],
+            f.array("text_off", "<i8"),
+            f.raw("text"),
+            f.array("cid_off", "<i8"),
+            f.raw("cid"),
+            buffer=f.buffer,
+        )
+
+    def write(self, path: str) -> None:
+        """Serialise to ``path`` atomically (temp file + rename)."""
+        write_columns(path, _MAGIC, {"count": len(self), "sources": self._sources}, [
+            ("ids", self.ids.astype("<i8").tobytes()),
+            ("source", self._source_idx.astype("<i4").tobytes()),
+            ("text_off", self._text_off.astype("<i8").tobytes()),
+            ("text", bytes(self._text)),
+            ("cid_off", self._cid_off.astype("<i8").tobytes()),
+            ("cid", bytes(self._cid)),
+        ])
+
+    # ---------------------------------------------------------------- read
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row(self, chunk_id: int) -> int:
+        """Row holding stable id ``chunk_id``, or -1 (absent / tombstoned)."""
+        i = int(np.searchsorted(self.ids, chunk_id))
+        return i if i < len(self.ids) and self.ids[i] == chunk_id else -1
+
+    def text(self, row: int) -> str:
+        return bytes(self._text[self._text_off[row] : self._text_off[row + 1]]).decode("utf-8")
+
+    def chunk_id(self, row: int) -> str:
+        return bytes(self._cid[self._cid_off[row] : self._cid_off[row + 1]]).decode("utf-8")
+
+    def source(self, row: int) -> str:
+        return self._sources[self._source_idx[row]]
+
+    def get(self, row: int) -> Dict:
+        return {
+            "id": int(self.ids[row]),
+            "chunk_id": self.chunk_id(row),
+            "source": self.source(row),
+            "text": self.text(row),
+        }
+
+    def __iter__(self) -> Iterator[Dict]:
+        return (self.get(i) for i in range(len(self)))
+
+    def to_dicts(self) -> List[Dict]:
+        return list(self)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes backing the table (mapped or in heap)."""
+        return (
+            self.ids.nbytes + self._source_idx.nbytes + self._text_off.nbytes
+            + len(self._text) + self._cid_off.nbytes + len(self._cid)
+        )
+
+
+# --------------------------------------------------------------- namespace I/O
+
+
+def read_chunks(paths: IndexPaths) -> Optional[ChunkTable]:
+    """The namespace's chunk table, mapped from ``chunks.bin`` (or parsed from a
+    legacy ``metadata.json``); None if it has neither."""
+    if os.path.exists(paths.chunks):
+        return ChunkTable.open(paths.chunks)
+    if os.path.exists(paths.metadata):
+        with open(paths.metadata, "r", encoding="utf-8") as f:
+            return ChunkTable.from_dicts(json.load(f))
+    return None
+
+
+def _stamp(paths: IndexPaths) -> Optional[tuple]:
+    """Identity of the file ``read_chunks`` would open right now."""
+    for path in (paths.chunks, paths.metadata):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        return path, st.st_ino, st.st_mtime_ns, st.st_size
+    return None
+
+
+def load_chunks(paths: IndexPaths) -> Optional[ChunkTable]:
+    """``read_chunks`` through the namespace cache (kind ``"chunks"``).
+
+    The cached table is checked against the file's inode and mtime on every
+    call: another process (the Celery worker) may have committed a new table,
+    and a stale one would silently drop hits on the chunks it added.
+    """
+    cache = get_cache()
+    stamp = _stamp(paths)
+    hit = cache.get(paths.namespace, "chunks")
+    if hit is not None and hit[0] == stamp:
+        return hit[1]
+    if stamp is None:
+        cache.invalidate(paths.namespace, "chunks")
+        return None
+    table = read_chunks(paths)  # stat first: a newer file than the stamp is only re-read
+    if table is not None:
+        cache.put(paths.namespace, "chunks", (stamp, table), table.nbytes)
+    return table
+
+
+def delete_chunks(paths: IndexPaths) -> None:
+    for path in (paths.chunks, paths.metadata):
+        if os.path.exists(path):
+            os.remove(path)
+    get_cache().invalidate(paths.namespace, "chunks")
+
+
+class _Spill:
+    """Anonymous temp file collecting one UTF-8 blob column's new values."""
+
+    def __init__(self, directory: str) -> None:
+        self._f = tempfile.TemporaryFile(dir=directory)
+
+    def append(self, values: Sequence[str]) -> np.ndarray:
+        """Write ``values``; returns their encoded lengths."""
+        encoded = [v.encode("utf-8") for v in values]
+        self._f.write(b"".join(encoded))
+        return np.fromiter((len(b) for b in encoded), dtype="<i8", count=len(encoded))
+
+    def view(self) -> "bytes | memoryview":
+        self._f.flush()
+        if not self._f.tell():
+            return b""
+        return memoryview(mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def close(self) -> None:
+        self._f.close()  # the file has no name: closing deletes it
+
+
+def _offsets(lengths: np.ndarray) -> np.ndarray:
+    off = np.zeros(len(lengths) + 1, dtype="<i8")
+    np.cumsum(lengths, out=off[1:])
+    return off
+
+
+class ChunkTableWriter:
+    """Pending edit of a namespace's chunks for one ingest; ``commit`` writes it.
+
+    New chunks get the next stable ids, so ids only ever grow and the table
+    stays sorted. Existing rows stay in the mapped table (``remove_sources``
+    clears a keep mask over them) and new rows' text and chunk ids are spilled
+    to anonymous temp files in the namespace directory as they arrive, so an
+    ingest holds a few bytes per row rather than every chunk's text; ``commit``
+    streams both into the new file. Vector-store writers wrap this and key
+    vectors by the same ids; one that still holds vectors under retired ids
+    (FAISS tombstones) must raise ``next_id`` past them.
+    """
+
+    def __init__(self, paths: IndexPaths, *, replace: bool) -> None:
+        self._paths = paths
+        self._base = None if replace else read_chunks(paths)
+        base = self._base
+        self._keep = np.ones(len(base) if base is not None else 0, dtype=bool)
+        self._sources: Dict[str, int] = {s: i for i, s in enumerate(base._sources)} if base is not None else {}
+        self._new: Dict[str, List[np.ndarray]] = {"ids": [], "source": [], "text": [], "cid": []}
+        self._spills: Optional[tuple[_Spill, _Spill]] = None
+        self.next_id = int(base.ids[-1]) + 1 if base is not None and len(base) else 0
+        self.dirty = replace
+
+    def remove_sources(self, sources: Sequence[str]) -> bool:
+        """Drop the existing rows of ``sources`` (call before ``add``)."""
+        drop = [self._sources[s] for s in set(sources) if s in self._sources]
+        if self._base is None or not drop:
+            return False
+        hit = self._keep & np.isin(self._base._source_idx, drop)
+        self._keep &= ~hit
+        changed = bool(hit.any())
+        self.dirty |= changed
+        return changed
+
+    def add(self, metadata: Sequence[Dict]) -> np.ndarray:
+        """Append chunks; returns their newly assigned ids."""
+        ids = np.arange(self.next_id, self.next_id + len(metadata), dtype="int64")
+        if not len(metadata):
+            return ids
+        if self._spills is None:
+            os.makedirs(self._paths.dir, exist_ok=True)
+            self._spills = (_Spill(self._paths.dir), _Spill(self._paths.dir))
+        text, cid = self._spills
+        self._new["ids"].append(ids)
+        self._new["source"].append(np.fromiter(
+            (self._sources.setdefault(m["source"], len(self._sources)) for m in metadata),
+            dtype="<i4",
+            count=len(metadata),
+        ))
+        self._new["text"].append(text.append([m["text"] for m in metadata]))
+        self._new["cid"].append(cid.append([m["chunk_id"] for m in metadata]))
+        self.next_id += len(metadata)
+        self.dirty = True
+        return ids
+
+    def __len__(self) -> int:
+        return int(self._keep.sum()) + sum(len(i) for i in self._new["ids"])
+
+    def _column(self, kind: str, base: Optional[np.ndarray]) -> np.ndarray:
+        parts = ([base[self._keep]] if base is not None else []) + self._new[kind]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype="<i8")
+
+    def live_ids(self) -> np.ndarray:
+        return self._column("ids", self._base.ids if self._base is not None else None).astype("int64")
+
+    def _blob(self, kind: str, spill: Optional[_Spill]) -> tuple[np.ndarray, list]:
+        """Offsets and pieces (kept runs of the mapped blob, then the spill) of one blob column."""
+        base, pieces = self._base, []
+        lengths = None
+        if base is not None:
+            off, blob = (base._text_off, base._text) if kind == "text" else (base._cid_off, base._cid)
+            lengths = np.diff(off)
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], self._keep.view(np.int8), [0]))))
+            view = memoryview(blob)
+            pieces = [view[int(off[a]) : int(off[b])] for a, b in zip(edges[::2], edges[1::2])]
+        if spill is not None:
+            pieces.append(spill.view())
+        return _offsets(self._column(kind, lengths)), pieces
+
+    def commit(self) -> None:
+        if not self.dirty:
+            return
+        try:
+            if not len(self):
+                delete_chunks(self._paths)
+                return
+            base = self._base
+            src = self._column("source", base._source_idx if base is not None else None)
+            used = np.unique(src)
+            names = list(self._sources)
+            text, cid = self._spills if self._spills is not None else (None, None)
+            text_off, text_pieces = self._blob("text", text)
+            cid_off, cid_pieces = self._blob("cid", cid)
+            os.makedirs(self._paths.dir, exist_ok=True)
+            write_columns(self._paths.chunks, _MAGIC, {"count": len(self), "sources": [names[i] for i in used]}, [
+                ("ids", self.live_ids().astype("<i8").tobytes()),
+                ("source", np.searchsorted(used, src).astype("<i4").tobytes()),
+                ("text_off", text_off.tobytes()),
+                ("text", text_pieces),
+                ("cid_off", cid_off.tobytes()),
+                ("cid", cid_pieces),
+            ])
+            if os.path.exists(self._paths.metadata):
+                os.remove(self._paths.metadata)  # superseded by chunks.bin
+            get_cache().invalidate(self._paths.namespace, "chunks")
+        finally:
+            if self._spills is not None:
+                for spill in self._spills:
+                    spill.close()
+                self._spills = None
+            self.dirty = False
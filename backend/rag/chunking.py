@@ -2,10 +2,12 @@
 
 Splits on the highest-priority separator (paragraph → line → sentence → word)
 that keeps chunks under ``chunk_size``, then greedily packs with overlap.
+``iter_split`` applies the same splitter to a stream of text pieces through a
+bounded window, for documents too large to hold as one string.
 """
 from __future__ import annotations
 
-from typing import Iterable, List
+from typing import Iterable, Iterator, List
 
 _DEFAULT_SEPARATORS: tuple[str, ...] = (
     "\n\n",
@@ -104,3 +106,35 @@ def recursive_split(
 
     # Fall-through: hard-split by character.
     return _merge(_split_on(text, ""), chunk_size, overlap)
+
+
+def iter_split(
+    pieces: Iterable[str],
+    *,
+    chunk_size: int,
+    overlap: int,
+    window: int | None = None,
+) -> Iterator[str]:
+    """Lazily chunk the concatenation of ``pieces``.
+
+    Text accumulates until ``window`` characters (default ``16 * chunk_size``),
+    is split with ``recursive_split``, and every chunk but the last is emitted.
+    The raw text from the last chunk onwards is carried into the next window,
+    since it may continue in the next piece. Output matches ``recursive_split``
+    on the joined text whenever the total fits in one window.
+    """
+    window = window or chunk_size * 16
+    carry = ""
+    for piece in pieces:
+        for start in range(0, len(piece), window):
+            carry += piece[start:start + window]
+            if len(carry) < window:
+                continue
+            chunks = recursive_split(carry, chunk_size=chunk_size, overlap=overlap)
+            if not chunks:
+                carry = ""
+                continue
+            yield from chunks[:-1]
+            tail = carry.rfind(chunks[-1])
+            carry = carry[tail:] if tail >= 0 else chunks[-1]
+    yield from recursive_split(carry, chunk_size=chunk_size, overlap=overlap)
@@ -0,0 +1,91 @@
+"""Flat columnar files that open in constant time via mmap.
+
+Shared container for ``chunks.bin`` and ``bm25.bin``. Layout (little-endian)::
+
+    magic (8 bytes) | u32 header length | JSON header | pad to 8 | columns
+
+The header is the caller's metadata plus ``"columns": {name: [offset, nbytes]}``.
+Columns start on 8-byte boundaries, so numpy views over the mapping are aligned.
+A column is given as one buffer or a list of buffers written back to back, so
+writers can stream slices of a mapped file without joining them in memory.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+_PREFIX = struct.Struct("<8sI")
+
+Column = Union[bytes, memoryview, List[Union[bytes, memoryview]]]
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _pieces(data: Column) -> List[Union[bytes, memoryview]]:
+    return data if isinstance(data, list) else [data]
+
+
+def write_columns(path: str, magic: bytes, meta: Dict, columns: List[Tuple[str, Column]]) -> None:
+    """Write ``columns`` after a header holding ``meta``; atomic (temp + rename)."""
+    layout: Dict[str, list] = {
+        name: [0, sum(memoryview(p).nbytes for p in _pieces(data))] for name, data in columns
+    }
+    header = {**meta, "columns": layout}
+    # Offsets depend on the header size, which depends on the offsets: size the
+    # header with placeholder offsets at least as wide as the real ones.
+    probe = json.dumps({**meta, "columns": {k: [2**62, v[1]] for k, v in layout.items()}})
+    pos = _pad8(_PREFIX.size + len(probe.encode("utf-8")))
+    for name, _ in columns:
+        layout[name][0] = pos
+        pos = _pad8(pos + layout[name][1])
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    # A unique temp file per writer: concurrent writers never share one.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREFIX.pack(magic, len(header_bytes)))
+            f.write(header_bytes)
+            for name, data in columns:
+                f.seek(layout[name][0])
+                for piece in _pieces(data):
+                    f.write(piece)
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+class ColumnFile:
+    """A mapped column file. ``array`` / ``raw`` return zero-copy views."""
+
+    def __init__(self, path: str, magic: bytes) -> None:
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        found, header_len = _PREFIX.unpack_from(self.buffer, 0)
+        if found != magic:
+            raise ValueError(f"{path}: expected {magic!r} file, found {found!r}")
+        self.header: Dict = json.loads(bytes(self.buffer[_PREFIX.size : _PREFIX.size + header_len]))
+        self._columns: Dict[str, list] = self.header["columns"]
+
+    def array(self, name: str, dtype: str) -> np.ndarray:
+        start, size = self._columns[name]
+        if not size:  # may sit at EOF, past the last byte actually written
+            return np.zeros(0, dtype=dtype)
+        return np.frombuffer(self.buffer, dtype=dtype, count=size // np.dtype(dtype).itemsize, offset=start)
+
+    def raw(self, name: str) -> memoryview:
+        start, size = self._columns[name]
+        return memoryview(self.buffer)[start : start + size]
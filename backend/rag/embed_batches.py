@@ -0,0 +1,114 @@
+"""Length-bucketed batching for ingest-time embedding.
+
+A transformer batch is padded to its longest member, so a batch that mixes a
+short tail chunk with full-size chunks spends most of its compute on padding.
+``encode_bucketed`` sorts texts by token length, cuts the sorted run into
+batches that stay under ``EMBED_TOKEN_BUDGET`` padded tokens (and at most
+``EMBED_MAX_BATCH`` texts), runs one forward pass per batch and writes the
+vectors back in the caller's order. Short chunks therefore travel in large
+batches and long ones in small batches with little padding either way.
+
+Token lengths come from the model's own tokenizer (Hugging Face for
+sentence-transformers, ``tokenizers`` for the ONNX backend), truncated at the
+model's max sequence length. Remote embedders expose no tokenizer and are
+sized by a characters-per-token estimate; the model server re-batches anyway.
+
+Each call logs and exports throughput (``EMBED_CHUNKS_PER_SECOND``) and the
+share of padded positions (``EMBED_PADDING_RATIO``) for tuning the budget.
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, List
+
+import numpy as np
+
+from logging_config import get_logger
+
+log = get_logger("rag.embed_batches")
+
+EMBED_TOKEN_BUDGET = int(os.getenv("EMBED_TOKEN_BUDGET", "8192"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "128"))
+
+_CHARS_PER_TOKEN = 4
+_DEFAULT_MAX_LENGTH = 512
+
+
+def _max_length(model: Any) -> int:
+    return int(getattr(model, "max_seq_length", None) or getattr(model, "max_length", None) or _DEFAULT_MAX_LENGTH)
+
+
+def token_lengths(model: Any, texts: List[str]) -> np.ndarray:
+    """Tokens per text (special tokens included), capped at the model's max length."""
+    cap = _max_length(model)
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is not None and hasattr(tokenizer, "encode_batch"):  # tokenizers.Tokenizer
+        lengths = [sum(e.attention_mask) for e in tokenizer.encode_batch(texts)]
+    elif callable(tokenizer):  # transformers tokenizer
+        ids = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=cap)["input_ids"]
+        lengths = [len(i) for i in ids]
+    else:
+        lengths = [len(t) // _CHARS_PER_TOKEN + 2 for t in texts]
+    return np.minimum(np.asarray(lengths, dtype="int64"), cap)
+
+
+def plan_batches(lengths: np.ndarray, *, token_budget: int, max_batch: int) -> List[np.ndarray]:
+    """Indices into ``lengths`` grouped shortest first, each group's padded size
+    (count × longest) within ``token_budget``. A text longer than the budget
+    still gets a batch of its own."""
+    order = np.argsort(lengths, kind="stable")
+    batches: list[np.ndarray] = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        # Sorted ascending, so the newest member sets the batch's padded width.
+        if end - start > max_batch or (end - start) * lengths[order[end - 1]] > token_budget:
+            if end - 1 > start:
+                batches.append(order[start : end - 1])
+                start = end - 1
+    if start < len(order):
+        batches.append(order[start:])
+    return batches
+
+
+def encode_bucketed(
+    model: Any,
+    texts: List[str],
+    *,
+    token_budget: int = EMBED_TOKEN_BUDGET,
+    max_batch: int = EMBED_MAX_BATCH,
+) -> np.ndarray:
+    """``model.encode(texts, normalize_embeddings=True)`` in length-bucketed
+    batches; rows come back in the order of ``texts``."""
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+    from metrics import EMBED_CHUNKS_PER_SECOND, EMBED_PADDING_RATIO
+
+    t0 = time.perf_counter()
+    lengths = token_lengths(model, texts)
+    batches = plan_batches(lengths, token_budget=token_budget, max_batch=max_batch)
+
+    parts: list[tuple[np.ndarray, np.ndarray]] = []
+    padded = 0
+    for idx in batches:
+        vecs = model.encode([texts[i] for i in idx], batch_size=len(idx), normalize_embeddings=True)
+        parts.append((idx, np.asarray(vecs, dtype="float32")))
+        padded += len(idx) * int(lengths[idx].max())
+    out = np.empty((len(texts), parts[0][1].shape[1]), dtype="float32")
+    for idx, vecs in parts:
+        out[idx] = vecs
+
+    elapsed = time.perf_counter() - t0
+    padding_ratio = 1.0 - float(lengths.sum()) / padded if padded else 0.0
+    rate = len(texts) / elapsed if elapsed > 0 else 0.0
+    EMBED_CHUNKS_PER_SECOND.set(rate)
+    EMBED_PADDING_RATIO.observe(padding_ratio)
+    log.info(
+        "embed.batches",
+        chunks=len(texts),
+        batches=len(batches),
+        tokens=int(lengths.sum()),
+        padding_ratio=round(padding_ratio, 3),
+        chunks_per_s=round(rate, 1),
+    )
+    return out
@@ -0,0 +1,289 @@
+"""Content-addressed cache for chunk embeddings.
+
+Keyed by ``(embedding model name, sha256(chunk text))`` so re-ingests after an
+upload or delete only encode chunks whose text is new. ``EMBED_CACHE_BACKEND``
+selects where vectors live:
+
+- ``disk`` (default): append-only row files per namespace and model under
+  ``{namespace}/embed_cache/<model>/``, vectors memory-mapped, LRU-bounded to
+  ``EMBED_CACHE_MAX_ENTRIES``. A call reads only the keys and the rows it hits
+  and writes only its new rows.
+- ``redis``: the shared cache backend (``cache._b``), bounded by
+  ``EMBED_CACHE_TTL`` plus the server's maxmemory policy. Shared across
+  namespaces, which helps when many users upload the same documents.
+- ``off``: always encode.
+
+Hits and misses are counted per chunk on ``CACHE_HIT`` / ``CACHE_MISS`` with
+``layer="embedding"``.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from logging_config import get_logger
+from rag.file_lock import file_lock
+from rag.user_store import paths_for
+
+log = get_logger("rag.embed_cache")
+
+_BACKEND = os.getenv("EMBED_CACHE_BACKEND", "disk").lower()
+_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "50000"))
+_REDIS_TTL = int(os.getenv("EMBED_CACHE_TTL", str(7 * 24 * 60 * 60)))
+
+_SLUG = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------------------- disk store
+
+
+class _DiskCache:
+    """Per-namespace, per-model directory of row-aligned append-only files.
+
+    ``<gen>.keys`` holds sha256 digests, ``<gen>.vecs`` float32 rows (memory-
+    mapped, so a lookup only pages in the rows it hits) and ``<gen>.used``
+    last-use times, updated in place. ``meta.json`` names the generation and
+    its committed row count; it is replaced after each append, so readers
+    never see a partial row. A flush appends the new rows and touches the used
+    ones; past the bound the least recently used rows are dropped by writing
+    the next generation, with slack so that happens once per many flushes.
+    Writers serialize on a lock file. After a flush the handle indexes the
+    rows appended since it last looked (or reloads a new generation), so it
+    can be flushed after every batch of a long ingest and stay small.
+    """
+
+    def __init__(self, namespace: str, model_name: str) -> None:
+        paths = paths_for(None if namespace == "_anon" else namespace)
+        self._dir = os.path.join(paths.dir, "embed_cache", _SLUG.sub("_", model_name))
+        os.makedirs(self._dir, exist_ok=True)
+        self._meta_path = os.path.join(self._dir, "meta.json")
+        self._rows: Dict[str, int] = {}
+        self._vecs: Optional[np.ndarray] = None
+        self._new: Dict[str, np.ndarray] = {}
+        self._touched: set[int] = set()
+        self._loaded = (-1, 0)  # (generation, rows) that _rows / _vecs index
+        self._meta = self._read_meta()
+        try:
+            self._load_rows(self._meta)
+        except (OSError, ValueError) as e:
+            log.warning("embed_cache.load_failed", path=self._dir, error=str(e))
+            self._rows, self._vecs, self._loaded = {}, None, (-1, 0)
+
+    def _load_rows(self, meta: Optional[Dict[str, int]]) -> None:
+        """Index ``meta``'s committed rows: only the new tail when the
+        generation is the one already loaded, else from scratch."""
+        if not meta or not meta["rows"]:
+            self._rows, self._vecs, self._loaded = {}, None, (-1, 0)
+            return
+        gen, rows, dim = meta["gen"], meta["rows"], meta["dim"]
+        start = self._loaded[1] if self._loaded[0] == gen else 0
+        if not start:
+            self._rows = {}
+        keys = np.fromfile(self._file("keys", gen), dtype="S32", count=rows - start, offset=start * 32)
+        self._rows.update((k.hex(), start + i) for i, k in enumerate(keys))
+        self._vecs = np.memmap(self._file("vecs", gen), dtype="float32", mode="r", shape=(rows, dim))
+        self._loaded = (gen, rows)
+
+    def _file(self, kind: str, gen: Optional[int] = None) -> str:
+        return os.path.join(self._dir, f"{self._meta['gen'] if gen is None else gen}.{kind}")  # type: ignore[index]
+
+    def _read_meta(self) -> Optional[Dict[str, int]]:
+        try:
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        out: dict[str, np.ndarray] = {}
+        for k in keys:
+            row = self._rows.get(k)
+            if row is not None:
+                out[k] = np.array(self._vecs[row])  # type: ignore[index]
+                self._touched.add(row)
+        return out
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        self._new.update(items)
+
+    def flush(self) -> None:
+        if not self._new and not self._touched:
+            return
+        with file_lock(os.path.join(self._dir, "lock")):
+            self._flush_locked()
+        self._new.clear()
+        self._touched.clear()
+
+    def _flush_locked(self) -> None:
+        now = time.time()
+        current = self._read_meta()
+        if current is None:
+            try:  # superseded single-file format; its rows are simply re-embedded
+                os.remove(self._dir + ".npz")
+            except OSError:
+                pass
+        self._meta = current
+        if current and current["gen"] == self._loaded[0] and self._touched:
+            # Rows only move on compaction (a new generation), so ours are still valid.
+            touched = sorted(r for r in self._touched if r < current["rows"])
+            used = np.memmap(self._file("used"), dtype="float64", mode="r+", shape=(current["rows"],))
+            used[touched] = now
+            used.flush()
+            del used
+        self._load_rows(current)  # rows other writers appended are not re-added
+        if not self._new:
+            return
+
+        new_keys = [k for k in self._new if k not in self._rows]
+        new_vecs = np.stack([self._new[k] for k in new_keys]).astype("float32") if new_keys else None
+        meta = dict(current) if current else {"gen": 0, "rows": 0, "dim": 0}
+        if new_vecs is not None and meta["rows"] and meta["dim"] != new_vecs.shape[1]:
+            # Model output size changed under the same name — start over.
+            meta = {"gen": meta["gen"] + 1, "rows": 0, "dim": 0}
+        if new_vecs is not None:
+            meta["dim"] = int(new_vecs.shape[1])
+            self._append(meta, "keys", np.array([bytes.fromhex(k) for k in new_keys], dtype="S32"))
+            self._append(meta, "vecs", new_vecs)
+            self._append(meta, "used", np.full(len(new_keys), now, dtype="float64"))
+            meta["rows"] += len(new_keys)
+        if meta["rows"] > _MAX_ENTRIES:
+            meta = self._compact(meta)
+        self._write_meta(meta)
+        if current and current["gen"] != meta["gen"]:
+            for kind in ("keys", "vecs", "used"):
+                try:
+                    os.remove(self._file(kind, current["gen"]))
+                except OSError:
+                    pass
+        self._meta = meta
+        self._load_rows(meta)
+
+    def _append(self, meta: Dict[str, int], kind: str, arr: np.ndarray) -> None:
+        path = self._file(kind, meta["gen"])
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            # Drop any tail a crashed writer left past the committed rows.
+            f.seek(meta["rows"] * arr.itemsize * (arr.shape[1] if arr.ndim > 1 else 1))
+            f.write(arr.tobytes())
+            f.truncate()
+
+    def _compact(self, meta: Dict[str, int]) -> Dict[str, int]:
+        rows, dim, gen = meta["rows"], meta["dim"], meta["gen"]
+        used = np.fromfile(self._file("used", gen), dtype="float64", count=rows)
+        # Evict to 7/8 of the bound so the rewrite happens once per many flushes.
+        keep = np.sort(np.argsort(used, kind="stable")[-(_MAX_ENTRIES - _MAX_ENTRIES // 8):])
+        log.info("embed_cache.evicted", path=self._dir, rows=rows - len(keep))
+        keys = np.fromfile(self._file("keys", gen), dtype="S32", count=rows)
+        vecs = np.memmap(self._file("vecs", gen), dtype="float32", mode="r", shape=(rows, dim))
+        out = {"gen": gen + 1, "rows": 0, "dim": dim}
+        self._append(out, "keys", keys[keep])
+        self._append(out, "vecs", np.ascontiguousarray(vecs[keep]))
+        self._append(out, "used", used[keep])
+        out["rows"] = len(keep)
+        return out
+
+    def _write_meta(self, meta: Dict[str, int]) -> None:
+        tmp = self._meta_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)
+
+
+# --------------------------------------------------------------- redis store
+
+
+class _SharedCache:
+    """Vectors as raw float32 bytes in the shared cache backend, one MGET per call."""
+
+    def __init__(self, model_name: str) -> None:
+        from cache import _b, _emb_key, decode_array, encode_array
+
+        self._b = _b()
+        self._key = lambda k: _emb_key(model_name, k)
+        self._decode, self._encode = decode_array, encode_array
+        self._new: Dict[str, np.ndarray] = {}
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        out: dict[str, np.ndarray] = {}
+        for k, raw in zip(keys, self._b.mget([self._key(k) for k in keys])):
+            vec = self._decode(raw)
+            if vec is not None:
+                out[k] = vec
+        return out
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        self._new.update(items)
+
+    def flush(self) -> None:
+        if not self._new:
+            return
+        self._b.mset({self._key(k): self._encode(v) for k, v in self._new.items()}, _REDIS_TTL)
+        self._new.clear()
+
+
+# --------------------------------------------------------------------- API
+
+
+EmbedCache = Union[_DiskCache, _SharedCache]
+
+
+def open_cache(model_name: str, namespace: Optional[str]) -> Optional[EmbedCache]:
+    """The store ``cached_embed`` would use, or None when caching is off.
+
+    Callers embedding many batches open it once, pass it as ``store`` to
+    each call and ``flush()`` it after each batch, which writes only that
+    batch's new rows."""
+    if _BACKEND == "off" or (_BACKEND == "disk" and namespace is None):
+        return None
+    if _BACKEND == "redis":
+        return _SharedCache(model_name)
+    return _DiskCache(namespace, model_name)  # type: ignore[arg-type]
+
+
+def cached_embed(
+    texts: List[str],
+    encode: Callable[[List[str]], np.ndarray],
+    *,
+    model_name: str,
+    namespace: Optional[str],
+    store: Optional[EmbedCache] = None,
+) -> np.ndarray:
+    """Embed ``texts`` via ``encode``, serving repeats from the cache.
+
+    Without a namespace (query-time calls) the disk backend is skipped. With
+    a caller-owned ``store`` (see ``open_cache``) new vectors are left for
+    the caller to flush; otherwise the store is opened and flushed here.
+    """
+    owned = store is None
+    if owned:
+        store = open_cache(model_name, namespace) if texts else None
+    if not texts or store is None:
+        return encode(texts)
+    from metrics import CACHE_HIT, CACHE_MISS  # late import: avoids boot-order coupling
+
+    keys = [text_key(t) for t in texts]
+    found = store.get_many(list(dict.fromkeys(keys)))
+    text_for = dict(zip(keys, texts))
+    missing = [k for k in text_for if k not in found]
+    n_miss = sum(1 for k in keys if k not in found)
+    CACHE_HIT.labels(layer="embedding").inc(len(keys) - n_miss)
+    CACHE_MISS.labels(layer="embedding").inc(n_miss)
+
+    if missing:
+        fresh = encode([text_for[k] for k in missing])
+        new = {k: np.asarray(v, dtype="float32") for k, v in zip(missing, fresh)}
+        store.put_many(new)
+        found.update(new)
+    if owned:
+        store.flush()
+    log.info("embed_cache.lookup", backend=_BACKEND, hits=len(keys) - n_miss, misses=n_miss)
+    return np.stack([found[k] for k in keys]).astype("float32")
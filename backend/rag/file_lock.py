@@ -0,0 +1,53 @@
+"""Advisory inter-process lock on a sidecar file (``flock``).
+
+Serializes writers of one on-disk artefact across gunicorn and Celery
+processes; readers don't take it. Where ``fcntl`` is unavailable (Windows dev
+boxes) the lock only serializes threads of the current process.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None  # type: ignore[assignment]
+
+class _Held:
+    """Per-path lock of this process, and how deep the holding thread is in it."""
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.depth = 0
+
+
+_local_locks: dict[str, _Held] = {}
+_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive lock on ``path`` (created if missing) for the block.
+
+    Re-entrant within a thread: a nested hold of the same path rides on the
+    outer one (a second ``flock`` on a new descriptor would wait on itself).
+    """
+    with _guard:
+        held = _local_locks.setdefault(os.path.abspath(path), _Held())
+    with held.lock:
+        held.depth += 1
+        try:
+            if fcntl is None or held.depth > 1:
+                yield
+                return
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)  # releases the flock
+        finally:
+            held.depth -= 1
@@ -7,20 +7,41 @@ ranking via RRF:
     score(d) = Σ_r 1 / (k + rank_r(d))
 
 with k=60.
+
+The persisted index is ``rag.bm25.BM25Index`` segment files listed in
+``bm25.manifest``: flat arrays keyed by stable chunk id, memory-mapped on load
+so opening is constant time and worker processes share the pages. Hits are
+hydrated from the namespace's chunk store. A ``bm25.pkl`` from earlier
+releases is searched read-only until the namespace's next ingest rebuilds it
+from the chunk store: queries never write index files, and ingest writers
+hold the namespace's ``bm25.lock``.
+
+Ingests update the index in place (``update_bm25``): new chunks land in a
+small extra segment and removed ones are tombstoned, so adding one file to a
+large namespace costs BM25 work proportional to that file, not the corpus.
 """
 from __future__ import annotations
 
 import os
 import pickle
 import re
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Union
 
 from logging_config import get_logger
+from rag.bm25 import BM25Segments
+from rag.candidates import CandidateBatch, Ranked, empty_ranked
+from rag.chunk_store import load_chunks
+from rag.file_lock import file_lock
+from rag.namespace_cache import get_cache
 from rag.user_store import paths_for
 
 log = get_logger("hybrid")
 
 _RRF_K = 60
+_MAX_SEGMENTS = int(os.getenv("BM25_MAX_SEGMENTS", "8"))
+_COMPACT_RATIO = float(os.getenv("BM25_COMPACT_RATIO", "0.25"))
+# Seconds a replaced BM25 segment file outlives the manifest that dropped it.
+_RETIRE_GRACE = float(os.getenv("BM25_RETIRE_GRACE", "300"))
 
 _TOKEN = re.compile(r"[A-Za-z0-9_]+")
 
@@ -29,59 +50,124 @@ def _tokenize(text: str) -> list[str]:
     return [t.lower() for t in _TOKEN.findall(text or "")]
 
 
-def _bm25_path(user_id: str | None) -> str:
+def _legacy_bm25_path(user_id: str | None) -> str:
     return os.path.join(paths_for(user_id).dir, "bm25.pkl")
 
 
-def build_bm25(user_id: str | None, metadata: List[Dict]) -> None:
-    """Persist a BM25Okapi index for this user's corpus. Call at end of ingest."""
-    try:
-        from rank_bm25 import BM25Okapi  # type: ignore
-    except ImportError:
-        log.warning("bm25.dependency_missing", hint="pip install rank-bm25")
-        return
+def _keyed_corpus(metadata: Iterable[Dict]) -> tuple[list[list[str]], list[int]]:
+    corpus: list[list[str]] = []
+    rows: list[int] = []
+    for i, m in enumerate(metadata):
+        rows.append(m.get("id", i))
+        corpus.append(_tokenize(m.get("text", "")))
+    return corpus, rows
+
+
+def _write_lock(user_id: str | None):
+    return file_lock(os.path.join(paths_for(user_id).dir, "bm25.lock"))
+
+
+def build_bm25(user_id: str | None, metadata: Iterable[Dict]) -> None:
+    """Rebuild this user's BM25 index from scratch as a single base segment.
 
-    corpus = [_tokenize(m.get("text", "")) for m in metadata]
+    ``metadata`` rows are chunk-store rows; a row without ``id`` is keyed by
+    its position, as in ``ChunkTable.from_dicts``. Replaces a legacy
+    ``bm25.pkl``.
+    """
+    with _write_lock(user_id):
+        _build_locked(user_id, metadata)
+
+
+def _build_locked(user_id: str | None, metadata: Iterable[Dict]) -> None:
+    paths = paths_for(user_id)
+    corpus, rows = _keyed_corpus(metadata)
+    legacy = _legacy_bm25_path(user_id)
+    if os.path.exists(legacy):
+        os.remove(legacy)  # superseded either way
+    get_cache().invalidate(paths.namespace, "bm25")
     if not corpus:
+        # Nothing left to index — don't leave stale files answering queries.
+        BM25Segments.delete(paths.dir)
         return
-    bm25 = BM25Okapi(corpus)
-    with open(_bm25_path(user_id), "wb") as f:
-        pickle.dump(
-            {
-                "bm25": bm25,
-                "ids": [m["chunk_id"] for m in metadata],
-                # Snapshot source/text per chunk so bm25_search doesn't need to
-                # reload the vector store's metadata (Qdrant doesn't keep one).
-                "meta": [{"source": m["source"], "text": m["text"]} for m in metadata],
-            },
-            f,
-        )
+    # Fresh file names; the old segments are retired by the manifest swap.
+    BM25Segments.build(paths.dir, corpus, rows).commit(grace=_RETIRE_GRACE)
     log.info("bm25.built", docs=len(corpus), user_id=user_id)
 
 
-_bm25_cache: dict[str, dict] = {}
+def update_bm25(user_id: str | None, *, added: Sequence[Dict], removed: Sequence[Dict]) -> None:
+    """Apply one ingest's chunk delta in place: ``added`` become a new segment,
+    ``removed`` are tombstoned. Both are chunk-store rows with ``id`` and
+    ``text`` (removed rows as they were before the ingest).
+
+    Past ``BM25_COMPACT_RATIO`` tombstones the index is rebuilt from the chunk
+    store; past ``BM25_MAX_SEGMENTS`` segments the non-base ones are merged.
+    """
+    if not added and not removed:
+        return
+    with _write_lock(user_id):
+        _update_locked(user_id, added, removed)
 
 
-def _load_bm25(user_id: str | None) -> Optional[dict]:
+def _update_locked(user_id: str | None, added: Sequence[Dict], removed: Sequence[Dict]) -> None:
     paths = paths_for(user_id)
-    ns = paths.namespace
-    if ns in _bm25_cache:
-        return _bm25_cache[ns]
-    p = _bm25_path(user_id)
-    if not os.path.exists(p):
-        return None
     try:
-        with open(p, "rb") as f:
-            loaded = pickle.load(f)  # nosec B301 - file is written by this process under a per-user namespace
-        _bm25_cache[ns] = loaded
-        return loaded
+        index = BM25Segments.open(paths.dir)  # from disk: the cached copy may be stale
+    except Exception as e:
+        log.warning("bm25.load_failed", error=str(e))
+        index = None
+    if index is None:  # first ingest, or a legacy pickle to migrate
+        chunks = load_chunks(paths)
+        _build_locked(user_id, chunks if chunks is not None else ())
+        return
+
+    index = index.remove(*_keyed_corpus(removed))
+    index = index.add(*_keyed_corpus(added))
+    if index.tombstone_ratio > _COMPACT_RATIO:
+        chunks = load_chunks(paths)
+        log.info("bm25.compacting", user_id=user_id, tombstones=len(index.deleted), live=index.n_docs)
+        _build_locked(user_id, chunks if chunks is not None else ())
+        return
+    if len(index.segments) > _MAX_SEGMENTS:
+        chunks = load_chunks(paths)
+        rows = index.delta_rows()
+        corpus = [_tokenize(chunks.text(chunks.row(int(i)))) if chunks is not None else [] for i in rows]
+        index = index.merge_deltas(corpus, rows)
+    index.commit(grace=_RETIRE_GRACE)
+    get_cache().put(paths.namespace, "bm25", index, index.nbytes)
+    log.info(
+        "bm25.updated",
+        user_id=user_id,
+        added=len(added),
+        removed=len(removed),
+        segments=len(index.segments),
+        tombstones=len(index.deleted),
+    )
+
+
+def _load_bm25(user_id: str | None) -> Optional[Union[BM25Segments, dict]]:
+    paths = paths_for(user_id)
+    cache = get_cache()
+    hit = cache.get(paths.namespace, "bm25")
+    if hit is not None:
+        return hit
+    legacy = _legacy_bm25_path(user_id)
+    try:
+        if not BM25Segments.exists(paths.dir) and os.path.exists(legacy):
+            with open(legacy, "rb") as f:
+                loaded = pickle.load(f)  # nosec B301 - file is written by this process under a per-user namespace
+            cache.put(paths.namespace, "bm25", loaded, os.path.getsize(legacy))
+            return loaded
+        index = BM25Segments.open(paths.dir)
+        if index is not None:
+            cache.put(paths.namespace, "bm25", index, index.nbytes)
+        return index
     except Exception as e:
         log.warning("bm25.load_failed", error=str(e))
         return None
 
 
 def reload_bm25(user_id: str | None) -> None:
-    _bm25_cache.pop(paths_for(user_id).namespace, None)
+    get_cache().invalidate(paths_for(user_id).namespace, "bm25")
 
 
 def rrf_fuse(vector_results: List[dict], bm25_results: List[dict], *, top_k: int) -> List[dict]:
@@ -108,6 +194,17 @@ def rrf_fuse(vector_results: List[dict], bm25_results: List[dict], *, top_k: int
     return merged[:top_k]
 
 
+def bm25_search_ids(query: str, *, user_id: str | None, top_k: int) -> Optional[Ranked]:
+    """``bm25_search`` as stable chunk ids and scores, best first; None for a
+    namespace still on a legacy pickle (use ``bm25_search``)."""
+    loaded = _load_bm25(user_id)
+    if not loaded:
+        return empty_ranked()
+    if not isinstance(loaded, BM25Segments):
+        return None
+    return loaded.top_k(_tokenize(query), top_k)
+
+
 def bm25_search(
     query: str,
     *,
@@ -118,20 +215,30 @@ def bm25_search(
     loaded = _load_bm25(user_id)
     if not loaded:
         return []
+    if isinstance(loaded, BM25Segments):
+        chunks = load_chunks(paths_for(user_id))
+        if chunks is None:
+            return []
+        return CandidateBatch.from_ranked(loaded.top_k(_tokenize(query), top_k), leg="bm25").to_dicts(chunks)
+
+    # rank_bm25 pickle not yet migrated (that happens on the next ingest).
     try:
         scores = loaded["bm25"].get_scores(_tokenize(query))
     except Exception as e:
         log.warning("bm25.score_failed", error=str(e))
         return []
+    ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
 
-    ids = loaded["ids"]
+    # Their text came from an in-pickle snapshot or, older still, from the
+    # caller-supplied metadata or the namespace's chunk table.
+    ids = loaded.get("ids") or []
     snap = loaded.get("meta") or []
-    # Prefer the in-pickle snapshot (works for Qdrant + FAISS); fall back to the
-    # caller-supplied metadata for older indexes built before the snapshot field.
+    if metadata is None and not snap:
+        chunks = load_chunks(paths_for(user_id))
+        metadata = chunks.to_dicts() if chunks is not None else None
     by_id_external = {m["chunk_id"]: m for m in (metadata or [])}
 
-    out: list[dict] = []
-    ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+    out = []
     for idx in ranked:
         if idx >= len(ids):
             continue
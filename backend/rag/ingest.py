@@ -2,14 +2,30 @@
 
 Indexes are user-scoped (see ``rag.user_store``); ``user_id=None`` uses the
 shared ``_anon`` namespace for the CLI / directory entry point.
+
+Ingestion is a generator pipeline: files yield text piecewise, the splitter
+consumes it lazily, and chunks are embedded and written in ``INGEST_EMBED_BATCH``
+batches, so transient memory tracks the batch size rather than the corpus.
+Within a step, cache misses are embedded in length-bucketed batches under a
+token budget (``rag.embed_batches``).
+
+``ingest_files`` rebuilds a namespace from the given files. ``ingest_files_incremental``
+diffs them against the namespace manifest (``rag.manifest``) and only extracts
+and embeds added / changed files, applying the delta to the vector store and BM25.
+Every entry point holds the namespace's ``ingest.lock`` (``namespace_lock``)
+from its manifest read to its manifest write, so two jobs for one namespace
+(worker concurrency, a delete's sync) never interleave their read-modify-writes.
 """
 from __future__ import annotations
 
+import itertools
+import multiprocessing
 import os
-from typing import Dict, List
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Mapping, Tuple
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 try:
     from PyPDF2 import PdfReader
@@ -32,66 +48,117 @@ from config import (
     CHUNK_OVERLAP,
     CHUNK_SIZE,
     DOCS_DIR,
-    EMBEDDING_MODEL_NAME,
 )
-from rag.chunking import recursive_split
-from rag.hybrid import build_bm25
+from rag.chunk_store import ChunkTable, load_chunks, read_chunks
+from rag.chunking import iter_split, recursive_split
+from rag.embed_batches import encode_bucketed
+from rag.embed_cache import EmbedCache, cached_embed, open_cache
+from rag.file_lock import file_lock
+from rag.hybrid import build_bm25, update_bm25
+from rag.manifest import (
+    ManifestDelta,
+    ManifestEntry,
+    clear_manifest,
+    diff,
+    file_sha256,
+    load_manifest,
+    save_manifest,
+)
+from rag.models import EMBEDDING_MODEL_ID, get_embedder
 from rag.user_store import IndexPaths, paths_for
 from rag.vector_store import get_store
 
-model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+# Text extraction fans out over a process pool: the parsers are CPU-bound and
+# hold the GIL. Timeout is per file, counted from when a worker picks it up.
+_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS") or os.cpu_count() or 1)
+_EXTRACT_TIMEOUT = float(os.getenv("INGEST_EXTRACT_TIMEOUT", "120"))
+
+# Chunks embedded and flushed to the vector store per step; bounds peak memory.
+_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "256"))
+
 
+def _encode(texts: List[str]) -> np.ndarray:
+    return encode_bucketed(get_embedder(), texts)
 
-def embed(texts: List[str]) -> np.ndarray:
-    return model.encode(texts, normalize_embeddings=True).astype("float32")
+
+def embed(texts: List[str], *, namespace: str | None = None, cache: EmbedCache | None = None) -> np.ndarray:
+    """Embed chunk texts; with a namespace, unchanged chunks come from the
+    embedding cache (``rag.embed_cache``) instead of the model. Pass an open
+    ``cache`` to reuse it across batches (the caller flushes it)."""
+    return cached_embed(texts, _encode, model_name=EMBEDDING_MODEL_ID, namespace=namespace, store=cache)
 
 
 # Document Loading
 
+_TXT_BLOCK = 1024 * 1024
+_CSV_ROWS = 5000
 
-def extract_text_from_file(file_path: str) -> str:
+
+def iter_text_from_file(file_path: str) -> Iterator[str]:
+    """Yield a file's text piecewise (page, slide, sheet, row block, or 1 MiB of
+    plain text) so callers never need the whole document as one string.
+    Separators are yielded as part of the pieces: ``"".join`` gives the full text.
+    """
     ext = os.path.splitext(file_path)[1].lower()
 
     if ext == ".txt":
         with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
+            for block in iter(lambda: f.read(_TXT_BLOCK), ""):
+                yield block
+        return
 
     if ext == ".pdf":
         if PdfReader is None:
             raise ImportError("PyPDF2 is required for PDF files")
         reader = PdfReader(file_path)
-        return "\n".join((page.extract_text() or "") for page in reader.pages)
+        yield from _joined((page.extract_text() or "") for page in reader.pages)
+        return
 
     if ext in (".doc", ".docx"):
         if Document is None:
             raise ImportError("python-docx is required for Word files")
         doc = Document(file_path)
-        return "\n".join(p.text for p in doc.paragraphs)
+        yield from _joined(p.text for p in doc.paragraphs)
+        return
 
     if ext == ".csv":
         if pd is None:
             raise ImportError("pandas is required for CSV files")
-        return pd.read_csv(file_path).to_string()
+        with pd.read_csv(file_path, chunksize=_CSV_ROWS) as reader:
+            yield from _joined(block.to_string() for block in reader)
+        return
 
     if ext in (".xlsx", ".xls"):
         if pd is None:
             raise ImportError("pandas is required for Excel files")
-        return pd.read_excel(file_path).to_string()
+        with pd.ExcelFile(file_path) as book:
+            yield from _joined(book.parse(sheet).to_string() for sheet in book.sheet_names)
+        return
 
     if ext in (".ppt", ".pptx"):
         if Presentation is None:
             raise ImportError("python-pptx is required for PowerPoint files")
         prs = Presentation(file_path)
-        out: list[str] = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    out.append(shape.text)
-        return "\n".join(out)
+        yield from _joined(
+            shape.text
+            for slide in prs.slides
+            for shape in slide.shapes
+            if hasattr(shape, "text")
+        )
+        return
 
     raise ValueError(f"Unsupported file format: {ext}")
 
 
+def _joined(parts: Iterable[str]) -> Iterator[str]:
+    for i, part in enumerate(parts):
+        yield part if i == 0 else "\n" + part
+
+
+def extract_text_from_file(file_path: str) -> str:
+    return "".join(iter_text_from_file(file_path))
+
+
 def load_text_files_from_dir(directory: str) -> Dict[str, str]:
     documents: dict[str, str] = {}
     for filename in os.listdir(directory):
@@ -103,14 +170,92 @@ def load_text_files_from_dir(directory: str) -> Dict[str, str]:
 
 
 def load_text_files_from_paths(file_paths: List[str]) -> Dict[str, str]:
-    documents: dict[str, str] = {}
-    for path in file_paths:
-        filename = os.path.basename(path)
-        try:
-            documents[filename] = extract_text_from_file(path)
-        except Exception as e:
-            print(f"Error loading {filename}: {e}")
-    return documents
+    loaded = {name: "".join(pieces) for name, pieces in iter_documents_from_paths(file_paths)}
+    # Keep input order so the index layout doesn't depend on completion order.
+    names = [os.path.basename(p) for p in file_paths]
+    return {name: loaded[name] for name in names if name in loaded}
+
+
+Segments = Iterable[str]
+
+
+def iter_documents_from_paths(file_paths: List[str]) -> Iterator[Tuple[str, Segments]]:
+    """Yield ``(filename, text pieces)`` per file that extracts successfully.
+
+    Sequentially, pieces stream straight from the parser. With a process pool
+    each file comes back whole, in completion order, and at most one file per
+    worker is held at a time. Files that fail to open print ``Error loading ...``
+    and are skipped; a failure part-way through keeps the text read so far.
+    """
+    workers = min(_EXTRACT_WORKERS, len(file_paths))
+    # Daemonic processes can't have children; extract inline there.
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        for path in file_paths:
+            filename = os.path.basename(path)
+            pieces = iter_text_from_file(path)
+            try:
+                # Pull the first piece here so open/parse errors surface per file.
+                first = next(pieces, "")
+            except Exception as e:
+                print(f"Error loading {filename}: {e}")
+                continue
+            yield filename, itertools.chain((first,), _guarded(filename, pieces))
+        return
+    yield from _extract_in_pool(file_paths, workers)
+
+
+def _guarded(filename: str, pieces: Iterator[str]) -> Iterator[str]:
+    # A parser failing mid-file (say, one bad PDF page) keeps what it produced.
+    try:
+        yield from pieces
+    except Exception as e:
+        print(f"Error loading {filename}: {e}")
+
+
+def _extract_in_pool(file_paths: List[str], workers: int) -> Iterator[Tuple[str, Segments]]:
+    pool = ProcessPoolExecutor(max_workers=workers)
+    queued = iter(file_paths)
+    futures: dict[Future, str] = {}
+    started: dict[Future, float] = {}
+    hung = False
+
+    def _submit_next() -> None:
+        path = next(queued, None)
+        if path is not None:
+            futures[pool.submit(extract_text_from_file, path)] = path
+
+    try:
+        for _ in range(workers):
+            _submit_next()
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for fut in done:
+                filename = os.path.basename(futures.pop(fut))
+                _submit_next()
+                try:
+                    text = fut.result()
+                except Exception as e:
+                    print(f"Error loading {filename}: {e}")
+                    continue
+                yield filename, (text,)
+            now = time.monotonic()
+            for fut in list(pending):
+                if fut.running():
+                    started.setdefault(fut, now)
+                if fut in started and now - started[fut] > _EXTRACT_TIMEOUT:
+                    filename = os.path.basename(futures.pop(fut))
+                    print(f"Error loading {filename}: extraction timed out after {_EXTRACT_TIMEOUT:g}s")
+                    pending.discard(fut)
+                    hung = True
+                    _submit_next()
+            pending = set(futures)
+    finally:
+        if hung:
+            # A parser stuck on one file would otherwise pin its worker forever.
+            for proc in list((getattr(pool, "_processes", None) or {}).values()):
+                proc.terminate()
+        pool.shutdown(wait=not hung, cancel_futures=True)
 
 
 # Chunking
@@ -124,38 +269,101 @@ def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
 # Core Ingestion
 
 
+def namespace_lock(user_id: str | None):
+    """Exclusive, re-entrant lock on one namespace's index files across processes."""
+    return file_lock(os.path.join(paths_for(user_id).dir, "ingest.lock"))
+
+
 def _user_id_from_paths(paths: IndexPaths) -> str | None:
     return None if paths.namespace == "_anon" else paths.namespace
 
 
-def _write_index(paths: IndexPaths, documents: Dict[str, str]) -> None:
-    all_chunks: list[str] = []
-    metadata: list[dict] = []
-    for source, text in documents.items():
-        for i, chunk in enumerate(chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)):
-            all_chunks.append(chunk)
-            metadata.append({
+def _iter_chunks(documents: Iterable[Tuple[str, Segments]]) -> Iterator[dict]:
+    for source, pieces in documents:
+        for i, chunk in enumerate(iter_split(pieces, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)):
+            yield {
                 "chunk_id": f"{source}_chunk_{i}",
                 "source": source,
                 "text": chunk,
-            })
-
-    if not all_chunks:
+            }
+
+
+def _batched(items: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    it = iter(items)
+    while batch := list(itertools.islice(it, size)):
+        yield batch
+
+
+def _rows_missing(table: ChunkTable | None, other: ChunkTable | None) -> List[dict]:
+    """Rows of ``table`` whose stable id isn't in ``other``."""
+    if table is None:
+        return []
+    ids = table.ids if other is None else np.setdiff1d(table.ids, other.ids, assume_unique=True)
+    return [table.get(table.row(int(i))) for i in ids]
+
+
+def _write_index(
+    paths: IndexPaths,
+    documents: Iterable[Tuple[str, Segments]],
+    *,
+    remove_sources: Iterable[str] = (),
+    replace: bool = True,
+) -> List[str]:
+    """Stream ``documents`` through chunk → embed → index in fixed-size batches.
+
+    ``replace=True`` rebuilds the namespace from ``documents`` alone. Otherwise
+    the chunks of ``remove_sources`` are dropped and ``documents`` appended.
+    Only one batch of chunk texts and embeddings is in flight at a time: the
+    writer spills text to disk and the embedding cache is flushed per batch.
+    Returns the names of the documents that were read.
+    """
+    remove_sources = list(remove_sources)
+    sources: list[str] = []
+
+    def _track(docs: Iterable[Tuple[str, Segments]]) -> Iterator[Tuple[str, Segments]]:
+        for source, pieces in docs:
+            sources.append(source)
+            yield source, pieces
+
+    # From disk, not the process cache: the delta BM25 applies must be taken
+    # against exactly the table this writer edits.
+    before = None if replace else read_chunks(paths)
+    writer = get_store().writer(paths.namespace, replace=replace)
+    writer.remove_sources(remove_sources)
+    # One cache handle for the whole ingest (keys read once), flushed per batch
+    # so new vectors never pile up: a flush only appends that batch's rows.
+    cache = open_cache(EMBEDDING_MODEL_ID, paths.namespace)
+    n_added = 0
+    for batch in _batched(_iter_chunks(_track(documents)), _EMBED_BATCH):
+        writer.add(embed([c["text"] for c in batch], namespace=paths.namespace, cache=cache), batch)
+        if cache is not None:
+            cache.flush()
+        n_added += len(batch)
+    if replace and not sources:
+        raise ValueError("No valid files provided for ingestion")
+    if replace and not n_added:
         raise ValueError("No valid text chunks found for ingestion")
+    writer.commit()
 
-    embeddings = embed(all_chunks)
-
-    get_store().upsert(paths.namespace, embeddings, metadata)
-
-    # BM25 still uses local-disk pickle keyed by user_id — works alongside both
-    # vector backends and is loaded into RAM on first query.
-    from rag.hybrid import reload_bm25
-    build_bm25(user_id=_user_id_from_paths(paths), metadata=metadata)
-    reload_bm25(_user_id_from_paths(paths))
+    # BM25 lives on local disk next to the chunk store (whichever vector
+    # backend is active). A rebuild indexes the committed chunk table; an
+    # incremental ingest applies just the chunks it added and removed.
+    user_id = _user_id_from_paths(paths)
+    chunks = load_chunks(paths)
+    if before is None:
+        build_bm25(user_id=user_id, metadata=chunks if chunks is not None else ())
+    else:
+        update_bm25(user_id, added=_rows_missing(chunks, before), removed=_rows_missing(before, chunks))
+    return sources
 
 
 def ingest_documents(documents: Dict[str, str], *, user_id: str | None = None) -> None:
-    _write_index(paths_for(user_id), documents)
+    paths = paths_for(user_id)
+    with namespace_lock(user_id):
+        _write_index(paths, ((source, (text,)) for source, text in documents.items()))
+        # In-memory documents carry no file hashes; the next incremental ingest
+        # starts from a full rebuild.
+        clear_manifest(paths)
 
 
 # CLI entry (shared _anon namespace)
@@ -171,14 +379,93 @@ def ingest() -> None:
 # Backend entry
 
 
+def _manifest_entry(path: str, stat: Tuple[int, float] | None = None) -> ManifestEntry:
+    if stat is None:
+        st = os.stat(path)
+        stat = (st.st_size, st.st_mtime)
+    return ManifestEntry(sha256=file_sha256(path), size=int(stat[0]), modified=float(stat[1]))
+
+
 def ingest_files(file_paths: List[str], *, user_id: str | None = None) -> None:
     print("Loading uploaded files...")
-    documents = load_text_files_from_paths(file_paths)
-    if not documents:
-        raise ValueError("No valid files provided for ingestion")
-    ingest_documents(documents, user_id=user_id)
+    paths = paths_for(user_id)
+    with namespace_lock(user_id):
+        loaded = set(_write_index(paths, iter_documents_from_paths(file_paths)))
+        save_manifest(paths, {
+            os.path.basename(p): _manifest_entry(p)
+            for p in file_paths
+            if os.path.basename(p) in loaded
+        })
     print("Ingestion from uploaded files complete.")
 
 
+def ingest_files_incremental(
+    file_paths: List[str],
+    *,
+    user_id: str | None = None,
+    removed: Iterable[str] = (),
+    stats: Mapping[str, Tuple[int, float]] | None = None,
+) -> ManifestDelta:
+    """Index only what changed since the last ingest of this namespace.
+
+    ``file_paths`` are the files that may have changed (anything else in the
+    manifest is left alone); ``removed`` names sources to drop. ``stats`` maps a
+    source name to the storage ``(size, modified)`` recorded in the manifest,
+    defaulting to the local file's stat.
+
+    With no manifest yet the namespace is rebuilt from ``file_paths``, so the
+    first call must cover the whole corpus. Runs under ``namespace_lock``; a
+    caller that read the manifest to pick ``file_paths`` should already hold it.
+    """
+    with namespace_lock(user_id):
+        return _ingest_incremental_locked(file_paths, user_id=user_id, removed=removed, stats=stats)
+
+
+def _ingest_incremental_locked(
+    file_paths: List[str],
+    *,
+    user_id: str | None,
+    removed: Iterable[str],
+    stats: Mapping[str, Tuple[int, float]] | None,
+) -> ManifestDelta:
+    paths = paths_for(user_id)
+    manifest = load_manifest(paths)
+    by_name = {os.path.basename(p): p for p in file_paths}
+    entries = {
+        name: _manifest_entry(path, (stats or {}).get(name)) for name, path in by_name.items()
+    }
+    delta = diff(manifest, {name: e.sha256 for name, e in entries.items()}, removed=removed)
+
+    updated = dict(manifest)
+    for name in delta.unchanged:
+        updated[name] = entries[name]
+    if delta.empty:
+        if updated != manifest:
+            save_manifest(paths, updated)
+        return delta
+
+    # Added sources are removed too: a namespace indexed before the manifest
+    # existed may already hold chunks under the same name.
+    loaded = set(_write_index(
+        paths,
+        iter_documents_from_paths([by_name[n] for n in delta.added + delta.changed]),
+        remove_sources=delta.added + delta.changed + delta.removed,
+        replace=not manifest,
+    ))
+    for name in delta.removed:
+        updated.pop(name, None)
+    for name in delta.added + delta.changed:
+        if name in loaded:
+            updated[name] = entries[name]
+        else:
+            updated.pop(name, None)  # failed extraction: retry on the next ingest
+    save_manifest(paths, updated)
+    print(
+        f"Incremental ingest: {len(delta.added)} added, {len(delta.changed)} changed, "
+        f"{len(delta.removed)} removed, {len(delta.unchanged)} unchanged."
+    )
+    return delta
+
+
 if __name__ == "__main__":
     ingest()
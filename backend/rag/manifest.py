@@ -0,0 +1,96 @@
+"""Per-namespace ingest manifest: which source files are in the index, and at
+what content hash.
+
+Incremental ingestion diffs the current raw-file set against this manifest so
+only added / changed files are extracted and embedded, and sources that have
+disappeared are dropped from the index. Stored as ``manifest.json`` next to the
+FAISS files; ``size`` / ``modified`` let callers skip hashing files whose
+storage stat is unchanged.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List
+
+from rag.user_store import IndexPaths
+
+_HASH_BLOCK = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    sha256: str
+    size: int
+    modified: float
+
+
+@dataclass
+class ManifestDelta:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(paths: IndexPaths) -> Dict[str, ManifestEntry]:
+    """Source name → entry. Missing or unreadable manifest reads as empty, which
+    makes the next incremental ingest treat every file as added."""
+    if not os.path.exists(paths.manifest):
+        return {}
+    try:
+        with open(paths.manifest, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        return {name: ManifestEntry(**entry) for name, entry in raw.get("files", {}).items()}
+    except (ValueError, TypeError, OSError):
+        return {}
+
+
+def save_manifest(paths: IndexPaths, entries: Dict[str, ManifestEntry]) -> None:
+    tmp = paths.manifest + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"files": {name: asdict(e) for name, e in sorted(entries.items())}}, f)
+    os.replace(tmp, paths.manifest)
+
+
+def clear_manifest(paths: IndexPaths) -> None:
+    if os.path.exists(paths.manifest):
+        os.remove(paths.manifest)
+
+
+def diff(
+    manifest: Dict[str, ManifestEntry],
+    current: Dict[str, str],
+    *,
+    removed: Iterable[str] = (),
+) -> ManifestDelta:
+    """Compare ``current`` (source name → sha256) against the manifest.
+
+    ``current`` need only cover files the caller actually hashed; sources it
+    omits are treated as untouched unless listed in ``removed``.
+    """
+    delta = ManifestDelta()
+    for name, digest in current.items():
+        prev = manifest.get(name)
+        if prev is None:
+            delta.added.append(name)
+        elif prev.sha256 != digest:
+            delta.changed.append(name)
+        else:
+            delta.unchanged.append(name)
+    delta.removed = [name for name in removed if name in manifest and name not in current]
+    return delta
@@ -0,0 +1,327 @@
+"""Out-of-process model server with request micro-batching.
+
+Web workers otherwise call ``encode([query])`` / ``predict(pairs)`` one
+request at a time, each thread contending for the GIL and each process holding
+its own weights. This server hosts the embedder and cross-encoder once and
+merges requests that arrive within ``MODEL_SERVER_BATCH_WINDOW_MS`` (up to
+``MODEL_SERVER_MAX_BATCH`` items) into one forward pass.
+
+Run it next to the app::
+
+    python -m rag.model_server            # binds MODEL_SERVER_BIND
+
+``MODEL_SERVER_BIND`` is ``host:port`` (default ``127.0.0.1:8765``) or
+``unix:/path/to.sock``. Point the app at it with ``MODEL_SERVER_URL``
+(``http://127.0.0.1:8765`` or ``unix:/path/to.sock``); ``rag.models`` then
+hands out ``RemoteEmbedder`` / ``RemoteReranker`` clients with the same
+``encode`` / ``predict`` surface, so ``retrieve.embed``, ``rerank.rerank`` and
+ingest need no changes and web workers never import torch.
+
+Endpoints: ``POST /embed`` ``{"texts": [...]}`` → base64 float32 vectors
+(always L2-normalised), ``POST /rerank`` ``{"pairs": [[q, passage], ...]}`` →
+scores, ``GET /healthz`` and ``GET /metrics``.
+"""
+from __future__ import annotations
+
+import base64
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+import numpy as np
+
+from logging_config import get_logger
+from resilience import with_retry
+
+log = get_logger("rag.model_server")
+
+_BIND = os.getenv("MODEL_SERVER_BIND", "127.0.0.1:8765")
+_WINDOW_MS = float(os.getenv("MODEL_SERVER_BATCH_WINDOW_MS", "5"))
+_MAX_BATCH = int(os.getenv("MODEL_SERVER_MAX_BATCH", "64"))
+_CLIENT_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", "30"))
+
+
+# ------------------------------------------------------------- micro-batcher
+
+
+class MicroBatcher:
+    """Run ``fn`` over items from concurrent callers in merged batches.
+
+    A single background thread takes the first waiting request, then keeps
+    collecting until ``window_s`` has passed since it arrived or ``max_batch``
+    items are queued. Each caller gets back exactly its own slice of the output.
+    If the merged call raises, each request in it is retried on its own, so
+    only the callers whose own input fails get the error.
+    """
+
+    def __init__(self, fn: Callable[[list], Sequence[Any]], *, name: str, window_s: float, max_batch: int) -> None:
+        self._fn = fn
+        self._name = name
+        self._window = window_s
+        self._max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[list, Future]]" = queue.Queue()
+        threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True).start()
+
+    def submit(self, items: list) -> Sequence[Any]:
+        if not items:
+            return []
+        fut: Future = Future()
+        self._queue.put((items, fut))
+        return fut.result()
+
+    def _collect(self) -> List[Tuple[list, Future]]:
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self._window
+        while size < self._max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(req)
+            size += len(req[0])
+        return batch
+
+    def _run(self) -> None:
+        from metrics import MODEL_BATCH_SIZE
+
+        while True:
+            batch = self._collect()
+            items = [item for req, _ in batch for item in req]
+            MODEL_BATCH_SIZE.labels(model=self._name).observe(len(items))
+            try:
+                out = self._fn(items)
+            except Exception as e:
+                log.warning("model_server.batch_failed", model=self._name, size=len(items), error=str(e))
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._run_alone(batch)
+                continue
+            offset = 0
+            for req, fut in batch:
+                fut.set_result(out[offset : offset + len(req)])
+                offset += len(req)
+
+    def _run_alone(self, batch: List[Tuple[list, Future]]) -> None:
+        for req, fut in batch:
+            try:
+                fut.set_result(self._fn(req))
+            except Exception as e:
+                log.warning("model_server.request_failed", model=self._name, size=len(req), error=str(e))
+                fut.set_exception(e)
+
+
+# --------------------------------------------------------------------- server
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive: clients hold one connection per thread
+    server: Any
+
+    def log_message(self, *_args) -> None:  # stdlib access log is noise here
+        pass
+
+    def _reply(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, payload: dict) -> None:
+        self._reply(status, json.dumps(payload).encode("utf-8"))
+
+    def do_GET(self) -> None:  # noqa: N802 - stdlib hook name
+        if self.path == "/healthz":
+            self._json(200, {"ok": True, "reranker": self.server.reranker is not None})
+        elif self.path == "/metrics":
+            try:
+                from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+            except ImportError:
+                self._json(404, {"error": "prometheus-client not installed"})
+                return
+            self._reply(200, generate_latest(), CONTENT_TYPE_LATEST)
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:  # noqa: N802 - stdlib hook name
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self._json(400, {"error": "invalid JSON"})
+            return
+        try:
+            if self.path == "/embed":
+                vecs = np.asarray(self.server.embedder.submit(list(payload["texts"])), dtype="float32")
+                self._json(200, {"shape": list(vecs.shape), "vectors": base64.b64encode(vecs.tobytes()).decode("ascii")})
+            elif self.path == "/rerank":
+                if self.server.reranker is None:
+                    self._json(503, {"error": "reranker disabled"})
+                    return
+                scores = self.server.reranker.submit([tuple(p) for p in payload["pairs"]])
+                self._json(200, {"scores": [float(s) for s in scores]})
+            else:
+                self._json(404, {"error": "not found"})
+        except KeyError as e:
+            self._json(400, {"error": f"missing field {e}"})
+        except Exception as e:
+            self._json(500, {"error": str(e)})
+
+
+class _TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(
+    bind: str = _BIND,
+    *,
+    embedder: Any,
+    reranker: Optional[Any],
+    window_ms: float = _WINDOW_MS,
+    max_batch: int = _MAX_BATCH,
+) -> socketserver.BaseServer:
+    """Build (but don't start) a server around the given model objects."""
+    if bind.startswith("unix:"):
+        path = bind[len("unix:") :]
+        if os.path.exists(path):
+            os.remove(path)
+        server: socketserver.BaseServer = _UnixServer(path, _Handler)
+    else:
+        host, _, port = bind.rpartition(":")
+        server = _TCPServer((host or "127.0.0.1", int(port)), _Handler)
+
+    window_s = window_ms / 1000.0
+    server.embedder = MicroBatcher(  # type: ignore[attr-defined]
+        lambda texts: embedder.encode(texts, normalize_embeddings=True, batch_size=max_batch),
+        name="embedder",
+        window_s=window_s,
+        max_batch=max_batch,
+    )
+    server.reranker = (  # type: ignore[attr-defined]
+        MicroBatcher(
+            lambda pairs: reranker.predict(pairs, batch_size=max_batch, show_progress_bar=False),
+            name="reranker",
+            window_s=window_s,
+            max_batch=max_batch,
+        )
+        if reranker is not None
+        else None
+    )
+    return server
+
+
+# --------------------------------------------------------------------- client
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._path)
+        self.sock = sock
+
+
+class ModelClient:
+    """Keep-alive HTTP client for the model server, one connection per thread."""
+
+    def __init__(self, url: str, *, timeout: float = _CLIENT_TIMEOUT) -> None:
+        self._url = url
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._url.startswith("unix:"):
+            return _UnixConnection(self._url[len("unix:") :], self._timeout)
+        parsed = urlparse(self._url)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self._timeout)
+
+    @with_retry("model_server", exception_types=(ConnectionError,), attempts=2, max_wait=0.5)
+    def post(self, route: str, payload: dict) -> dict:
+        conn = getattr(self._local, "conn", None) or self._connect()
+        self._local.conn = conn
+        try:
+            conn.request("POST", route, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            body = resp.read()
+        except (OSError, http.client.HTTPException) as e:
+            # Stale keep-alive or server restart: drop the connection, let retry reconnect.
+            conn.close()
+            self._local.conn = None
+            raise ConnectionError(f"model server {route}: {e}") from e
+        if resp.status != 200:
+            raise RuntimeError(f"model server {route}: HTTP {resp.status} {body[:200]!r}")
+        return json.loads(body)
+
+
+class RemoteEmbedder:
+    """``SentenceTransformer.encode`` lookalike backed by the model server."""
+
+    def __init__(self, client: ModelClient) -> None:
+        self._client = client
+
+    def encode(self, texts: List[str], *, normalize_embeddings: bool = True, **_kw) -> np.ndarray:
+        if not normalize_embeddings:
+            raise ValueError("the model server only returns normalised embeddings")
+        out = self._client.post("/embed", {"texts": list(texts)})
+        return np.frombuffer(base64.b64decode(out["vectors"]), dtype="float32").reshape(out["shape"])
+
+
+class RemoteReranker:
+    """``CrossEncoder.predict`` lookalike backed by the model server."""
+
+    def __init__(self, client: ModelClient) -> None:
+        self._client = client
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], **_kw) -> np.ndarray:
+        out = self._client.post("/rerank", {"pairs": [list(p) for p in pairs]})
+        return np.asarray(out["scores"], dtype="float32")
+
+
+# ----------------------------------------------------------------------- main
+
+
+def main() -> None:
+    # This process *is* the model server: always load the models locally.
+    os.environ.pop("MODEL_SERVER_URL", None)
+    from rag.models import get_embedder, get_reranker, warmup
+
+    for role, stats in warmup().items():
+        log.info("model_server.model_ready", role=role, model=stats.name, seconds=round(stats.load_seconds, 2))
+    server = make_server(embedder=get_embedder(), reranker=get_reranker())
+    log.info("model_server.listening", bind=_BIND, window_ms=_WINDOW_MS, max_batch=_MAX_BATCH)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    # Keep the `from config import ...` imports inside rag/ working.
+    _BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, _BACKEND_DIR)
+    sys.path.insert(0, os.path.join(_BACKEND_DIR, "rag"))
+    main()
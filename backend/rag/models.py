@@ -0,0 +1,220 @@
+"""Process-wide model registry: one embedder and one cross-encoder per process.
+
+Ingest, retrieve, rerank, the CLI and evals all fetch models from here instead
+of constructing their own, so each worker holds a single copy of the weights.
+Models load lazily on first use, or up front via ``warmup()`` (set
+``MODEL_WARMUP=1`` to do it at app boot). Load time and parameter footprint are
+logged and exported as gauges.
+
+``RERANKER_MODEL`` overrides the cross-encoder; ``RERANK_DISABLE=1`` makes
+``get_reranker()`` return None without trying to load it.
+``EMBEDDING_BACKEND`` / ``RERANKER_BACKEND`` pick ``torch`` (sentence-transformers,
+the default) or ``onnx`` (int8-quantized ONNX Runtime exports from
+``rag.onnx_models``) per role. ``EMBEDDING_MODEL_ID`` / ``RERANKER_MODEL_ID``
+name the model and backend together, for cache keys and stats.
+
+With ``MODEL_SERVER_URL`` set, both roles are thin clients of the
+out-of-process model server (``rag.model_server``) instead of local weights.
+
+Under a pre-forking server, ``prepare_for_fork()`` in the master plus
+``after_fork()`` in each worker let every worker share one copy of the weights
+copy-on-write (see ``gunicorn.conf.py``).
+"""
+from __future__ import annotations
+
+import gc
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+from config import EMBEDDING_MODEL_NAME
+from logging_config import get_logger
+
+log = get_logger("rag.models")
+
+RERANKER_MODEL_NAME = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_DISABLED = os.getenv("RERANK_DISABLE") == "1"
+MODEL_SERVER_URL = os.getenv("MODEL_SERVER_URL", "")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "torch")
+
+_BACKENDS = ("torch", "onnx")
+
+
+def _model_id(name: str, backend: str) -> str:
+    # Quantized models score slightly differently; keep their cache entries apart.
+    if backend not in _BACKENDS:
+        raise ValueError(f"unknown model backend {backend!r}; expected one of {_BACKENDS}")
+    return name if backend == "torch" else f"{name}@onnx-int8"
+
+
+EMBEDDING_MODEL_ID = _model_id(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND)
+RERANKER_MODEL_ID = _model_id(RERANKER_MODEL_NAME, RERANKER_BACKEND)
+
+EMBEDDER = "embedder"
+RERANKER = "reranker"
+
+
+@dataclass(frozen=True)
+class ModelStats:
+    name: str
+    load_seconds: float
+    resident_bytes: int
+
+
+_lock = threading.Lock()
+_models: Dict[str, Any] = {}
+_stats: Dict[str, ModelStats] = {}
+_failed: set[str] = set()
+
+
+def _param_bytes(model: Any) -> int:
+    """Bytes held by the model's tensors; 0 if it doesn't expose parameters."""
+    nbytes = getattr(model, "nbytes", None)
+    if callable(nbytes):
+        return int(nbytes())
+    for owner in (model, getattr(model, "model", None)):
+        params = getattr(owner, "parameters", None)
+        if callable(params):
+            try:
+                return int(sum(p.numel() * p.element_size() for p in params()))
+            except Exception:
+                return 0
+    return 0
+
+
+def _load(role: str, name: str, factory: Callable[[], Any]) -> Any:
+    from metrics import MODEL_LOAD_SECONDS, MODEL_RESIDENT_BYTES
+
+    log.info("models.loading", role=role, model=name)
+    t0 = time.perf_counter()
+    model = factory()
+    stats = ModelStats(name=name, load_seconds=time.perf_counter() - t0, resident_bytes=_param_bytes(model))
+    _stats[role] = stats
+    MODEL_LOAD_SECONDS.labels(model=role).set(stats.load_seconds)
+    MODEL_RESIDENT_BYTES.labels(model=role).set(stats.resident_bytes)
+    log.info(
+        "models.loaded",
+        role=role,
+        model=name,
+        seconds=round(stats.load_seconds, 3),
+        resident_mb=round(stats.resident_bytes / 2**20, 1),
+    )
+    return model
+
+
+def _get(role: str, name: str, factory: Callable[[], Any]) -> Any:
+    model = _models.get(role)
+    if model is not None:
+        return model
+    with _lock:
+        if role not in _models:
+            _models[role] = _load(role, name, factory)
+        return _models[role]
+
+
+def _new_embedder():
+    if MODEL_SERVER_URL:
+        from rag.model_server import ModelClient, RemoteEmbedder
+
+        return RemoteEmbedder(ModelClient(MODEL_SERVER_URL))
+    if EMBEDDING_BACKEND == "onnx":
+        from rag.onnx_models import OnnxEmbedder, model_dir
+
+        return OnnxEmbedder(model_dir(EMBEDDING_MODEL_NAME))
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+def _new_reranker():
+    if MODEL_SERVER_URL:
+        from rag.model_server import ModelClient, RemoteReranker
+
+        return RemoteReranker(ModelClient(MODEL_SERVER_URL))
+    if RERANKER_BACKEND == "onnx":
+        from rag.onnx_models import OnnxCrossEncoder, model_dir
+
+        return OnnxCrossEncoder(model_dir(RERANKER_MODEL_NAME), max_length=512)
+    from sentence_transformers import CrossEncoder  # type: ignore
+
+    return CrossEncoder(RERANKER_MODEL_NAME, max_length=512)
+
+
+def get_embedder():
+    """The shared bi-encoder (``EMBEDDING_MODEL_NAME`` on ``EMBEDDING_BACKEND``)."""
+    return _get(EMBEDDER, EMBEDDING_MODEL_ID, _new_embedder)
+
+
+def get_reranker():
+    """The shared cross-encoder, or None when disabled or it failed to load."""
+    if RERANK_DISABLED or RERANKER in _failed:
+        return None
+    try:
+        return _get(RERANKER, RERANKER_MODEL_ID, _new_reranker)
+    except Exception as e:
+        log.warning("rerank.model.unavailable", error=str(e))
+        _failed.add(RERANKER)
+        return None
+
+
+def warmup(*, reranker: bool = True) -> Dict[str, ModelStats]:
+    """Load models now rather than on the first request. Returns their stats."""
+    get_embedder()
+    if reranker:
+        get_reranker()
+    return loaded_models()
+
+
+def _set_torch_threads(n: int) -> None:
+    try:
+        import torch  # type: ignore
+    except ImportError:
+        return
+    torch.set_num_threads(n)
+
+
+def prepare_for_fork() -> Dict[str, ModelStats]:
+    """Load and warm the models in a master process that is about to fork.
+
+    Torch runs single-threaded here so no OpenMP pool exists to be inherited
+    broken, and tokenizers parallelism is off (it deadlocks across fork). One
+    forward pass builds lazily-initialised buffers before the fork, and
+    ``gc.freeze()`` keeps the collector from writing to (and so copying) the
+    inherited pages in every worker.
+    """
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    _set_torch_threads(1)
+    stats = warmup()
+    if MODEL_SERVER_URL:
+        return stats  # nothing local to share; the model server holds the weights
+    get_embedder().encode(["warmup"], normalize_embeddings=True)
+    reranker = get_reranker()
+    if reranker is not None:
+        reranker.predict([("warmup", "warmup")], show_progress_bar=False)
+    gc.freeze()
+    return stats
+
+
+def after_fork() -> None:
+    """Per-worker setup after forking from a ``prepare_for_fork`` master."""
+    _set_torch_threads(int(os.getenv("TORCH_NUM_THREADS", "1")))
+
+
+def loaded_models() -> Dict[str, ModelStats]:
+    return dict(_stats)
+
+
+def is_loaded(role: str) -> bool:
+    return role in _models
+
+
+def reset_for_tests(models: Optional[Dict[str, Any]] = None) -> None:
+    """Drop loaded models (optionally seeding fakes). Tests only."""
+    with _lock:
+        _models.clear()
+        _stats.clear()
+        _failed.clear()
+        _models.update(models or {})
@@ -0,0 +1,103 @@
+"""Process-wide LRU of loaded per-namespace search artefacts, under a byte budget.
+
+The FAISS store, BM25 and the semantic answer cache's ANN mirror keep what
+they've loaded for a namespace here, keyed by ``(namespace, kind)``. Eviction
+works on whole namespaces: when the total passes ``NAMESPACE_CACHE_BYTES`` the
+least recently used namespace loses all its entries together, so a cold
+tenant never keeps half its indexes resident. The namespace being inserted is never evicted, even if it
+alone exceeds the budget.
+
+Sizes are what the loader reports: index file + chunk table bytes for FAISS,
+the persisted file size for BM25, vector bytes for the semantic mirror.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from logging_config import get_logger
+
+log = get_logger("rag.namespace_cache")
+
+_BUDGET = int(os.getenv("NAMESPACE_CACHE_BYTES", str(1024**3)))
+
+
+class NamespaceCache:
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self._entries: "OrderedDict[str, Dict[str, Tuple[Any, int]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, kind: str) -> Optional[Any]:
+        with self._lock:
+            kinds = self._entries.get(namespace)
+            if not kinds or kind not in kinds:
+                return None
+            self._entries.move_to_end(namespace)
+            return kinds[kind][0]
+
+    def put(self, namespace: str, kind: str, value: Any, nbytes: int) -> None:
+        with self._lock:
+            kinds = self._entries.setdefault(namespace, {})
+            if kind in kinds:
+                self._bytes -= kinds[kind][1]
+            kinds[kind] = (value, nbytes)
+            self._bytes += nbytes
+            self._entries.move_to_end(namespace)
+            self._evict()
+            self._export()
+
+    def invalidate(self, namespace: str, kind: Optional[str] = None) -> None:
+        with self._lock:
+            kinds = self._entries.get(namespace)
+            if not kinds:
+                return
+            for k in [kind] if kind else list(kinds):
+                entry = kinds.pop(k, None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+            if not kinds:
+                del self._entries[namespace]
+            self._export()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._export()
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def namespaces(self) -> list[str]:
+        """Resident namespaces, least recently used first."""
+        with self._lock:
+            return list(self._entries)
+
+    def _evict(self) -> None:
+        from metrics import NAMESPACE_CACHE_EVICTIONS
+
+        while self._bytes > self.budget and len(self._entries) > 1:
+            # The namespace just inserted sits at the end, so it's never picked here.
+            namespace = next(iter(self._entries))
+            freed = sum(n for _, n in self._entries.pop(namespace).values())
+            self._bytes -= freed
+            NAMESPACE_CACHE_EVICTIONS.inc()
+            log.info("namespace_cache.evicted", namespace=namespace, freed_bytes=freed, resident_bytes=self._bytes)
+
+    def _export(self) -> None:
+        from metrics import NAMESPACE_CACHE_BYTES, NAMESPACE_CACHE_NAMESPACES
+
+        NAMESPACE_CACHE_NAMESPACES.set(len(self._entries))
+        NAMESPACE_CACHE_BYTES.set(self._bytes)
+
+
+_cache = NamespaceCache(_BUDGET)
+
+
+def get_cache() -> NamespaceCache:
+    return _cache
@@ -0,0 +1,245 @@
+"""ONNX Runtime backends for the embedder and cross-encoder, int8-quantized.
+
+``EMBEDDING_BACKEND=onnx`` / ``RERANKER_BACKEND=onnx`` make ``rag.models``
+serve these instead of the sentence-transformers (PyTorch) models. They expose
+the same ``encode`` / ``predict`` surface, so ingest, retrieve, rerank and the
+model server need no changes, and a worker on this backend never imports
+torch: inference is onnxruntime and tokenization is the ``tokenizers`` fast
+tokenizer saved next to the graph.
+
+Export and quantize offline, once per model (this step does need torch)::
+
+    python -m rag.onnx_models export              # both models
+    python -m rag.onnx_models export --only reranker
+
+Each model lands in ``ONNX_MODEL_DIR/<model name>/`` as ``model.onnx`` (fp32),
+``model_int8.onnx`` (dynamic int8 weights, what is served), ``tokenizer.json``
+and ``onnx_config.json`` (pooling, max length, score activation). Check
+retrieval quality against the PyTorch models with the evals parity gate
+(``python -m evals.run --parity-with <torch run>.json``).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from logging_config import get_logger
+
+log = get_logger("rag.onnx_models")
+
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", "data/onnx"))
+# Intra-op threads per session. 1 matches TORCH_NUM_THREADS: scale with workers.
+_NUM_THREADS = int(os.getenv("ONNX_NUM_THREADS", "1"))
+_BATCH_SIZE = 32
+
+QUANTIZED_FILE = "model_int8.onnx"
+FP32_FILE = "model.onnx"
+CONFIG_FILE = "onnx_config.json"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+def model_dir(name: str, root: Optional[Path] = None) -> Path:
+    """Where ``name`` (a Hugging Face id, ``org/model``) is exported to."""
+    return (root or ONNX_MODEL_DIR) / name.replace("/", "__")
+
+
+class _OnnxModel:
+    def __init__(self, path: Union[str, Path], *, max_length: Optional[int] = None) -> None:
+        import onnxruntime as ort  # type: ignore
+        from tokenizers import Tokenizer  # type: ignore
+
+        path = Path(path)
+        if not (path / QUANTIZED_FILE).exists():
+            raise FileNotFoundError(
+                f"no ONNX export in {path}; run `python -m rag.onnx_models export` first"
+            )
+        self.path = path
+        self.config: Dict = json.loads((path / CONFIG_FILE).read_text(encoding="utf-8"))
+        self.max_length = int(max_length or self.config["max_length"])
+
+        self.tokenizer = Tokenizer.from_file(str(path / TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.max_length)
+        self.tokenizer.enable_padding(pad_id=int(self.config.get("pad_id", 0)))
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = _NUM_THREADS
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(path / QUANTIZED_FILE), sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def nbytes(self) -> int:
+        """Size of the served graph; stands in for the parameter footprint."""
+        return (self.path / QUANTIZED_FILE).stat().st_size
+
+    def _run(self, inputs: Sequence[Union[str, Tuple[str, str]]]) -> Tuple[np.ndarray, np.ndarray]:
+        encodings = self.tokenizer.encode_batch(list(inputs))
+        feed = {
+            "input_ids": np.array([e.ids for e in encodings], dtype="int64"),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype="int64"),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype="int64"),
+        }
+        feed = {k: v for k, v in feed.items() if k in self._input_names}
+        return self.session.run(None, feed)[0], feed["attention_mask"]
+
+
+class OnnxEmbedder(_OnnxModel):
+    """Bi-encoder with ``SentenceTransformer.encode``'s surface (mean pooling)."""
+
+    def encode(
+        self,
+        texts: Union[str, List[str]],
+        *,
+        batch_size: int = _BATCH_SIZE,
+        normalize_embeddings: bool = False,
+        **_kw,
+    ) -> np.ndarray:
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        out = np.zeros((len(texts), int(self.config["dim"])), dtype="float32")
+        for start in range(0, len(texts), batch_size):
+            hidden, mask = self._run(texts[start : start + batch_size])
+            mask = mask[..., None].astype("float32")
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            out[start : start + len(pooled)] = pooled
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Cross-encoder with ``CrossEncoder.predict``'s surface and activation."""
+
+    def predict(
+        self,
+        pairs: Sequence[Tuple[str, str]],
+        *,
+        batch_size: int = _BATCH_SIZE,
+        show_progress_bar: bool = False,
+        **_kw,
+    ) -> np.ndarray:
+        pairs = [(str(q), str(p)) for q, p in pairs]
+        scores: list[np.ndarray] = []
+        for start in range(0, len(pairs), batch_size):
+            logits, _ = self._run(pairs[start : start + batch_size])
+            scores.append(logits[:, 0] if logits.shape[1] == 1 else logits)
+        if not scores:
+            return np.zeros(0, dtype="float32")
+        out = np.concatenate(scores).astype("float32")
+        if self.config.get("activation") == "sigmoid":
+            out = 1.0 / (1.0 + np.exp(-out))
+        return out
+
+
+# --------------------------------------------------------------- export
+
+
+def _export_graph(model, tokenizer, path: Path, output: str) -> None:
+    import torch  # type: ignore
+
+    sample = tokenizer(["export sample"], ["second segment"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {n: {0: "batch", 1: "sequence"} for n in names}
+    axes[output] = {0: "batch"} if output == "logits" else {0: "batch", 1: "sequence"}
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[n] for n in names),
+            str(path / FP32_FILE),
+            input_names=names,
+            output_names=[output],
+            dynamic_axes=axes,
+            opset_version=14,
+        )
+
+
+def _quantize(path: Path) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+
+    quantize_dynamic(str(path / FP32_FILE), str(path / QUANTIZED_FILE), weight_type=QuantType.QInt8)
+
+
+def _finish(path: Path, tokenizer, config: Dict) -> Path:
+    _quantize(path)
+    tokenizer.backend_tokenizer.save(str(path / TOKENIZER_FILE))
+    config["pad_id"] = tokenizer.pad_token_id or 0
+    (path / CONFIG_FILE).write_text(json.dumps(config, indent=2), encoding="utf-8")
+    log.info(
+        "onnx.exported",
+        model=config["model"],
+        path=str(path),
+        fp32_mb=round((path / FP32_FILE).stat().st_size / 2**20, 1),
+        int8_mb=round((path / QUANTIZED_FILE).stat().st_size / 2**20, 1),
+    )
+    return path
+
+
+def export_embedder(name: str, root: Optional[Path] = None) -> Path:
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(name, device="cpu")
+    pooling = st[1].get_pooling_mode_str()
+    if pooling != "mean":
+        raise ValueError(f"{name} uses {pooling} pooling; only mean pooling is supported")
+    path = model_dir(name, root)
+    path.mkdir(parents=True, exist_ok=True)
+    _export_graph(st[0].auto_model, st.tokenizer, path, "last_hidden_state")
+    config = {
+        "model": name,
+        "kind": "embedder",
+        "max_length": st.max_seq_length,
+        "dim": st.get_sentence_embedding_dimension(),
+    }
+    return _finish(path, st.tokenizer, config)
+
+
+def export_reranker(name: str, root: Optional[Path] = None, *, max_length: int = 512) -> Path:
+    from sentence_transformers import CrossEncoder  # type: ignore
+
+    ce = CrossEncoder(name, max_length=max_length, device="cpu")
+    path = model_dir(name, root)
+    path.mkdir(parents=True, exist_ok=True)
+    _export_graph(ce.model, ce.tokenizer, path, "logits")
+    activation = type(ce.default_activation_function).__name__.lower()
+    config = {
+        "model": name,
+        "kind": "reranker",
+        "max_length": max_length,
+        "activation": "sigmoid" if activation == "sigmoid" else "identity",
+    }
+    return _finish(path, ce.tokenizer, config)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from config import EMBEDDING_MODEL_NAME
+    from rag.models import RERANKER_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Export and int8-quantize the models for ONNX Runtime.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Export to ONNX and quantize (needs torch + onnxruntime).")
+    export.add_argument("--only", choices=("embedder", "reranker"), help="Export just one model.")
+    export.add_argument("--out", type=Path, default=None, help=f"Output root (default {ONNX_MODEL_DIR}).")
+    args = parser.parse_args(argv)
+
+    if args.only in (None, "embedder"):
+        print(export_embedder(EMBEDDING_MODEL_NAME, args.out))
+    if args.only in (None, "reranker"):
+        print(export_reranker(RERANKER_MODEL_NAME, args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    # Keep the `from config import ...` imports inside rag/ working.
+    _BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, _BACKEND_DIR)
+    sys.path.insert(0, os.path.join(_BACKEND_DIR, "rag"))
+    sys.exit(main())
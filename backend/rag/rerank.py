@@ -4,38 +4,122 @@ Two-stage retrieval: a bi-encoder (FAISS + sentence-transformers) fetches a
 wide candidate set with good recall, then a cross-encoder rescores the
 (query, passage) pairs jointly for better precision.
 
-Loaded lazily on first use to keep cold-start fast. ``RERANKER_MODEL``
-overrides the model; ``RERANK_DISABLE=1`` short-circuits when the model
-can't be downloaded.
+The model comes from the shared registry in ``rag.models`` (lazy, one copy
+per process). ``RERANKER_MODEL`` overrides it; ``RERANK_DISABLE=1``
+short-circuits when the model can't be downloaded.
+
+Scores are cached per process, keyed by (reranker model and backend,
+normalised query, sha256 of the passage), so a repeated question over an
+unchanged corpus only sends the pairs it hasn't seen to ``predict``.
+Normalisation lowercases and collapses whitespace, which the uncased MS MARCO
+cross-encoders ignore anyway. The cache is an LRU of
+``RERANK_CACHE_MAX_ENTRIES`` scores (0 disables it); lookups count on
+``CACHE_HIT`` / ``CACHE_MISS`` with ``layer="rerank"``.
+
+``rerank_depth`` picks how many fused candidates are worth scoring at all:
+fewer for small namespaces and for fused lists with a clear score gap, none
+when vector and BM25 agree on the top hit and on a runner-up well behind it.
 """
 from __future__ import annotations
 
+import hashlib
+import math
 import os
-from typing import List
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import List, Optional
+
+import numpy as np
 
 from logging_config import get_logger
+from rag.candidates import CandidateBatch
+from rag.chunk_store import ChunkTable
+from rag.models import RERANKER_MODEL_ID, get_reranker
 
 log = get_logger("rerank")
 
-_MODEL_NAME = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
-_DISABLED = os.getenv("RERANK_DISABLE") == "1"
+_CACHE_MAX_ENTRIES = int(os.getenv("RERANK_CACHE_MAX_ENTRIES", "100000"))
+# Adaptive depth (see ``rerank_depth``); RERANK_ADAPTIVE=0 always reranks RERANK_MAX_DEPTH.
+_ADAPTIVE = os.getenv("RERANK_ADAPTIVE", "1") == "1"
+_MAX_DEPTH = int(os.getenv("RERANK_MAX_DEPTH", "50"))
+_DEPTH_FRACTION = float(os.getenv("RERANK_DEPTH_FRACTION", "0.1"))
+_GAP_RATIO = float(os.getenv("RERANK_GAP_RATIO", "0.6"))
+_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0.3"))
 
-_model = None
 
+class _ScoreCache:
+    """Thread-safe LRU of cross-encoder scores keyed by 64-byte digests."""
 
-def _get_model():
-    global _model
-    if _model is not None or _DISABLED:
-        return _model
-    try:
-        from sentence_transformers import CrossEncoder  # type: ignore
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._scores: "OrderedDict[bytes, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[float]]:
+        with self._lock:
+            out = []
+            for k in keys:
+                score = self._scores.get(k)
+                if score is not None:
+                    self._scores.move_to_end(k)
+                out.append(score)
+            return out
+
+    def put_many(self, items: dict[bytes, float]) -> None:
+        with self._lock:
+            self._scores.update(items)
+            for k in items:
+                self._scores.move_to_end(k)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scores.clear()
+
+
+_cache = _ScoreCache(_CACHE_MAX_ENTRIES)
 
-        log.info("rerank.model.loading", model=_MODEL_NAME)
-        _model = CrossEncoder(_MODEL_NAME, max_length=512)
+
+def _query_key(query: str) -> bytes:
+    normalised = " ".join(query.lower().split())
+    return hashlib.sha256(f"{RERANKER_MODEL_ID}\0{normalised}".encode("utf-8")).digest()
+
+
+def _predict(model, query: str, texts: List[str]) -> Optional[np.ndarray]:
+    try:
+        scores = model.predict([(query, t) for t in texts], show_progress_bar=False)
     except Exception as e:
-        log.warning("rerank.model.unavailable", error=str(e))
-        _model = None
-    return _model
+        log.warning("rerank.predict_failed", error=str(e))
+        return None
+    return np.asarray(scores, dtype="float32")
+
+
+def rerank_scores(query: str, texts: List[str]) -> Optional[np.ndarray]:
+    """Cross-encoder relevance of each text to ``query``; None if the model is
+    not available or raises. Only cache misses reach the model."""
+    model = get_reranker()
+    if model is None:
+        return None
+    if _cache.max_entries <= 0 or not texts:
+        return _predict(model, query, texts)
+    from metrics import CACHE_HIT, CACHE_MISS  # late import: avoids boot-order coupling
+
+    q = _query_key(query)
+    keys = [q + hashlib.sha256(t.encode("utf-8")).digest() for t in texts]
+    cached = _cache.get_many(keys)
+    scores = np.array([np.nan if s is None else s for s in cached], dtype="float32")
+    miss = [i for i, s in enumerate(cached) if s is None]
+    CACHE_HIT.labels(layer="rerank").inc(len(texts) - len(miss))
+    CACHE_MISS.labels(layer="rerank").inc(len(miss))
+    if miss:
+        fresh = _predict(model, query, [texts[i] for i in miss])
+        if fresh is None:
+            return None
+        scores[miss] = fresh
+        _cache.put_many({keys[i]: float(s) for i, s in zip(miss, fresh)})
+    return scores
 
 
 def rerank(query: str, chunks: List[dict], *, top_k: int) -> List[dict]:
@@ -47,17 +131,119 @@ def rerank(query: str, chunks: List[dict], *, top_k: int) -> List[dict]:
     if not chunks:
         return []
 
-    model = _get_model()
-    if model is None:
-        return chunks[:top_k]
-
-    pairs = [(query, c.get("text", "")) for c in chunks]
-    try:
-        scores = model.predict(pairs, show_progress_bar=False)
-    except Exception as e:
-        log.warning("rerank.predict_failed", error=str(e))
+    scores = rerank_scores(query, [c.get("text", "") for c in chunks])
+    if scores is None:
         return chunks[:top_k]
 
     for c, s in zip(chunks, scores):
         c["rerank_score"] = float(s)
     return sorted(chunks, key=lambda c: c["rerank_score"], reverse=True)[:top_k]
+
+
+@dataclass(frozen=True)
+class RerankDecision:
+    """How many fused candidates go to the cross-encoder, and why.
+
+    ``decision`` is ``full`` (the usual ``RERANK_MAX_DEPTH``), ``partial``
+    (cut by ``reason``: ``namespace`` or ``gap``), ``skip`` (``reason``
+    ``unambiguous``) or ``off`` (no reranker loaded).
+    """
+
+    depth: int
+    decision: str
+    reason: str
+
+
+def _leg_top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Mask of the ``k`` best candidates by one leg's own score."""
+    present = np.flatnonzero(~np.isnan(scores))
+    mask = np.zeros(len(scores), dtype=bool)
+    mask[present[np.argsort(-scores[present], kind="stable")[:k]]] = True
+    return mask
+
+
+def _both_legs(batch: CandidateBatch, i: int) -> bool:
+    return not np.isnan(batch.vector[i]) and not np.isnan(batch.bm25[i])
+
+
+def _gap_cut(batch: CandidateBatch, *, top_k: int, limit: int) -> int:
+    """How many of the first ``limit`` candidates to keep (see ``rerank_depth``)."""
+    window = batch.fused[top_k - 1 : limit]  # type: ignore[index]
+    if len(window) < 2:
+        return limit
+    ratios = window[1:] / window[:-1]
+    i = int(np.argmin(ratios))
+    if ratios[i] >= _GAP_RATIO:
+        return limit
+    keep = np.flatnonzero((_leg_top(batch.vector, top_k) | _leg_top(batch.bm25, top_k))[:limit])
+    return max(top_k + i, int(keep[-1]) + 1 if len(keep) else 0)
+
+
+def rerank_depth(batch: CandidateBatch, *, top_k: int, namespace_size: int) -> RerankDecision:
+    """Adaptive rerank depth for a fused candidate batch (best first).
+
+    - Namespace size: rerank at most ``RERANK_DEPTH_FRACTION`` of the
+      namespace's chunks (never fewer than ``top_k``); a 40-chunk namespace
+      doesn't need 50 cross-encoder passes.
+    - Score gap: past the ``top_k``-th candidate, the list is cut at its
+      largest drop between neighbouring fused scores, if the score after it
+      is under ``RERANK_GAP_RATIO`` × the one before. The cut never excludes
+      a chunk in either leg's own top ``top_k``: RRF puts a leg's #1 hit that
+      the other leg missed below every chunk both legs found, and it may
+      still be the best answer.
+    - Skip: when both legs found the top chunk and the runner-up, and the top
+      chunk leads by ``RERANK_SKIP_MARGIN`` of its fused score, the order
+      stands. A single-leg runner-up says nothing about the rest of the head
+      (RRF scores any leg's #1 at half a shared #1), so the usual depth,
+      never under ``top_k``, is reranked then.
+
+    Each decision is counted on ``RERANK_DECISIONS`` and ``RERANK_DEPTH``.
+    """
+    from metrics import RERANK_DECISIONS, RERANK_DEPTH
+
+    n = len(batch)
+    full = min(n, _MAX_DEPTH)
+    if get_reranker() is None:
+        result = RerankDecision(0, "off", "disabled")
+    elif not _ADAPTIVE or not n:
+        result = RerankDecision(full, "full", "fixed")
+    else:
+        depth, reason = full, "max"
+        by_size = max(top_k, math.ceil(namespace_size * _DEPTH_FRACTION))
+        if by_size < depth:
+            depth, reason = by_size, "namespace"
+        fused = batch.fused
+        if fused is not None and n > top_k:
+            by_gap = _gap_cut(batch, top_k=top_k, limit=depth)
+            if by_gap < depth:
+                depth, reason = by_gap, "gap"
+        if (
+            fused is not None
+            and _both_legs(batch, 0)
+            and (n == 1 or (_both_legs(batch, 1) and fused[1] <= (1 - _SKIP_MARGIN) * fused[0]))
+        ):
+            result = RerankDecision(0, "skip", "unambiguous")
+        else:
+            result = RerankDecision(depth, "full" if depth == full else "partial", reason)
+    RERANK_DECISIONS.labels(decision=result.decision, reason=result.reason).inc()
+    RERANK_DEPTH.observe(result.depth)
+    return result
+
+
+def rerank_batch(
+    query: str, batch: CandidateBatch, chunks: ChunkTable, *, top_k: int, depth: Optional[int] = None
+) -> CandidateBatch:
+    """``rerank`` over a candidate batch. Only the first ``depth`` candidates
+    (default: all) are scored; the rest keep their fused order behind them.
+    Passage text is read from ``chunks`` only for the candidates scored."""
+    depth = len(batch) if depth is None else min(depth, len(batch))
+    if not depth or get_reranker() is None:
+        return batch.take(np.arange(min(top_k, len(batch))))
+    head = batch.take(np.arange(depth))
+    texts = [chunks.text(row) if row >= 0 else "" for row in head.rows(chunks)]
+    scores = rerank_scores(query, texts)
+    if scores is None:
+        return batch.take(np.arange(min(top_k, len(batch))))
+    ranked = np.concatenate([np.argsort(-scores, kind="stable"), np.arange(depth, len(batch))])[:top_k]
+    rerank_col = np.concatenate([scores, np.full(len(batch) - depth, np.nan, dtype="float32")])
+    return replace(batch, rerank=rerank_col).take(ranked)
@@ -1,24 +1,92 @@
 """Retrieval pipeline: embed query, run vector + BM25 search, fuse with RRF,
 then cross-encoder rerank. The vector backend (FAISS/Qdrant) is chosen in
 ``rag.vector_store``; this module is agnostic to it.
+
+The vector leg (query embedding + store search) and the BM25 leg run
+concurrently on a shared, bounded thread pool, so a Qdrant round-trip overlaps
+the local BM25 scoring. Each leg gets ``RETRIEVE_LEG_TIMEOUT`` seconds; a leg
+that misses it is dropped and the request carries on with the other one.
+
+Candidates travel as a ``rag.candidates.CandidateBatch`` — chunk ids plus
+per-stage score arrays — through fusion and rerank; text is read from the
+chunk table only for passages the cross-encoder scores and for the returned
+top-k. Namespaces from before the chunk store take the dict pipeline.
 """
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, TypeVar, Union
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-from config import EMBEDDING_MODEL_NAME, SIMILARITY_THRESHOLD, TOP_K
-from rag.hybrid import bm25_search, rrf_fuse
-from rag.rerank import rerank
+from config import SIMILARITY_THRESHOLD, TOP_K
+from logging_config import get_logger
+from rag.candidates import CandidateBatch, Ranked, empty_ranked, fuse_rrf
+from rag.chunk_store import ChunkTable, load_chunks
+from rag.hybrid import bm25_search, bm25_search_ids, rrf_fuse
+from rag.models import get_embedder
+from rag.rerank import rerank, rerank_batch, rerank_depth
 from rag.user_store import paths_for
 from rag.vector_store import get_store
 
-model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+log = get_logger("rag.retrieve")
 
 _TOP_K_RETRIEVE = 50  # wide net for recall; narrowed by rerank
 _DEFAULT_FINAL_TOP_K = TOP_K
+_LEG_TIMEOUT = float(os.getenv("RETRIEVE_LEG_TIMEOUT", "5"))
+_LEG_WORKERS = int(os.getenv("RETRIEVE_LEG_WORKERS", "16"))
+
+T = TypeVar("T")
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _leg_pool() -> ThreadPoolExecutor:
+    # Created on first use, so a preloading master never forks with live threads.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=_LEG_WORKERS, thread_name_prefix="retrieve-leg")
+        return _pool
+
+
+def _submit_leg(leg: str, fn: Callable[[], T]) -> "Future[T]":
+    from metrics import RETRIEVAL_LEG_SECONDS
+
+    def _timed() -> T:
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            RETRIEVAL_LEG_SECONDS.labels(leg=leg).observe(time.perf_counter() - start)
+
+    # Copy the context so log lines from the leg keep the request's correlation id.
+    return _leg_pool().submit(contextvars.copy_context().run, _timed)
+
+
+def _leg_result(leg: str, fut: "Future[T]", deadline: float) -> Union[T, Ranked]:
+    """The leg's hits, or none if it misses ``deadline`` (it keeps running in
+    the pool; its result is discarded). Errors propagate as before."""
+    from metrics import RETRIEVAL_LEG_TIMEOUTS
+
+    try:
+        return fut.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        RETRIEVAL_LEG_TIMEOUTS.labels(leg=leg).inc()
+        log.warning("retrieve.leg_timeout", leg=leg, timeout_s=_LEG_TIMEOUT)
+        return empty_ranked()
+
+
+def _hydrate(ranked: Ranked, leg: str, chunks: Optional[ChunkTable]) -> List[Dict]:
+    if chunks is None or not len(ranked[0]):
+        return []
+    return CandidateBatch.from_ranked(ranked, leg=leg).to_dicts(chunks)
 
 
 def reload_index(user_id: Optional[str] = None) -> None:
@@ -32,7 +100,7 @@ def reload_index(user_id: Optional[str] = None) -> None:
 
 
 def embed(texts: List[str]) -> np.ndarray:
-    return model.encode(texts, normalize_embeddings=True).astype("float32")
+    return get_embedder().encode(texts, normalize_embeddings=True).astype("float32")
 
 
 def retrieve(
@@ -42,15 +110,42 @@ def retrieve(
     top_k: int = _DEFAULT_FINAL_TOP_K,
     threshold: float = SIMILARITY_THRESHOLD,
     query_embedding: np.ndarray | None = None,
+    trace: Optional[Dict] = None,
 ) -> List[Dict]:
-    namespace = paths_for(user_id).namespace
+    """Top ``top_k`` chunks for ``query``. Pass a dict as ``trace`` to get the
+    candidate count and the adaptive rerank decision back (used by evals)."""
+    paths = paths_for(user_id)
     store = get_store()
 
-    q_emb = query_embedding if query_embedding is not None else embed([query])
-
-    vector_hits = store.search(namespace, q_emb, _TOP_K_RETRIEVE, threshold)
-    bm25_hits = bm25_search(query, user_id=user_id, metadata=None, top_k=_TOP_K_RETRIEVE)
-
+    # Each leg yields ranked chunk ids, or hit dicts for a namespace that
+    # predates the chunk store.
+    def _vector_leg() -> Union[Ranked, List[Dict]]:
+        q_emb = query_embedding if query_embedding is not None else embed([query])
+        ranked = store.search_ids(paths.namespace, q_emb, _TOP_K_RETRIEVE, threshold)
+        return ranked if ranked is not None else store.search(paths.namespace, q_emb, _TOP_K_RETRIEVE, threshold)
+
+    def _bm25_leg() -> Union[Ranked, List[Dict]]:
+        ranked = bm25_search_ids(query, user_id=user_id, top_k=_TOP_K_RETRIEVE)
+        return ranked if ranked is not None else bm25_search(query, user_id=user_id, top_k=_TOP_K_RETRIEVE)
+
+    deadline = time.monotonic() + _LEG_TIMEOUT
+    bm25_fut = _submit_leg("bm25", _bm25_leg)
+    vector_fut = _submit_leg("vector", _vector_leg)
+    vector = _leg_result("vector", vector_fut, deadline)
+    bm25 = _leg_result("bm25", bm25_fut, deadline)
+
+    chunks = load_chunks(paths)
+    if isinstance(vector, tuple) and isinstance(bm25, tuple):
+        if chunks is None:
+            return []
+        batch = fuse_rrf(vector, bm25, top_k=_TOP_K_RETRIEVE) if len(bm25[0]) else CandidateBatch.from_ranked(vector)
+        decision = rerank_depth(batch, top_k=top_k, namespace_size=len(chunks))
+        if trace is not None:
+            trace.update(candidates=len(batch), rerank_depth=decision.depth, rerank_decision=decision.decision)
+        return rerank_batch(query, batch, chunks, top_k=top_k, depth=decision.depth).to_dicts(chunks)
+
+    vector_hits = vector if isinstance(vector, list) else _hydrate(vector, "vector", chunks)
+    bm25_hits = bm25 if isinstance(bm25, list) else _hydrate(bm25, "bm25", chunks)
     if bm25_hits:
         fused = rrf_fuse(vector_hits, bm25_hits, top_k=_TOP_K_RETRIEVE)
     else:
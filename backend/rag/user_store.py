@@ -1,7 +1,7 @@
 """Per-user index paths and raw-file bookkeeping.
 
-Each user gets ``data/index/users/{user_id}/`` (faiss.index + metadata.json);
-callers with no user_id fall back to a shared ``_anon`` namespace.
+Each user gets ``data/index/users/{user_id}/`` (faiss.index + chunks.bin +
+manifest.json; older indexes have metadata.json instead of chunks.bin); callers with no user_id fall back to a shared ``_anon`` namespace.
 """
 from __future__ import annotations
 
@@ -23,11 +23,15 @@ class IndexPaths:
     namespace: str
     dir: str
     faiss_index: str
-    metadata: str
+    metadata: str  # legacy JSON chunk list, superseded by ``chunks``
+    chunks: str  # binary chunk table (rag.chunk_store)
     storage_meta: str  # tracks total bytes for quota enforcement
+    manifest: str  # source → content hash of what's currently indexed
 
     def exists(self) -> bool:
-        return os.path.exists(self.faiss_index) and os.path.exists(self.metadata)
+        return os.path.exists(self.faiss_index) and (
+            os.path.exists(self.chunks) or os.path.exists(self.metadata)
+        )
 
 
 def _safe_namespace(user_id: str | None) -> str:
@@ -48,7 +52,9 @@ def paths_for(user_id: str | None) -> IndexPaths:
         dir=str(base),
         faiss_index=str(base / "faiss.index"),
         metadata=str(base / "metadata.json"),
+        chunks=str(base / "chunks.bin"),
         storage_meta=str(base / "storage.json"),
+        manifest=str(base / "manifest.json"),
     )
 
 
@@ -75,6 +81,14 @@ def list_raw_files(user_id: str | None) -> list[str]:
     return [obj.key for obj in get_storage().list_keys(_safe_namespace(user_id))]
 
 
+def list_raw_objects(user_id: str | None) -> list:
+    """Like ``list_raw_files`` but keeps size / mtime, so incremental ingest can
+    skip files whose stat matches the manifest without fetching them. Raises
+    if the listing fails: an incomplete one would read as deleted sources."""
+    from storage import get_storage
+    return get_storage().list_keys(_safe_namespace(user_id), strict=True)
+
+
 def wipe_namespace(user_id: str | None) -> None:
     paths = paths_for(user_id)
     if os.path.exists(paths.dir):
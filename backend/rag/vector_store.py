@@ -3,19 +3,32 @@
 Backend is Qdrant when ``VECTOR_BACKEND=qdrant`` or ``QDRANT_URL`` is set, else
 FAISS on local disk. The namespace-keyed interface (upsert/search/delete/exists)
 hides the backend; namespace is the per-user id (``_anon`` shared).
+
+``writer(namespace)`` opens an ``IndexWriter`` for incremental ingests: drop the
+chunks of some sources, add new ones, then ``commit``. ``upsert`` is a writer
+with ``replace=True``. The FAISS backend keys vectors by stable chunk id, so a
+single-document change only touches that document's vectors.
+
+``search`` returns hydrated dicts; ``search_ids`` returns the same ranking as
+stable chunk ids and scores (``rag.candidates.Ranked``) for the retrieval
+pipeline, or None when the namespace can't be served by id (Qdrant points
+written before the chunk store).
 """
 from __future__ import annotations
 
-import json
 import os
-import shutil
+import tempfile
 import threading
-from typing import Dict, List, Optional, Protocol
+import uuid
+from typing import Dict, Iterable, List, Optional, Protocol
 
 import numpy as np
 
 from logging_config import get_logger
-from rag.user_store import paths_for
+from rag.candidates import CandidateBatch, Ranked, empty_ranked
+from rag.chunk_store import ChunkTableWriter, delete_chunks, load_chunks
+from rag.namespace_cache import get_cache
+from rag.user_store import IndexPaths, paths_for
 from resilience import with_retry
 
 log = get_logger("rag.vector_store")
@@ -38,13 +51,24 @@ def _qdrant_call(fn, *args, **kwargs):
     return fn(*args, **kwargs)
 
 
+class IndexWriter(Protocol):
+    def remove_sources(self, sources: Iterable[str]) -> None: ...
+    def add(self, vectors: np.ndarray, metadata: List[Dict]) -> None: ...
+    def commit(self) -> None: ...
+
+
 class VectorStore(Protocol):
     backend: str
 
+    def writer(self, namespace: str, *, replace: bool = False) -> IndexWriter: ...
+
     def upsert(self, namespace: str, vectors: np.ndarray, metadata: List[Dict]) -> None: ...
     def search(
         self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float
     ) -> List[Dict]: ...
+    def search_ids(
+        self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float
+    ) -> Optional[Ranked]: ...
     def delete(self, namespace: str) -> None: ...
     def exists(self, namespace: str) -> bool: ...
     def get_metadata(self, namespace: str) -> List[Dict]: ...
@@ -52,6 +76,16 @@ class VectorStore(Protocol):
 
 # ---------------------------------------------------------------- FAISS backend
 
+# Rebuild the HNSW graph once tombstoned vectors exceed this share of the index.
+_COMPACT_RATIO = float(os.getenv("FAISS_COMPACT_RATIO", "0.25"))
+# mmap: map the index read-only so its pages sit in the shared OS page cache;
+# heap: read it into each worker's memory. (The chunk table is always mapped.)
+_LOAD_MODE = os.getenv("FAISS_LOAD_MODE", "mmap").lower()
+
+
+def _paths(namespace: str) -> IndexPaths:
+    return paths_for(None if namespace == "_anon" else namespace)
+
 
 class _FaissStore:
     backend = "faiss"
@@ -59,96 +93,185 @@ class _FaissStore:
     def __init__(self) -> None:
         import faiss  # local import; tests stub this out
         self._faiss = faiss
-        self._cache: dict[str, tuple] = {}  # namespace → (index, metadata)
         self._lock = threading.Lock()
 
     def _load(self, namespace: str):
+        cache = get_cache()
+        hit = cache.get(namespace, "faiss")
+        if hit is not None:
+            return hit
         with self._lock:
-            hit = self._cache.get(namespace)
+            hit = cache.get(namespace, "faiss")
             if hit is not None:
                 return hit
-            paths = paths_for(None if namespace == "_anon" else namespace)
+            paths = _paths(namespace)
             if not paths.exists():
                 return None
-            index = self._faiss.read_index(paths.faiss_index)
+            index = self._read_index(paths.faiss_index, mmap=_LOAD_MODE == "mmap")
             try:
-                index.hnsw.efSearch = 64
+                self._hnsw(index).efSearch = 64
             except AttributeError:
                 pass
-            with open(paths.metadata, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
-            self._cache[namespace] = (index, metadata)
-            return self._cache[namespace]
+            cache.put(namespace, "faiss", index, os.path.getsize(paths.faiss_index))
+            return index
+
+    def _read_index(self, path: str, *, mmap: bool):
+        if mmap:
+            try:
+                return self._faiss.read_index(path, self._faiss.IO_FLAG_MMAP | self._faiss.IO_FLAG_READ_ONLY)
+            except (AttributeError, RuntimeError) as e:
+                # Older FAISS builds can't map every index type.
+                log.info("faiss.mmap_unavailable", path=path, error=str(e))
+        return self._faiss.read_index(path)
+
+    def _hnsw(self, index):
+        inner = self._faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+        return inner.hnsw
+
+    def _new_index(self, dim: int):
+        # The metric must go to the constructor: setting ``metric_type`` after
+        # the fact leaves the flat storage on L2 and inverts the ranking.
+        hnsw = self._faiss.IndexHNSWFlat(dim, 32, self._faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = 200
+        return self._faiss.IndexIDMap2(hnsw)
+
+    def _invalidate(self, namespace: str) -> None:
+        get_cache().invalidate(namespace, "faiss")
+
+    def writer(self, namespace: str, *, replace: bool = False) -> "_FaissWriter":
+        return _FaissWriter(self, namespace, replace=replace)
 
     def upsert(self, namespace: str, vectors: np.ndarray, metadata: List[Dict]) -> None:
-        paths = paths_for(None if namespace == "_anon" else namespace)
-        # Reset namespace dir (destructive within user's own namespace only).
-        if os.path.exists(paths.dir):
-            # Preserve raw/ — only the index files get rewritten.
-            for entry in os.listdir(paths.dir):
-                full = os.path.join(paths.dir, entry)
-                if entry == "raw":
-                    continue
-                if os.path.isfile(full):
-                    os.remove(full)
-                elif os.path.isdir(full):
-                    shutil.rmtree(full)
-        os.makedirs(paths.dir, exist_ok=True)
-
-        dim = vectors.shape[1]
-        index = self._faiss.IndexHNSWFlat(dim, 32)
-        index.hnsw.efConstruction = 200
-        index.metric_type = self._faiss.METRIC_INNER_PRODUCT
-        index.train(vectors)
-        index.add(vectors)
-        self._faiss.write_index(index, paths.faiss_index)
-        with open(paths.metadata, "w", encoding="utf-8") as f:
-            json.dump(metadata, f, indent=2)
+        writer = self.writer(namespace, replace=True)
+        writer.add(vectors, metadata)
+        writer.commit()
 
-        with self._lock:
-            self._cache.pop(namespace, None)
+    def search_ids(
+        self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float
+    ) -> Optional[Ranked]:
+        index = self._load(namespace)
+        # Pre-id indexes are plain HNSW whose labels are row positions, which
+        # is what the chunk table assumes for legacy rows without an id.
+        chunks = load_chunks(_paths(namespace))
+        if index is None or chunks is None:
+            return empty_ranked()
+        # Over-fetch by the tombstone count so skipped ids don't starve top_k.
+        dead = max(index.ntotal - len(chunks), 0)
+        scores, ids = index.search(query_vec, min(top_k + dead, index.ntotal))
+        scores, ids = scores[0], ids[0].astype("int64")
+        # Only ids in both files are served: tombstones, and vectors a writer
+        # swapped in before the chunk table that names them.
+        keep = (ids >= 0) & (scores >= threshold) & np.isin(ids, chunks.ids)
+        return ids[keep][:top_k], scores[keep][:top_k]
 
     def search(
         self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float
     ) -> List[Dict]:
-        loaded = self._load(namespace)
-        if loaded is None:
-            return []
-        index, metadata = loaded
-        scores, indices = index.search(query_vec, top_k)
-        out: list[dict] = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < 0 or idx >= len(metadata):
-                continue
-            if score < threshold:
-                continue
-            chunk = metadata[idx]
-            out.append({
-                "chunk_id": chunk["chunk_id"],
-                "source": chunk["source"],
-                "text": chunk["text"],
-                "score": float(score),
-            })
-        return out
+        ids, scores = self.search_ids(namespace, query_vec, top_k, threshold)
+        chunks = load_chunks(_paths(namespace))
+        return CandidateBatch.from_ranked((ids, scores)).to_dicts(chunks) if len(ids) else []
 
     def delete(self, namespace: str) -> None:
-        paths = paths_for(None if namespace == "_anon" else namespace)
+        paths = _paths(namespace)
         if os.path.exists(paths.faiss_index):
             os.remove(paths.faiss_index)
-        if os.path.exists(paths.metadata):
-            os.remove(paths.metadata)
-        with self._lock:
-            self._cache.pop(namespace, None)
+        delete_chunks(paths)
+        self._invalidate(namespace)
 
     def exists(self, namespace: str) -> bool:
-        paths = paths_for(None if namespace == "_anon" else namespace)
-        return paths.exists()
+        return _paths(namespace).exists()
 
     def get_metadata(self, namespace: str) -> List[Dict]:
-        loaded = self._load(namespace)
-        if loaded is None:
-            return []
-        return loaded[1]
+        chunks = load_chunks(_paths(namespace))
+        return chunks.to_dicts() if chunks is not None else []
+
+
+class _FaissWriter:
+    """Edits one namespace's ID-mapped HNSW index; ``commit`` writes it back.
+
+    Vectors are keyed by the chunk store's stable ids. ``add`` appends under
+    fresh ids; ``remove_sources`` only drops chunk-table rows, leaving the
+    vectors in the graph as tombstones that search skips. Once tombstones pass
+    ``FAISS_COMPACT_RATIO`` of the index, ``commit`` rebuilds the graph from
+    the live vectors under the same ids (no re-embedding). Files are written to
+    a unique temp name and renamed so readers never see a half-written index.
+    The index is swapped in before the chunk table: a crash between the two
+    leaves vectors whose ids no chunk names yet, which search skips and the
+    next writer treats as tombstones, never chunks without vectors.
+    """
+
+    def __init__(self, store: _FaissStore, namespace: str, *, replace: bool) -> None:
+        self._store = store
+        self._namespace = namespace
+        self._paths = _paths(namespace)
+        self._index = None
+        self._chunks = ChunkTableWriter(self._paths, replace=replace)
+        if not replace and self._paths.exists():
+            self._index = store._faiss.read_index(self._paths.faiss_index)
+            if not hasattr(self._index, "id_map"):
+                self._migrate()
+            elif self._index.ntotal:
+                # Tombstoned ids may sit above every live one; never reuse them.
+                top = int(store._faiss.vector_to_array(self._index.id_map).max())
+                self._chunks.next_id = max(self._chunks.next_id, top + 1)
+
+    def _migrate(self) -> None:
+        """Re-key a pre-id index: row position becomes the chunk's stable id
+        (the chunk table already reads id-less rows that way)."""
+        vectors = self._index.reconstruct_n(0, self._index.ntotal)
+        ids = np.arange(len(vectors), dtype="int64")
+        self._index = self._store._new_index(vectors.shape[1])
+        self._index.add_with_ids(vectors, ids)
+        self._chunks.dirty = True
+        log.info("faiss.migrated_to_ids", namespace=self._namespace, vectors=len(ids))
+
+    def remove_sources(self, sources: Iterable[str]) -> None:
+        if self._index is not None:
+            self._chunks.remove_sources(list(sources))
+
+    def add(self, vectors: np.ndarray, metadata: List[Dict]) -> None:
+        if not len(metadata):
+            return
+        if self._index is None:
+            self._index = self._store._new_index(vectors.shape[1])
+        self._index.add_with_ids(vectors, self._chunks.add(metadata))
+
+    def _compact(self) -> None:
+        faiss = self._store._faiss
+        inner = faiss.downcast_index(self._index.index)
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+        ids = faiss.vector_to_array(self._index.id_map)
+        live = np.isin(ids, self._chunks.live_ids())
+        dead = int((~live).sum())
+        self._index = self._store._new_index(vectors.shape[1])
+        self._index.add_with_ids(vectors[live], ids[live])
+        log.info("faiss.compacted", namespace=self._namespace, dropped=dead, kept=int(live.sum()))
+
+    def commit(self) -> None:
+        if not self._chunks.dirty:
+            return
+        if self._index is None or not len(self._chunks):
+            self._store.delete(self._namespace)
+            self._chunks.dirty = False
+            return
+        dead = self._index.ntotal - len(self._chunks)
+        if dead > _COMPACT_RATIO * self._index.ntotal:
+            self._compact()
+        os.makedirs(self._paths.dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self._paths.dir, prefix="faiss.index.", suffix=".tmp")
+        os.close(fd)
+        try:
+            self._store._faiss.write_index(self._index, tmp)
+            os.chmod(tmp, 0o644)  # mkstemp creates 0600
+            os.replace(tmp, self._paths.faiss_index)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        self._store._invalidate(self._namespace)
+        self._chunks.commit()
 
 
 # --------------------------------------------------------------- Qdrant backend
@@ -184,6 +307,12 @@ class _QdrantStore:
                     field_name="user_id",
                     field_schema=qm.PayloadSchemaType.KEYWORD,
                 )
+                # ...and source, for per-file deletes on incremental ingest.
+                self._client.create_payload_index(
+                    collection_name=self.COLLECTION,
+                    field_name="source",
+                    field_schema=qm.PayloadSchemaType.KEYWORD,
+                )
                 log.info("qdrant.collection_created", name=self.COLLECTION, dim=dim)
             self._ensured_dim = dim
 
@@ -191,41 +320,18 @@ class _QdrantStore:
         qm = self._models
         return qm.Filter(must=[qm.FieldCondition(key="user_id", match=qm.MatchValue(value=namespace))])
 
+    def writer(self, namespace: str, *, replace: bool = False) -> "_QdrantWriter":
+        return _QdrantWriter(self, namespace, replace=replace)
+
     def upsert(self, namespace: str, vectors: np.ndarray, metadata: List[Dict]) -> None:
-        self._ensure_collection(vectors.shape[1])
-        # Replace this user's vectors atomically: delete-by-filter then insert.
-        _qdrant_call(
-            self._client.delete,
-            collection_name=self.COLLECTION,
-            points_selector=self._models.FilterSelector(filter=self._user_filter(namespace)),
-        )
-        points = []
-        for i, (vec, meta) in enumerate(zip(vectors, metadata)):
-            points.append(
-                self._models.PointStruct(
-                    id=f"{namespace}:{meta['chunk_id']}",
-                    vector=vec.tolist(),
-                    payload={
-                        "user_id": namespace,
-                        "chunk_id": meta["chunk_id"],
-                        "source": meta["source"],
-                        "text": meta["text"],
-                    },
-                )
-            )
-        # Batch in chunks of 256 to keep individual requests bounded.
-        for start in range(0, len(points), 256):
-            _qdrant_call(
-                self._client.upsert,
-                collection_name=self.COLLECTION,
-                points=points[start:start + 256],
-            )
+        # Replace this user's vectors: delete-by-filter then insert.
+        writer = self.writer(namespace, replace=True)
+        writer.add(vectors, metadata)
+        writer.commit()
 
-    def search(
-        self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float
-    ) -> List[Dict]:
+    def _search_points(self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float):
         try:
-            hits = _qdrant_call(
+            return _qdrant_call(
                 self._client.search,
                 collection_name=self.COLLECTION,
                 query_vector=query_vec[0].tolist(),
@@ -236,13 +342,42 @@ class _QdrantStore:
         except Exception as e:  # collection might not exist yet
             log.warning("qdrant.search_failed", error=str(e))
             return []
+
+    def search_ids(
+        self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float
+    ) -> Optional[Ranked]:
+        hits = self._search_points(namespace, query_vec, top_k, threshold)
+        payloads = [h.payload or {} for h in hits]
+        if any("text" in p or "id" not in p for p in payloads):
+            return None  # points from before the chunk store: use search()
+        chunks = load_chunks(_paths(namespace))
+        ids = np.fromiter((p["id"] for p in payloads), dtype="int64", count=len(payloads))
+        scores = np.fromiter((h.score for h in hits), dtype="float32", count=len(hits))
+        keep = np.isin(ids, chunks.ids) if chunks is not None else np.zeros(len(ids), dtype=bool)
+        if not keep.all():
+            log.warning("qdrant.hits_without_chunks", namespace=namespace, dropped=int((~keep).sum()))
+        return ids[keep], scores[keep]
+
+    def search(
+        self, namespace: str, query_vec: np.ndarray, top_k: int, threshold: float
+    ) -> List[Dict]:
+        hits = self._search_points(namespace, query_vec, top_k, threshold)
+        # Payloads carry the chunk id; text comes from the local chunk store.
+        # Points written before the chunk store still hold their own text.
+        chunks = load_chunks(_paths(namespace))
         out: list[dict] = []
         for h in hits:
             payload = h.payload or {}
+            text = payload.get("text")
+            if text is None:
+                row = chunks.row(payload["id"]) if chunks is not None and "id" in payload else -1
+                if row < 0:
+                    continue
+                text = chunks.text(row)
             out.append({
                 "chunk_id": payload.get("chunk_id"),
                 "source": payload.get("source"),
-                "text": payload.get("text"),
+                "text": text,
                 "score": float(h.score),
             })
         return out
@@ -255,6 +390,7 @@ class _QdrantStore:
             )
         except Exception as e:
             log.warning("qdrant.delete_failed", error=str(e))
+        delete_chunks(_paths(namespace))
 
     def exists(self, namespace: str) -> bool:
         try:
@@ -270,6 +406,9 @@ class _QdrantStore:
             return False
 
     def get_metadata(self, namespace: str) -> List[Dict]:
+        chunks = load_chunks(_paths(namespace))
+        if chunks is not None:
+            return chunks.to_dicts()
         out: list[dict] = []
         try:
             offset = None
@@ -297,6 +436,81 @@ class _QdrantStore:
         return out
 
 
+class _QdrantWriter:
+    """Qdrant applies each call server-side; ``commit`` writes the local chunk
+    table and finishes a replace that never saw an ``add``. Point payloads hold
+    ids and source only, no text."""
+
+    def __init__(self, store: _QdrantStore, namespace: str, *, replace: bool) -> None:
+        self._store = store
+        self._namespace = namespace
+        self._replace = replace
+        self._chunks = ChunkTableWriter(_paths(namespace), replace=replace)
+
+    def _clear_if_replacing(self) -> None:
+        if not self._replace:
+            return
+        _qdrant_call(
+            self._store._client.delete,
+            collection_name=self._store.COLLECTION,
+            points_selector=self._store._models.FilterSelector(
+                filter=self._store._user_filter(self._namespace)
+            ),
+        )
+        self._replace = False
+
+    def remove_sources(self, sources: Iterable[str]) -> None:
+        drop = sorted(set(sources))
+        if not drop:
+            return
+        self._chunks.remove_sources(drop)
+        qm = self._store._models
+        flt = qm.Filter(must=[
+            qm.FieldCondition(key="user_id", match=qm.MatchValue(value=self._namespace)),
+            qm.FieldCondition(key="source", match=qm.MatchAny(any=drop)),
+        ])
+        _qdrant_call(
+            self._store._client.delete,
+            collection_name=self._store.COLLECTION,
+            points_selector=qm.FilterSelector(filter=flt),
+        )
+
+    def add(self, vectors: np.ndarray, metadata: List[Dict]) -> None:
+        if not len(metadata):
+            return
+        store = self._store
+        store._ensure_collection(vectors.shape[1])
+        self._clear_if_replacing()
+        points = []
+        for vec, meta, cid in zip(vectors, metadata, self._chunks.add(metadata)):
+            points.append(
+                store._models.PointStruct(
+                    # Qdrant point ids must be unsigned ints or UUIDs.
+                    id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"{self._namespace}:{cid}")),
+                    vector=vec.tolist(),
+                    payload={
+                        "user_id": self._namespace,
+                        "id": int(cid),
+                        "chunk_id": meta["chunk_id"],
+                        "source": meta["source"],
+                    },
+                )
+            )
+        # Batch in chunks of 256 to keep individual requests bounded.
+        for start in range(0, len(points), 256):
+            _qdrant_call(
+                store._client.upsert,
+                collection_name=store.COLLECTION,
+                points=points[start:start + 256],
+            )
+
+    def commit(self) -> None:
+        if self._replace:
+            self._store.delete(self._namespace)
+            self._replace = False
+        self._chunks.commit()
+
+
 # ----------------------------------------------------------------- factory
 
 
@@ -326,7 +540,9 @@ def get_store() -> VectorStore:
 
 
 def reset_store_for_tests() -> None:
-    """Drop the cached store. Tests use this after monkeypatching env."""
+    """Drop the cached store and loaded namespaces. Tests use this after
+    monkeypatching env."""
     global _store
     with _store_lock:
         _store = None
+    get_cache().clear()
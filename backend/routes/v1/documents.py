@@ -26,6 +26,7 @@ from rag.user_store import (
 from rag.vector_store import get_store
 from settings import get_settings
 from storage import materialize_keys_to_dir
+from tasks import INGEST_MODE, sync_user_index
 
 bp = Blueprint("documents", __name__)
 log = get_logger("routes.documents")
@@ -57,9 +58,14 @@ def delete_user_document(doc_id: str):
     if raw_path:
         remove_raw_file(raw_path)
 
-    # Re-ingest remaining files so the index reflects the deletion.
     remaining_keys = list_raw_files(user_id)
-    if remaining_keys:
+    if remaining_keys and INGEST_MODE == "incremental":
+        # Drop just this file's chunks (manifest diff against storage); the
+        # remaining files are neither fetched nor re-embedded.
+        sync_user_index(user_id)
+        reload_index(user_id=user_id)
+    elif remaining_keys:
+        # Full mode: re-ingest remaining files so the index reflects the deletion.
         # Storage keys may be local paths or s3:// URIs — materialize all of
         # them to a tmp dir so the ingest layer (which only knows local paths)
         # works against either backend.
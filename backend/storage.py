@@ -46,7 +46,7 @@ class RawStorage(Protocol):
 
     def save(self, user_id: str, src_path: str, original_name: str) -> str: ...
     def remove(self, key: str) -> bool: ...
-    def list_keys(self, user_id: str) -> List[StoredObject]: ...
+    def list_keys(self, user_id: str, *, strict: bool = False) -> List[StoredObject]: ...
     def fetch_to_local(self, key: str, dest_dir: Optional[str] = None) -> str: ...
     def signed_url(self, key: str, ttl: int = 300) -> Optional[str]: ...
 
@@ -84,7 +84,7 @@ class _LocalStorage:
         except OSError:
             return False
 
-    def list_keys(self, user_id: str) -> List[StoredObject]:
+    def list_keys(self, user_id: str, *, strict: bool = False) -> List[StoredObject]:
         d = self._user_dir(user_id)
         out: list[StoredObject] = []
         for p in d.iterdir():
@@ -177,7 +177,9 @@ class _S3Storage:
             log.warning("s3.delete_failed", key=key, error=str(e))
             return False
 
-    def list_keys(self, user_id: str) -> List[StoredObject]:
+    def list_keys(self, user_id: str, *, strict: bool = False) -> List[StoredObject]:
+        """All of the user's objects. A listing error yields what was read so
+        far, or raises with ``strict`` (callers that treat absence as deletion)."""
         out: list[StoredObject] = []
         prefix = f"{user_id}/"
         paginator = self._client.get_paginator("list_objects_v2")
@@ -192,7 +194,9 @@ class _S3Storage:
                         modified=obj["LastModified"].timestamp(),
                     ))
         except Exception as e:
-            log.warning("s3.list_failed", user_id=user_id, error=str(e))
+            log.warning("s3.list_failed", user_id=user_id, error=str(e), strict=strict)
+            if strict:
+                raise
         return out
 
     def fetch_to_local(self, key: str, dest_dir: Optional[str] = None) -> str:
@@ -9,6 +9,6 @@ import os
 
 ASYNC_MODE = os.getenv("ASYNC_MODE", "sync").lower()
 
-from .ingest_tasks import enqueue_ingest, get_job_status  # noqa: E402
+from .ingest_tasks import INGEST_MODE, enqueue_ingest, get_job_status, sync_user_index  # noqa: E402
 
-__all__ = ["ASYNC_MODE", "enqueue_ingest", "get_job_status"]
+__all__ = ["ASYNC_MODE", "INGEST_MODE", "enqueue_ingest", "get_job_status", "sync_user_index"]
@@ -3,10 +3,13 @@
 Uses a small job-state store so the client can poll ``/chat/jobs/<id>``. In
 sync mode the job is completed by the time ``enqueue_ingest`` returns. In
 Celery mode the HTTP request returns immediately with a pending jobId.
+
+``INGEST_MODE=incremental`` (default) only processes raw files that were added,
+changed or removed since the namespace manifest was written; ``full`` rebuilds
+the user's whole corpus on every job.
 """
 from __future__ import annotations
 
-import json
 import os
 import tempfile
 import time
@@ -16,20 +19,23 @@ from typing import Optional
 
 from logging_config import get_logger
 from metrics import INGESTION_DURATION
-from rag.ingest import ingest_files
+from rag.ingest import ingest_files, ingest_files_incremental, namespace_lock
+from rag.manifest import ManifestEntry, load_manifest
 from rag.retrieve import reload_index
-from rag.user_store import add_user_bytes, list_raw_files
-from storage import materialize_keys_to_dir
+from rag.user_store import add_user_bytes, list_raw_files, list_raw_objects, paths_for
+from storage import StoredObject, materialize_keys_to_dir
 
 log = get_logger("tasks.ingest")
 
+INGEST_MODE = os.getenv("INGEST_MODE", "incremental").lower()
+
 # --- Job state store -------------------------------------------------------
 #
 # Uses the shared cache backend if available (Redis or memory). This means
 # jobs survive across workers in prod (Redis) but not across process restarts
 # in dev (memory). A persistent store is the eventual home for this.
 
-from cache import _b, _key  # noqa: E402
+from cache import _b, _key, decode_value, encode_value, invalidate_user  # noqa: E402
 
 
 @dataclass
@@ -48,22 +54,63 @@ def _job_key(job_id: str) -> str:
 
 
 def _save(state: JobState) -> None:
-    _b().set(_job_key(state.id), json.dumps(asdict(state)), ttl=60 * 60 * 24)
+    _b().set(_job_key(state.id), encode_value(asdict(state)), ttl=60 * 60 * 24)
 
 
 def _load(job_id: str) -> Optional[JobState]:
-    raw = _b().get(_job_key(job_id))
-    if not raw:
+    data = decode_value(_b().get(_job_key(job_id)))
+    if not data:
         return None
     try:
-        return JobState(**json.loads(raw))
-    except (ValueError, TypeError):
+        return JobState(**data)
+    except TypeError:
         return None
 
 
 # --- Task body -------------------------------------------------------------
 
 
+def _stat_changed(entry: Optional[ManifestEntry], obj: StoredObject) -> bool:
+    return entry is None or entry.size != obj.size or entry.modified != obj.modified
+
+
+def sync_user_index(user_id: str) -> None:
+    """Ingest only the raw files whose storage stat differs from the manifest,
+    plus drop sources no longer in storage. Unchanged files are not fetched.
+    A failed storage listing raises (failing the job) rather than removing
+    every source it didn't return. Holds the namespace lock from the manifest
+    read to the manifest write: a concurrent job or a delete's sync waits."""
+    with namespace_lock(user_id):
+        _sync_locked(user_id)
+
+
+def _sync_locked(user_id: str) -> None:
+    manifest = load_manifest(paths_for(user_id))
+    objects = list_raw_objects(user_id)
+    stale = [o for o in objects if _stat_changed(manifest.get(o.name), o)]
+    present = {o.name for o in objects}
+    removed = [name for name in manifest if name not in present]
+    if not stale and not removed:
+        log.info("ingest.delta_empty", user_id=user_id)
+        return
+    with tempfile.TemporaryDirectory(prefix="docai_delta_") as tmpd:
+        local = materialize_keys_to_dir([o.key for o in stale], tmpd)
+        delta = ingest_files_incremental(
+            local,
+            user_id=user_id,
+            removed=removed,
+            stats={o.name: (o.size, o.modified) for o in stale},
+        )
+    log.info(
+        "ingest.delta_applied",
+        user_id=user_id,
+        added=len(delta.added),
+        changed=len(delta.changed),
+        removed=len(delta.removed),
+        unchanged=len(delta.unchanged),
+    )
+
+
 def _run_ingest(job_id: str, file_paths: list[str], total_bytes: int, user_id: Optional[str]):
     state = _load(job_id) or JobState(id=job_id, status="pending", user_id=user_id)
     state.status = "running"
@@ -72,21 +119,27 @@ def _run_ingest(job_id: str, file_paths: list[str], total_bytes: int, user_id: O
     materialized_dir: Optional[tempfile.TemporaryDirectory] = None
     ingest_t0 = time.time()
     try:
-        # Re-ingest the user's whole corpus so retrieval stays consistent after
-        # uploads/deletions. Authenticated uploads are already saved to the raw
-        # store (under their original names) before this runs, so ingest from
-        # there; indexing the temp paths too would duplicate each doc under its
+        # Authenticated uploads are already saved to the raw store (under their
+        # original names) before this runs, so ingest from there; indexing the
+        # temp paths too would duplicate each doc under its
         # "{user}__{uuid}__name" temp filename. Anonymous uploads aren't
         # persisted, so fall back to the temp batch. (S3 keys download first.)
-        existing_keys = list_raw_files(user_id) if user_id else []
-        if existing_keys:
-            materialized_dir = tempfile.TemporaryDirectory(prefix="docai_existing_")
-            existing_local = materialize_keys_to_dir(existing_keys, materialized_dir.name)
+        if user_id and INGEST_MODE == "incremental":
+            sync_user_index(user_id)
         else:
-            existing_local = []
-        sources = existing_local if user_id else list(file_paths)
-        ingest_files(sources or list(file_paths), user_id=user_id)
+            # Full mode: re-ingest the user's whole corpus.
+            existing_keys = list_raw_files(user_id) if user_id else []
+            if existing_keys:
+                materialized_dir = tempfile.TemporaryDirectory(prefix="docai_existing_")
+                existing_local = materialize_keys_to_dir(existing_keys, materialized_dir.name)
+            else:
+                existing_local = []
+            sources = existing_local if user_id else list(file_paths)
+            ingest_files(sources or list(file_paths), user_id=user_id)
         reload_index(user_id=user_id)
+        # The route already bumped the generation at enqueue; answers cached
+        # while this job ran came from the old index, so retire them too.
+        invalidate_user(user_id)
         if user_id:
             add_user_bytes(user_id, total_bytes)
         state.status = "succeeded"
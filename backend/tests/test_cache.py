@@ -0,0 +1,337 @@
+"""Answer cache tests against the in-process backend: exact hits, the packed
+semantic index, searched both by scanning the fetched blob and through the
+in-process FAISS mirror (only the winning entry is read either way),
+generation-based invalidation (and bypass when the generation can't be
+read), the two-tier wrapper (process L1 over a
+shared L2, kept coherent by pub/sub) and the value codecs.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+import cache
+
+
+class _CountingBackend(cache._InMemoryBackend):
+    def __init__(self) -> None:
+        super().__init__()
+        self.calls: list[str] = []
+
+    def get(self, key):
+        self.calls.append("get")
+        return super().get(key)
+
+    def mget(self, keys):
+        self.calls.append(f"mget:{len(keys)}")
+        return [cache._InMemoryBackend.get(self, k) for k in keys]
+
+    def vec_fetch(self, key):
+        self.calls.append("vec_fetch")
+        return super().vec_fetch(key)
+
+    def vec_tail(self, key, seen, width):
+        self.calls.append("vec_tail")
+        return super().vec_tail(key, seen, width)
+
+
+@pytest.fixture(params=["ann", "scan"])
+def backend(request, monkeypatch):
+    from rag.namespace_cache import get_cache
+
+    if request.param == "ann":
+        pytest.importorskip("faiss")
+    monkeypatch.setattr(cache, "SEMANTIC_ANN", request.param == "ann")
+    b = _CountingBackend()
+    monkeypatch.setattr(cache, "_backend", b)
+    get_cache().clear()
+    yield b
+    get_cache().clear()
+
+
+def _fetch(backend) -> str:
+    return "vec_tail" if cache.SEMANTIC_ANN else "vec_fetch"
+
+
+def _vec(*xs: float) -> np.ndarray:
+    return np.asarray(xs, dtype="float32")
+
+
+def test_exact_roundtrip(backend):
+    cache.set_exact("u", "What is BM25?", 5, "a ranking function", ["a.txt"])
+    hit = cache.get_exact("u", "  what is bm25?", 5)
+    assert hit is not None and hit.answer == "a ranking function"
+    assert cache.get_exact("u", "What is BM25?", 10) is None
+
+
+def test_invalidation_bumps_the_generation_and_retires_only_that_namespace(backend):
+    for user in ("u", "other"):
+        cache.set_exact(user, "q", 5, f"{user} answer", [])
+        cache.semantic_set(user, "q", _vec(1.0, 0.0, 0.0), f"{user} answer", [])
+    assert cache.semantic_get("u", _vec(1.0, 0.0, 0.0)).answer == "u answer"  # warms the ANN mirror
+
+    cache.invalidate_user("u")
+    assert cache.generation("u") == 1 and cache.generation("other") == 0
+    assert cache.get_exact("u", "q", 5) is None
+    assert cache.semantic_get("u", _vec(1.0, 0.0, 0.0)) is None
+    assert cache.get_exact("other", "q", 5).answer == "other answer"
+    assert cache.semantic_get("other", _vec(1.0, 0.0, 0.0)).answer == "other answer"
+
+    cache.set_exact("u", "q", 5, "fresh", [])
+    cache.semantic_set("u", "q", _vec(1.0, 0.0, 0.0), "fresh", [])
+    assert cache.get_exact("u", "q", 5).answer == "fresh"
+    assert cache.semantic_get("u", _vec(1.0, 0.0, 0.0)).answer == "fresh"
+
+
+def test_semantic_lookup_is_one_fetch_and_reads_only_the_winner(backend):
+    for i in range(20):
+        cache.semantic_set("u", f"q{i}", _vec(1.0, i, 0.0), f"answer {i}", [])
+    cache.semantic_set("u", "target", _vec(0.0, 0.0, 1.0), "the answer", ["t.txt"])
+    backend.calls.clear()
+
+    hit = cache.semantic_get("u", _vec(0.0, 0.05, 1.0))
+    assert hit is not None and (hit.query, hit.sources) == ("target", ["t.txt"])
+    assert backend.calls == [_fetch(backend), "mget:1"]
+
+    backend.calls.clear()
+    assert cache.semantic_get("u", _vec(-1.0, 0.0, 0.0)) is None
+    assert backend.calls == [_fetch(backend), "mget:0"]
+    assert cache.semantic_get("other", _vec(0.0, 0.0, 1.0)) is None
+
+
+def test_semantic_index_keeps_the_newest_entries(backend, monkeypatch):
+    monkeypatch.setattr(cache, "SEMANTIC_MAX_ENTRIES", 3)
+    for i in range(5):
+        angle = i * np.pi / 10
+        cache.semantic_set("u", f"q{i}", _vec(np.cos(angle), np.sin(angle), 0.0), f"a{i}", [])
+
+    blob, ids = backend.vec_fetch(cache._vec_key("u", 0))
+    assert len(ids) == 3 and len(blob) == 3 * 3 * 2
+    assert cache.semantic_get("u", _vec(1.0, 0.0, 0.0)) is None  # q0 was trimmed
+    assert cache.semantic_get("u", _vec(np.cos(0.4 * np.pi), np.sin(0.4 * np.pi), 0.0)).answer == "a4"
+
+
+def test_packed_index_trims_in_bulk_past_its_slack(backend, monkeypatch):
+    monkeypatch.setattr(cache, "SEMANTIC_MAX_ENTRIES", 8)
+    key, sizes = cache._vec_key("u", 0), []
+    for i in range(12):
+        cache.semantic_set("u", f"q{i}", _unit_at(i), f"a{i}", [])
+        sizes.append(len(backend.vec_fetch(key)[1]))
+
+    # Grows to 8 + 8 // 4 rows, then is cut back to the newest 8 in one go.
+    assert sizes == [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 8, 9]
+    # The slack is storage only: q3 is still stored but is not among the newest 8.
+    assert backend.vec_fetch(key)[1][0].startswith(cache._hash_vec(cache._unit(_unit_at(3))))
+    assert cache.semantic_get("u", _unit_at(3)) is None
+    assert cache.semantic_get("u", _unit_at(4)).answer == "a4"
+
+
+def _unit_at(i: int) -> np.ndarray:
+    # Neighbours are pi/8 apart: cos(pi/8) is under SEMANTIC_SIM_THRESHOLD.
+    return _vec(np.cos(i * np.pi / 8), np.sin(i * np.pi / 8), 0.0)
+
+
+def test_semantic_index_skips_expired_entries_and_resets_on_new_width(backend):
+    cache.semantic_set("u", "old", _vec(1.0, 0.0, 0.0), "stale", [])
+    cache.semantic_set("u", "new", _vec(1.0, 0.1, 0.0), "fresh", [])
+    backend._kv.pop(cache._entry_key("u", 0, cache._hash_vec(cache._unit(_vec(1.0, 0.1, 0.0)))))
+    assert cache.semantic_get("u", _vec(1.0, 0.1, 0.0)).answer == "stale"
+
+    cache.semantic_set("u", "wide", _vec(1.0, 0.0, 0.0, 0.0), "4-d", [])
+    _, ids = backend.vec_fetch(cache._vec_key("u", 0))
+    assert len(ids) == 1
+    assert cache.semantic_get("u", _vec(1.0, 0.0, 0.0)) is None
+
+
+@pytest.fixture
+def ann(monkeypatch):
+    pytest.importorskip("faiss")
+    from rag.namespace_cache import get_cache
+
+    monkeypatch.setattr(cache, "SEMANTIC_ANN", True)
+    b = cache._InMemoryBackend(maxsize=10_000)
+    monkeypatch.setattr(cache, "_backend", b)
+    get_cache().clear()
+    yield b
+    get_cache().clear()
+
+
+def test_ann_mirror_pulls_only_new_rows_and_expires_by_ttl(ann, monkeypatch):
+    from rag.namespace_cache import get_cache
+
+    # A row written long ago: Redis still lists it, but it is past SEMANTIC_TTL.
+    ann.vec_append(cache._vec_key("u", 0), "deadbeef@1000", _vec(0.0, 0.0, 1.0).astype("<f2").tobytes(), max_rows=10, ttl=60)
+    ann.set(cache._entry_key("u", 0, "deadbeef"), cache.encode_value({"query": "old", "answer": "old", "ts": 1000}), 60)
+    cache.semantic_set("u", "first", _vec(1.0, 0.0, 0.0), "one", [])
+    assert cache.semantic_get("u", _vec(1.0, 0.0, 0.0)).answer == "one"
+    assert cache.semantic_get("u", _vec(0.0, 0.0, 1.0)) is None
+
+    pulled: list[int] = []
+    real_tail = ann.vec_tail
+    monkeypatch.setattr(ann, "vec_tail", lambda *a: pulled.append(len((t := real_tail(*a))[3])) or t)
+    cache.semantic_set("u", "second", _vec(0.0, 1.0, 0.0), "two", [])
+    assert cache.semantic_get("u", _vec(0.0, 1.0, 0.0)).answer == "two"
+    assert cache.semantic_get("u", _vec(0.0, 1.0, 0.0)).answer == "two"
+    assert pulled == [1, 0]
+    mirror = get_cache().get("u", "semantic")
+    assert mirror.ids[mirror.start :] == [m for m in mirror.ids if not m.endswith("@1000")]
+
+
+def test_ann_mirror_searches_thousands_of_entries(ann, monkeypatch):
+    monkeypatch.setattr(cache, "SEMANTIC_MAX_ENTRIES", 3000)
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((3500, 32)).astype("float32")
+    for i, v in enumerate(vecs):
+        cache.semantic_set("u", f"q{i}", v, f"a{i}", [])
+
+    assert cache.semantic_get("u", vecs[1234] + 0.01).answer == "a1234"
+    assert cache.semantic_get("u", vecs[100]) is None  # trimmed: only the newest 3000 are kept
+
+
+class _Bus:
+    """Synchronous stand-in for Redis pub/sub shared by the fake L2s below."""
+
+    def __init__(self) -> None:
+        self.subscribers: list = []
+
+    def publish(self, channel, message):
+        for ch, on_message in self.subscribers:
+            if ch == channel:
+                on_message(message)
+
+
+class _SharedL2(_CountingBackend):
+    def __init__(self, store, bus) -> None:
+        super().__init__()
+        self._kv, self._counters, self._bus = store._kv, store._counters, bus
+
+    def publish(self, channel, message):
+        self._bus.publish(channel, message)
+
+    def listen(self, channel, on_message, on_subscribed):
+        self._bus.subscribers.append((channel, on_message))
+        on_subscribed()
+
+
+@pytest.fixture
+def tiers():
+    store, bus = cache._InMemoryBackend(), _Bus()
+    l2s = [_SharedL2(store, bus) for _ in range(2)]
+    return l2s, [cache._TieredBackend(l2, max_entries=8, ttl=60) for l2 in l2s]
+
+
+def test_l1_serves_repeat_reads_and_remembers_misses(tiers):
+    (l2, _), (a, _) = tiers
+    a.set("job", b"running", 60)
+    assert a.get("job") == b"running" and a.get("job") == b"running"
+    assert a.get("absent") is None and a.get("absent") is None
+    assert a.counter("gen") == 0 and a.counter("gen") == 0
+    assert l2.calls == ["mget:1"]
+
+
+def test_writes_invalidate_peer_l1s(tiers):
+    (_, l2_b), (a, b) = tiers
+    assert b.get("job") is None
+    assert b.counter("gen") == 0
+    a.set("job", b"done", 60)
+    a.incr("gen")
+    assert b.get("job") == b"done"
+    assert b.counter("gen") == 1
+    assert l2_b.calls == ["mget:1", "mget:1"]
+
+
+def test_l1_is_bounded_and_skips_fills_raced_by_an_invalidation(tiers):
+    (l2, _), (a, b) = tiers
+    a.mset({f"k{i}": b"%d" % i for i in range(20)}, 60)
+    assert len(a._l1) == 8 and a.get("k0") == b"0"
+
+    real_mget = l2.mget
+
+    def racing_mget(keys):
+        values = real_mget(keys)
+        b.set("raced", b"new", 60)  # lands between a's L2 read and its L1 fill
+        return values
+
+    l2.mget = racing_mget
+    assert a.get("raced") is None
+    l2.mget = real_mget
+    assert "raced" not in a._l1 and a.get("raced") == b"new"
+
+
+def test_embedding_vectors_skip_the_l1_and_are_not_published(tiers):
+    (l2, _), (a, b) = tiers
+    published = []
+    a._l2.publish = lambda channel, message: published.append(message)
+    emb = [cache._emb_key("model", f"t{i}") for i in range(3)]
+    a.set("job", b"running", 60)
+    a.mset({k: b"vec" for k in emb}, 60)
+    assert len(published) == 1 and list(a._l1) == ["job"]
+
+    l2.calls.clear()
+    assert a.mget([*emb, "job"]) == [b"vec", b"vec", b"vec", b"running"]
+    assert a.mget(emb) == [b"vec"] * 3
+    assert l2.calls == ["mget:3", "mget:3"] and list(a._l1) == ["job"]
+
+
+def test_unreadable_generation_bypasses_the_cache(tiers, monkeypatch):
+    (l2, _), (a, _) = tiers
+    monkeypatch.setattr(cache, "_backend", a)
+    cache.set_exact("u", "q", 5, "cached at generation 0", [])
+    a._l1.clear()
+
+    class _Down:
+        def get(self, key):
+            raise ConnectionError("redis down")
+
+        incr = get
+
+    broken = object.__new__(cache._RedisBackend)
+    broken._r = _Down()
+    assert broken.counter("gen") is None and broken.incr("gen") is None
+
+    # Redis' failure value: never read as generation 0, never kept in L1.
+    monkeypatch.setattr(l2, "counter", broken.counter)
+    monkeypatch.setattr(l2, "incr", broken.incr)
+    assert cache.get_exact("u", "q", 5) is None
+    cache.set_exact("u", "other", 5, "never written", [])
+    cache.semantic_set("u", "q", _vec(1.0, 0.0, 0.0), "never written", [])
+    assert cache.semantic_get("u", _vec(1.0, 0.0, 0.0)) is None
+    cache.invalidate_user("u")
+    assert not a._l1 and l2.calls == []  # no answer or vector reads either
+
+    monkeypatch.undo()
+    monkeypatch.setattr(cache, "_backend", a)
+    assert cache.get_exact("u", "q", 5).answer == "cached at generation 0"
+    assert cache.get_exact("u", "other", 5) is None
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+@pytest.mark.parametrize("compression", ["none", "zlib", "zstd"])
+def test_codecs_roundtrip_and_compress_only_long_values(codec, compression, monkeypatch):
+    optional = {"msgpack": "msgpack", "zstd": "zstandard"}
+    for name in (codec, compression):
+        if name in optional:
+            pytest.importorskip(optional[name])
+    monkeypatch.setattr(cache, "_SER", cache._CODEC_NAMES[codec])
+    monkeypatch.setattr(cache, "_CMP", cache._COMPRESSION_NAMES[compression])
+    short = {"query": "q", "answer": "short", "sources": ["a.txt"], "ts": 1.5}
+    long = dict(short, answer="a long answer with repeats. " * 200)
+
+    assert cache.decode_value(cache.encode_value(short)) == short
+    packed = cache.encode_value(long)
+    assert cache.decode_value(packed) == long
+    if compression == "none":
+        assert len(packed) > len(long["answer"])
+    else:
+        assert len(packed) < len(long["answer"]) // 10
+
+
+def test_decode_tolerates_misses_and_foreign_values():
+    assert cache.decode_value(None) is None
+    assert cache.decode_value(b'{"legacy": "json string"}') is None  # pre-codec entry: a miss
+    assert cache.decode_value(bytes([cache._SER_JSON | cache._CMP_ZLIB]) + b"not zlib") is None
+
+    v = np.arange(384, dtype="float32") / 7
+    assert np.array_equal(cache.decode_array(cache.encode_array(v)), v)
+    assert len(cache.encode_array(v)) == 384 * 4
+    assert cache.decode_array(b"abc") is None
@@ -0,0 +1,59 @@
+"""Binary chunk table: round trip through the mapped file and id lookups."""
+from __future__ import annotations
+
+from rag.chunk_store import ChunkTable
+
+
+def _rows():
+    return [
+        {"id": 7, "chunk_id": "b.txt_chunk_0", "source": "b.txt", "text": "zweite Zeile — ünïcode"},
+        {"id": 2, "chunk_id": "a.txt_chunk_0", "source": "a.txt", "text": "first"},
+        {"id": 5, "chunk_id": "a.txt_chunk_1", "source": "a.txt", "text": ""},
+    ]
+
+
+def test_chunk_table_round_trips_through_mmap(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    ChunkTable.from_dicts(_rows()).write(path)
+
+    table = ChunkTable.open(path)
+    assert len(table) == 3
+    assert table.ids.tolist() == [2, 5, 7]  # rows are kept in id order
+    assert table.to_dicts() == sorted(_rows(), key=lambda m: m["id"])
+
+
+def test_chunk_table_row_lookup_misses_tombstones(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    ChunkTable.from_dicts(_rows()).write(path)
+    table = ChunkTable.open(path)
+
+    assert table.source(table.row(7)) == "b.txt"
+    assert table.row(3) == -1 and table.row(99) == -1
+
+
+def test_chunk_table_without_ids_uses_row_positions():
+    table = ChunkTable.from_dicts([{"chunk_id": "x", "source": "s", "text": "t"}])
+    assert table.get(table.row(0)) == {"id": 0, "chunk_id": "x", "source": "s", "text": "t"}
+
+
+def test_concurrent_writers_each_use_their_own_temp_file(tmp_path, monkeypatch):
+    import os
+
+    from rag import colfile
+
+    path = str(tmp_path / "chunks.bin")
+    real_replace = os.replace
+    raced: list[bool] = []
+
+    def _replace_after_a_rival_write(src, dst):
+        if not raced:  # another worker writes the same file between our write and rename
+            raced.append(True)
+            ChunkTable.from_dicts(_rows()[:1]).write(path)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(colfile.os, "replace", _replace_after_a_rival_write)
+    ChunkTable.from_dicts(_rows()).write(path)
+
+    assert len(ChunkTable.open(path)) == 3  # the later rename wins, intact
+    assert os.listdir(tmp_path) == ["chunks.bin"]
+    assert os.stat(path).st_mode & 0o777 == 0o644
@@ -3,7 +3,7 @@ mid-sentence when possible, and respect overlap. Pure-logic, no services.
 """
 from __future__ import annotations
 
-from rag.chunking import recursive_split
+from rag.chunking import iter_split, recursive_split
 
 
 def test_short_text_returns_single_chunk():
@@ -64,3 +64,20 @@ def test_no_overlap_mode_produces_disjoint_pieces():
     joined = "".join(out).replace(" ", "")
     assert "alpha" in joined and "juliet" in joined
     assert all(len(c) <= 20 for c in out)
+
+
+def test_iter_split_matches_recursive_split_within_one_window():
+    text = "First paragraph.\n\nSecond paragraph. Third sentence."
+    pieces = ["First para", "graph.\n\nSecond ", "paragraph. Third sentence."]
+    assert list(iter_split(pieces, chunk_size=30, overlap=0)) == recursive_split(
+        text, chunk_size=30, overlap=0
+    )
+
+
+def test_iter_split_streams_long_input_without_losing_words():
+    words = [f"word{i}" for i in range(2000)]
+    pieces = [" ".join(words[i:i + 7]) + " " for i in range(0, len(words), 7)]
+    out = list(iter_split(pieces, chunk_size=80, overlap=0, window=400))
+    assert all(len(c) <= 80 for c in out)
+    # Window boundaries must not glue or drop words.
+    assert " ".join(out).split() == words
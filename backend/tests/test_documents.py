@@ -45,6 +45,26 @@ def test_delete_document(client, auth_headers, mongo_patch):
     assert db.documents.count_documents({}) == 0
 
 
+def test_delete_with_remaining_docs_applies_only_the_delta(client, auth_headers, mongo_patch):
+    db = mongo_patch["rag_chat_app"]
+    r = db.documents.insert_one({
+        "userId": auth_headers["user_id"],
+        "filename": "a.pdf",
+        "size": 10,
+        "rawPath": "/tmp/nonexistent.pdf",
+    })
+    with patch("routes.v1.documents.INGEST_MODE", "incremental"), \
+         patch("routes.v1.documents.ingest_files") as full_ingest, \
+         patch("routes.v1.documents.sync_user_index") as sync, \
+         patch("routes.v1.documents.reload_index"), \
+         patch("routes.v1.documents.list_raw_files", return_value=["/raw/b.pdf"]), \
+         patch("routes.v1.documents.remove_raw_file", return_value=True):
+        rv = client.delete(f"/api/v1/documents/{r.inserted_id}", headers=auth_headers["headers"])
+    assert rv.status_code == 200
+    sync.assert_called_once_with(auth_headers["user_id"])
+    full_ingest.assert_not_called()
+
+
 def test_delete_foreign_document_denied(client, auth_headers, mongo_patch):
     db = mongo_patch["rag_chat_app"]
     r = db.documents.insert_one({
@@ -88,3 +88,28 @@ def test_dataset_sources_exist_on_disk():
     for row in _load_rows():
         for src in row["source_docs"]:
             assert src in existing, f"{row['id']} references missing {src}"
+
+
+# --- ONNX parity gate -------------------------------------------------------
+
+
+def test_parity_check_allows_the_baseline_tolerance(tmp_path):
+    from evals import run
+
+    reference = tmp_path / "torch.json"
+    reference.write_text(json.dumps({"meta": {"models": {}}, "summary": {"recall_at_5": 0.9}}))
+
+    assert run._parity_check({"recall_at_5": 0.9 - run._BASELINE_TOLERANCE + 0.01}, reference)
+    assert not run._parity_check({"recall_at_5": 0.9 - run._BASELINE_TOLERANCE - 0.01}, reference)
+
+
+def test_output_flag_writes_the_record_to_a_fixed_path(tmp_path):
+    from evals import run
+
+    out = tmp_path / "smoke" / "torch.json"
+    meta = {"timestamp": "20260101T000000", "dataset_rows": 0, "mode": "smoke"}
+    assert run._write_results({"recall_at_5": 0.8}, [], meta, out) == out
+
+    assert json.loads(out.read_text())["summary"] == {"recall_at_5": 0.8}
+    assert out.with_suffix(".md").exists()
+    assert run._parity_check({"recall_at_5": 0.8}, out)
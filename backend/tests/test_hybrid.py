@@ -7,9 +7,12 @@ from __future__ import annotations
 
 import os
 
+import numpy as np
 import pytest
 
+from rag.chunk_store import ChunkTable
 from rag.hybrid import _tokenize, rrf_fuse
+from rag.namespace_cache import get_cache
 
 
 def test_tokenize_lowercases_and_drops_punctuation():
@@ -64,6 +67,8 @@ def test_bm25_build_and_search_roundtrip(monkeypatch, tmp_path):
         {"chunk_id": "c2", "source": "b.txt", "text": "lazy dogs sleep often"},
         {"chunk_id": "c3", "source": "a.txt", "text": "brown fox jumps over"},
     ]
+    # BM25 stores only chunk ids; hits are hydrated from the chunk store.
+    ChunkTable.from_dicts(metadata).write(user_store.paths_for("u1").chunks)
     hybrid.build_bm25(user_id="u1", metadata=metadata)
     hybrid.reload_bm25("u1")  # drop cache so search re-reads from disk
 
@@ -78,7 +83,7 @@ def test_bm25_search_returns_empty_when_no_index(monkeypatch, tmp_path):
     monkeypatch.setattr(user_store, "_USERS_ROOT", tmp_path)
     monkeypatch.setattr(hybrid, "paths_for", user_store.paths_for)
     # Reset BM25 cache for this namespace.
-    monkeypatch.setattr(hybrid, "_bm25_cache", {}, raising=False)
+    get_cache().invalidate("missing")
     # No build_bm25 call → no on-disk artefact → search must return [].
     assert hybrid.bm25_search("anything", user_id="missing", metadata=None, top_k=5) == []
 
@@ -92,3 +97,183 @@ def test_user_store_paths_for_creates_dirs(monkeypatch, tmp_path):
     assert os.path.isdir(paths.dir)
     assert os.path.isdir(os.path.join(paths.dir, "raw"))
     assert paths.namespace == "alice"
+
+
+def _random_corpus(n_docs: int, seed: int = 0) -> list[list[str]]:
+    import random
+
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(60)]
+    # Skewed draws so some terms appear in most documents (negative idf → epsilon).
+    return [
+        rng.choices(words, weights=[1 / (i + 1) for i in range(60)], k=rng.randint(0, 30))
+        for _ in range(n_docs)
+    ]
+
+
+def test_sparse_bm25_matches_rank_bm25_scores():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    from rag.bm25 import BM25Index
+
+    corpus = _random_corpus(300)
+    reference = rank_bm25.BM25Okapi(corpus)
+    index = BM25Index.build(corpus)
+
+    for query in (["w0"], ["w1", "w5", "w5"], ["w59", "missing", "w3"], []):
+        np.testing.assert_allclose(index.get_scores(query), reference.get_scores(query), rtol=1e-5, atol=1e-5)
+
+
+def test_sparse_bm25_top_k_is_ordered_best_first():
+    from rag.bm25 import BM25Index
+
+    index = BM25Index.build(_random_corpus(200, seed=1))
+    query = ["w2", "w7"]
+    scores = index.get_scores(query)
+
+    idx, top = index.top_k(query, 10)
+    assert len(idx) == 10
+    assert list(top) == sorted(top, reverse=True)
+    assert top[-1] >= np.sort(scores)[-10]
+    assert len(index.top_k(query, 1000)[0]) == 200
+
+
+def test_bm25_file_roundtrip_is_memory_mapped(tmp_path):
+    from rag.bm25 import BM25Index
+
+    corpus = _random_corpus(150, seed=2) + [["naïve", "café"]]
+    built = BM25Index.build(corpus, rows=[10 * i for i in range(len(corpus))])
+    path = str(tmp_path / "bm25.bin")
+    built.write(path)
+    opened = BM25Index.open(path)
+
+    assert opened.docs.base is not None  # a view into the mapping, not a copy
+    np.testing.assert_array_equal(opened.rows, built.rows)
+    for query in (["w0", "w4"], ["café"], ["w59", "missing"], []):
+        np.testing.assert_array_equal(opened.get_scores(query), built.get_scores(query))
+    assert opened.terms.get("naïve") == built.terms["naïve"]
+
+    with open(path, "r+b") as f:
+        f.write(b"NOTBM25!")
+    with pytest.raises(ValueError):
+        BM25Index.open(path)
+
+
+def test_legacy_bm25_pickle_is_searched_read_only_and_migrated_by_ingest(monkeypatch, tmp_path):
+    import pickle
+
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    from rag import hybrid, user_store
+    from rag.bm25 import BM25Segments
+
+    monkeypatch.setattr(user_store, "_USERS_ROOT", tmp_path)
+    monkeypatch.setattr(hybrid, "paths_for", user_store.paths_for)
+    get_cache().invalidate("legacy")
+
+    metadata = [
+        {"chunk_id": "c1", "source": "a.txt", "text": "the quick brown fox"},
+        {"chunk_id": "c2", "source": "b.txt", "text": "lazy dogs sleep often"},
+        {"chunk_id": "c3", "source": "a.txt", "text": "brown fox jumps over"},
+    ]
+    ChunkTable.from_dicts(metadata).write(user_store.paths_for("legacy").chunks)
+    legacy = os.path.join(user_store.paths_for("legacy").dir, "bm25.pkl")
+    corpus = [hybrid._tokenize(m["text"]) for m in metadata]
+    with open(legacy, "wb") as f:
+        pickle.dump({"bm25": rank_bm25.BM25Okapi(corpus), "ids": ["c1", "c2", "c3"]}, f)
+
+    # Queries serve the pickle and write nothing.
+    hits = hybrid.bm25_search("lazy dogs", user_id="legacy", top_k=2)
+    assert [h["chunk_id"] for h in hits][:1] == ["c2"]
+    assert os.path.exists(legacy) and not BM25Segments.exists(user_store.paths_for("legacy").dir)
+
+    # The next ingest delta rebuilds from the chunk store and retires the pickle.
+    hybrid.update_bm25("legacy", added=[], removed=[{"id": 0, "text": metadata[0]["text"]}])
+    assert not os.path.exists(legacy)
+    assert BM25Segments.open(user_store.paths_for("legacy").dir).n_docs == 3  # rebuilt from the chunk table
+    hybrid.reload_bm25("legacy")
+    assert [h["chunk_id"] for h in hybrid.bm25_search("lazy dogs", user_id="legacy", top_k=2)][:1] == ["c2"]
+
+
+def _assert_same_ranking(segments, corpus, rows, query):
+    from rag.bm25 import BM25Index
+
+    fresh = BM25Index.build(corpus, rows)
+    got_ids, got = segments.top_k(query, len(rows))
+    idx, want = fresh.top_k(query, len(rows))
+    np.testing.assert_allclose(got, want, rtol=1e-5, atol=1e-5)
+    assert sorted(got_ids) == sorted(fresh.rows[idx])
+
+
+def test_bm25_segments_match_a_full_rebuild(tmp_path):
+    from rag.bm25 import BM25Index, BM25Segments
+
+    corpus = _random_corpus(120, seed=3)
+    base = BM25Index.build(corpus[:100], rows=range(100))
+    base.write(BM25Segments.base_path(str(tmp_path)))
+    index = BM25Segments.open(str(tmp_path))
+
+    index = index.remove([corpus[i] for i in range(0, 40, 3)], list(range(0, 40, 3)))
+    index = index.add(corpus[100:], list(range(100, 120)))
+    index = index.remove([corpus[105]], [105])
+    index.commit()
+    reopened = BM25Segments.open(str(tmp_path))
+    assert len(reopened.segments) == 2
+
+    live = [i for i in range(120) if not (i < 40 and i % 3 == 0) and i != 105]
+    for query in (["w0", "w1"], ["w7", "w7", "w40"], ["missing"]):
+        _assert_same_ranking(reopened, [corpus[i] for i in live], live, query)
+
+    delta = reopened.delta_rows()
+    merged = reopened.merge_deltas([corpus[i] for i in delta], delta)
+    assert len(merged.segments) == 2 and list(merged.deleted) == list(range(0, 40, 3))
+    _assert_same_ranking(merged, [corpus[i] for i in live], live, ["w0", "w3"])
+
+
+def test_update_bm25_appends_segments_then_compacts(monkeypatch, tmp_path):
+    from rag import hybrid, user_store
+    from rag.bm25 import BM25Segments
+
+    monkeypatch.setattr(user_store, "_USERS_ROOT", tmp_path)
+    monkeypatch.setattr(hybrid, "paths_for", user_store.paths_for)
+    get_cache().invalidate("inc")
+
+    rows = [{"id": i, "chunk_id": f"c{i}", "source": "a.txt", "text": f"common doc{i} words"} for i in range(8)]
+    paths = user_store.paths_for("inc")
+    ChunkTable.from_dicts(rows).write(paths.chunks)
+    hybrid.build_bm25("inc", rows)
+
+    new = {"id": 8, "chunk_id": "c8", "source": "b.txt", "text": "common zebra words"}
+    ChunkTable.from_dicts(rows + [new]).write(paths.chunks)
+    get_cache().invalidate("inc", "chunks")
+    hybrid.update_bm25("inc", added=[new], removed=[])
+    assert [name for name, _ in BM25Segments.open(paths.dir).segments] == ["bm25.0.bin", "bm25.1.bin"]
+    assert [h["chunk_id"] for h in hybrid.bm25_search("zebra", user_id="inc", top_k=1)] == ["c8"]
+
+    # Dropping most of the base crosses BM25_COMPACT_RATIO: back to one segment.
+    ChunkTable.from_dicts(rows[6:] + [new]).write(paths.chunks)
+    get_cache().invalidate("inc", "chunks")
+    hybrid.update_bm25("inc", added=[], removed=rows[:6])
+    assert [name for name, _ in BM25Segments.open(paths.dir).segments] == ["bm25.2.bin"]
+    hits = hybrid.bm25_search("common", user_id="inc", top_k=10)
+    assert sorted(h["chunk_id"] for h in hits) == ["c6", "c7", "c8"]
+
+
+def test_bm25_readers_of_the_previous_manifest_keep_their_files(monkeypatch, tmp_path):
+    from rag import hybrid, user_store
+    from rag.bm25 import BM25Segments
+
+    monkeypatch.setattr(user_store, "_USERS_ROOT", tmp_path)
+    monkeypatch.setattr(hybrid, "paths_for", user_store.paths_for)
+    directory = user_store.paths_for("gc").dir
+    rows = [{"id": i, "chunk_id": f"c{i}", "source": "a.txt", "text": f"doc{i} text"} for i in range(4)]
+
+    hybrid.build_bm25("gc", rows)
+    old_manifest = BM25Segments._read_header(directory)
+    hybrid.build_bm25("gc", rows[:2])  # a full rebuild commits under new names
+    for name in old_manifest["segments"]:
+        assert os.path.exists(os.path.join(directory, name))  # still mappable in the grace period
+    assert BM25Segments.open(directory).n_docs == 2
+
+    monkeypatch.setattr(hybrid, "_RETIRE_GRACE", 0.0)
+    hybrid.build_bm25("gc", rows[:3])
+    on_disk = sorted(n for n in os.listdir(directory) if n.endswith(".bin"))
+    assert on_disk == [name for name, _ in BM25Segments.open(directory).segments] == ["bm25.2.bin"]
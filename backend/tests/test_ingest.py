@@ -0,0 +1,523 @@
+"""Ingestion tests: manifest diffing and incremental per-file ingest against a
+real FAISS index in a temp namespace. Embeddings come from the conftest stub.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from rag.manifest import ManifestEntry, diff
+
+
+def _entry(digest: str) -> ManifestEntry:
+    return ManifestEntry(sha256=digest, size=1, modified=0.0)
+
+
+def test_manifest_diff_classifies_files():
+    manifest = {"a.txt": _entry("1"), "b.txt": _entry("2"), "c.txt": _entry("3")}
+    delta = diff(manifest, {"a.txt": "1", "b.txt": "changed", "d.txt": "4"}, removed=["c.txt"])
+    assert delta.unchanged == ["a.txt"]
+    assert delta.changed == ["b.txt"]
+    assert delta.added == ["d.txt"]
+    assert delta.removed == ["c.txt"]
+    assert not delta.empty
+
+
+def test_manifest_diff_ignores_removed_names_it_never_indexed():
+    delta = diff({"a.txt": _entry("1")}, {"a.txt": "1"}, removed=["ghost.txt"])
+    assert delta.removed == []
+    assert delta.empty
+
+
+@pytest.fixture
+def ns(monkeypatch, tmp_path):
+    pytest.importorskip("faiss")
+    pytest.importorskip("rank_bm25")
+    from rag import user_store, vector_store
+
+    monkeypatch.setattr(user_store, "_USERS_ROOT", tmp_path / "users")
+    monkeypatch.delenv("VECTOR_BACKEND", raising=False)
+    monkeypatch.delenv("QDRANT_URL", raising=False)
+    vector_store.reset_store_for_tests()
+    yield "incr-user"
+    vector_store.reset_store_for_tests()
+
+
+def _write(path, text: str) -> str:
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_incremental_ingest_only_embeds_changed_files(ns, monkeypatch, tmp_path):
+    from rag import ingest
+    from rag.hybrid import bm25_search, reload_bm25
+    from rag.vector_store import get_store
+
+    embedded: list[str] = []
+    real_embed = ingest.embed
+
+    def _counting_embed(texts, **kw):
+        embedded.extend(texts)
+        return real_embed(texts, **kw)
+
+    monkeypatch.setattr(ingest, "embed", _counting_embed)
+
+    src = tmp_path / "src"
+    src.mkdir()
+    a = _write(src / "a.txt", "alpha document about apples")
+    b = _write(src / "b.txt", "bravo document about bananas")
+
+    first = ingest.ingest_files_incremental([a, b], user_id=ns)
+    assert sorted(first.added) == ["a.txt", "b.txt"]
+    assert len(embedded) == 2
+
+    embedded.clear()
+    b = _write(src / "b.txt", "bravo document about blueberries")
+    c = _write(src / "c.txt", "charlie document about cherries")
+    second = ingest.ingest_files_incremental([a, b, c], user_id=ns)
+    assert second.unchanged == ["a.txt"]
+    assert second.changed == ["b.txt"]
+    assert second.added == ["c.txt"]
+    assert sorted(embedded) == sorted([
+        "bravo document about blueberries",
+        "charlie document about cherries",
+    ])
+
+    texts = {m["source"]: m["text"] for m in get_store().get_metadata(ns)}
+    assert texts == {
+        "a.txt": "alpha document about apples",
+        "b.txt": "bravo document about blueberries",
+        "c.txt": "charlie document about cherries",
+    }
+
+    embedded.clear()
+    third = ingest.ingest_files_incremental([], user_id=ns, removed=["a.txt"])
+    assert third.removed == ["a.txt"]
+    assert embedded == []
+    assert {m["source"] for m in get_store().get_metadata(ns)} == {"b.txt", "c.txt"}
+
+    # The BM25 snapshot must follow the same delta as the vector store.
+    reload_bm25(ns)
+    hits = bm25_search("blueberries", user_id=ns, top_k=5)
+    assert {h["text"] for h in hits} == {
+        "bravo document about blueberries",
+        "charlie document about cherries",
+    }
+
+
+def test_bm25_delta_is_taken_against_the_chunk_table_on_disk(ns, tmp_path):
+    from rag import chunk_store, ingest
+    from rag.bm25 import BM25Segments
+    from rag.namespace_cache import get_cache
+    from rag.user_store import paths_for
+
+    a = _write(tmp_path / "a.txt", "alpha document")
+    b = _write(tmp_path / "b.txt", "bravo document")
+    ingest.ingest_files_incremental([a], user_id=ns)
+
+    # A cached table that no longer matches the file (as a stale one could).
+    paths = paths_for(ns)
+    stale = chunk_store.ChunkTable.from_dicts([])
+    get_cache().put(ns, "chunks", (chunk_store._stamp(paths), stale), 0)
+    ingest.ingest_files_incremental([a, b], user_id=ns)
+
+    index = BM25Segments.open(paths.dir)
+    assert index.n_docs == len(chunk_store.read_chunks(paths)) == 2  # a.txt not indexed twice
+
+
+def test_incremental_ingest_is_a_noop_when_nothing_changed(ns, monkeypatch, tmp_path):
+    from rag import ingest
+
+    src = tmp_path / "src"
+    src.mkdir()
+    a = _write(src / "a.txt", "alpha document")
+    ingest.ingest_files_incremental([a], user_id=ns)
+
+    monkeypatch.setattr(ingest, "embed", lambda *a, **kw: pytest.fail("re-embedded unchanged file"))
+    delta = ingest.ingest_files_incremental([a], user_id=ns)
+    assert delta.empty and delta.unchanged == ["a.txt"]
+
+
+def test_concurrent_ingests_of_one_namespace_do_not_lose_each_others_files(ns, monkeypatch, tmp_path):
+    import threading
+
+    from rag import ingest
+    from rag.manifest import load_manifest
+    from rag.user_store import paths_for
+    from rag.vector_store import get_store
+
+    seed = _write(tmp_path / "seed.txt", "seed document")
+    a = _write(tmp_path / "a.txt", "alpha document")
+    b = _write(tmp_path / "b.txt", "bravo document")
+    ingest.ingest_files_incremental([seed], user_id=ns)
+
+    other = threading.Thread(target=ingest.ingest_files_incremental, args=([b],), kwargs={"user_id": ns})
+    real_embed = ingest.embed
+
+    def _embed_then_race(texts, **kw):
+        if not other.is_alive() and other.ident is None:
+            other.start()  # a second job for the namespace, mid-way through this one
+            other.join(timeout=0.5)
+            assert other.is_alive(), "second ingest ran inside the first one's read-modify-write"
+        return real_embed(texts, **kw)
+
+    monkeypatch.setattr(ingest, "embed", _embed_then_race)
+    ingest.ingest_files_incremental([a], user_id=ns)
+    other.join(timeout=10)
+
+    assert set(load_manifest(paths_for(ns))) == {"seed.txt", "a.txt", "b.txt"}
+    rows = get_store().get_metadata(ns)
+    assert sorted(m["source"] for m in rows) == ["a.txt", "b.txt", "seed.txt"]
+    assert len({m["id"] for m in rows}) == 3
+
+
+class _FailingPaginator:
+    def paginate(self, **kw):
+        yield {"Contents": []}
+        raise ConnectionError("listing interrupted")
+
+
+def test_failed_storage_listing_fails_the_sync_instead_of_removing_sources(ns, monkeypatch, tmp_path):
+    import storage
+    from rag import ingest
+    from rag.vector_store import get_store
+    from tasks.ingest_tasks import sync_user_index
+
+    a = _write(tmp_path / "a.txt", "alpha document")
+    ingest.ingest_files_incremental([a], user_id=ns)
+
+    s3 = object.__new__(storage._S3Storage)
+    s3._bucket = "b"
+    s3._client = type("_Client", (), {"get_paginator": lambda self, op: _FailingPaginator()})()
+    assert s3.list_keys(ns) == []  # lenient listing for display callers
+    monkeypatch.setattr(storage, "_storage", s3)
+    with pytest.raises(ConnectionError):
+        sync_user_index(ns)
+    assert {m["source"] for m in get_store().get_metadata(ns)} == {"a.txt"}
+
+
+def test_embedding_cache_skips_model_for_repeated_chunks(ns, monkeypatch):
+    from rag import ingest
+
+    encoded: list[str] = []
+    real_encode = ingest._encode
+
+    def _counting_encode(texts):
+        encoded.extend(texts)
+        return real_encode(texts)
+
+    monkeypatch.setattr(ingest, "_encode", _counting_encode)
+
+    ingest.ingest_documents({"a.txt": "alpha text", "b.txt": "bravo text"}, user_id=ns)
+    assert sorted(encoded) == ["alpha text", "bravo text"]
+
+    encoded.clear()
+    ingest.ingest_documents({"a.txt": "alpha text", "c.txt": "charlie text"}, user_id=ns)
+    assert encoded == ["charlie text"]
+
+
+def test_embedding_cache_evicts_least_recently_used(ns, monkeypatch):
+    from rag import embed_cache
+
+    monkeypatch.setattr(embed_cache, "_MAX_ENTRIES", 2)
+    encode = lambda texts: np.ones((len(texts), 3), dtype="float32")  # noqa: E731
+
+    embed_cache.cached_embed(["a", "b"], encode, model_name="m", namespace=ns)
+    embed_cache.cached_embed(["a"], encode, model_name="m", namespace=ns)  # refresh "a"
+    embed_cache.cached_embed(["c"], encode, model_name="m", namespace=ns)  # evicts "b"
+
+    store = embed_cache._DiskCache(ns, "m")
+    cached = store.get_many([embed_cache.text_key(t) for t in ("a", "b", "c")])
+    assert set(cached) == {embed_cache.text_key("a"), embed_cache.text_key("c")}
+
+
+def test_embedding_cache_appends_rows_instead_of_rewriting(ns, monkeypatch):
+    import os
+
+    from rag import embed_cache
+
+    encode = lambda texts: np.full((len(texts), 4), len(texts[0]), dtype="float32")  # noqa: E731
+    embed_cache.cached_embed([f"t{i}" for i in range(100)], encode, model_name="m", namespace=ns)
+    store = embed_cache._DiskCache(ns, "m")
+    vecs_path = store._file("vecs")
+    inode, size = os.stat(vecs_path).st_ino, os.path.getsize(vecs_path)
+
+    out = embed_cache.cached_embed(["t5", "a much longer new text"], encode, model_name="m", namespace=ns)
+    assert out[:, 0].tolist() == [2.0, 22.0]
+    assert os.stat(vecs_path).st_ino == inode
+    assert os.path.getsize(vecs_path) == size + 4 * 4
+    assert embed_cache._DiskCache(ns, "m")._meta == {"gen": 0, "rows": 101, "dim": 4}
+
+    # A new output width under the same model name starts a fresh generation.
+    wide = lambda texts: np.ones((len(texts), 8), dtype="float32")  # noqa: E731
+    embed_cache.cached_embed(["fresh"], wide, model_name="m", namespace=ns)
+    reopened = embed_cache._DiskCache(ns, "m")
+    assert reopened._meta == {"gen": 1, "rows": 1, "dim": 8} and not os.path.exists(vecs_path)
+
+
+def _slow_extract(path: str) -> str:
+    import time
+
+    if path.endswith("slow.txt"):
+        time.sleep(5)
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_parallel_extraction_reports_errors_per_file(monkeypatch, tmp_path, capsys):
+    from rag import ingest
+
+    monkeypatch.setattr(ingest, "_EXTRACT_WORKERS", 2)
+    paths = [_write(tmp_path / f"{n}.txt", f"text {n}") for n in ("a", "b", "c")]
+    paths.append(_write(tmp_path / "bad.xyz", "unsupported"))
+
+    docs = ingest.load_text_files_from_paths(paths)
+    assert docs == {"a.txt": "text a", "b.txt": "text b", "c.txt": "text c"}
+    assert "Error loading bad.xyz: Unsupported file format: .xyz" in capsys.readouterr().out
+
+
+def test_parallel_extraction_times_out_hung_files(monkeypatch, tmp_path, capsys):
+    from rag import ingest
+
+    monkeypatch.setattr(ingest, "_EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(ingest, "_EXTRACT_TIMEOUT", 0.5)
+    monkeypatch.setattr(ingest, "extract_text_from_file", _slow_extract)
+    paths = [_write(tmp_path / "fast.txt", "fast"), _write(tmp_path / "slow.txt", "slow")]
+
+    docs = ingest.load_text_files_from_paths(paths)
+    assert docs == {"fast.txt": "fast"}
+    assert "Error loading slow.txt: extraction timed out" in capsys.readouterr().out
+
+
+def test_ingest_embeds_and_flushes_in_fixed_size_batches(ns, monkeypatch):
+    from rag import ingest
+    from rag.vector_store import get_store
+
+    batch_sizes: list[int] = []
+    real_embed = ingest.embed
+
+    def _recording_embed(texts, **kw):
+        batch_sizes.append(len(texts))
+        return real_embed(texts, **kw)
+
+    monkeypatch.setattr(ingest, "_EMBED_BATCH", 2)
+    monkeypatch.setattr(ingest, "embed", _recording_embed)
+
+    docs = {f"{n}.txt": f"document {n}" for n in "abcde"}
+    ingest.ingest_documents(docs, user_id=ns)
+
+    assert batch_sizes == [2, 2, 1]
+    assert {m["source"] for m in get_store().get_metadata(ns)} == set(docs)
+
+
+def test_ingest_opens_the_embedding_cache_once_and_flushes_per_batch(ns, monkeypatch):
+    from rag import embed_cache, ingest
+
+    calls: list[str] = []
+    pending: list[int] = []
+    real_init, real_flush = embed_cache._DiskCache.__init__, embed_cache._DiskCache.flush
+    monkeypatch.setattr(embed_cache._DiskCache, "__init__", lambda self, *a: calls.append("open") or real_init(self, *a))
+
+    def _flush(self):
+        calls.append("flush")
+        pending.append(len(self._new))
+        real_flush(self)
+
+    monkeypatch.setattr(embed_cache._DiskCache, "flush", _flush)
+    monkeypatch.setattr(ingest, "_EMBED_BATCH", 2)
+
+    # e.txt repeats a.txt: the last batch finds it among rows flushed earlier.
+    docs = {f"{n}.txt": f"document {n}" for n in "abcd"} | {"e.txt": "document a"}
+    ingest.ingest_documents(docs, user_id=ns)
+    assert calls == ["open", "flush", "flush", "flush"]
+    assert pending == [2, 2, 0]  # only the current batch's vectors are held
+    assert embed_cache._DiskCache(ns, ingest.EMBEDDING_MODEL_ID)._meta["rows"] == 4
+
+
+def test_chunk_writer_spills_new_text_instead_of_holding_it(ns):
+    import tracemalloc
+
+    from rag.chunk_store import ChunkTableWriter, read_chunks
+    from rag.user_store import paths_for
+
+    paths = paths_for(ns)
+    seed = ChunkTableWriter(paths, replace=True)
+    seed.add([{"chunk_id": f"{s}_0", "source": s, "text": f"text of {s}"} for s in ("a.txt", "b.txt", "c.txt")])
+    seed.commit()
+
+    writer = ChunkTableWriter(paths, replace=False)
+    assert writer.remove_sources(["b.txt"])
+    tracemalloc.start()
+    for batch in range(8):
+        writer.add([
+            {"chunk_id": f"d.txt_{batch}_{i}", "source": "d.txt", "text": f"{batch}:{i} " + "x" * 2000}
+            for i in range(64)
+        ])
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert held < 256 * 1024  # 1 MiB of chunk text went to the spill file
+
+    writer.commit()
+    table = read_chunks(paths)
+    assert len(table) == 2 + 8 * 64 == len(writer)
+    assert [table.source(r) for r in range(3)] == ["a.txt", "c.txt", "d.txt"]
+    assert table.text(1) == "text of c.txt" and table.text(2) == "0:0 " + "x" * 2000
+    assert table.ids.tolist() == [0, 2, *range(3, 3 + 8 * 64)]
+    assert table.chunk_id(len(table) - 1) == "d.txt_7_63"
+
+
+def _faiss_state(ns):
+    import faiss
+
+    from rag.user_store import paths_for
+
+    index = faiss.read_index(paths_for(ns).faiss_index)
+    return index.ntotal, set(faiss.vector_to_array(index.id_map).tolist())
+
+
+def test_faiss_deletes_tombstone_and_keep_stable_ids(ns, monkeypatch):
+    from rag import vector_store
+    from rag.vector_store import get_store
+
+    monkeypatch.setattr(vector_store, "_COMPACT_RATIO", 0.5)
+    store = get_store()
+    vecs = np.eye(3, dtype="float32")
+    store.upsert(ns, vecs, [{"chunk_id": f"{s}_chunk_0", "source": s, "text": s} for s in ("a", "b", "c")])
+    ids = {m["source"]: m["id"] for m in store.get_metadata(ns)}
+
+    writer = store.writer(ns)
+    writer.remove_sources(["b"])
+    writer.commit()
+
+    # One tombstone out of three stays under the ratio: no rebuild, same ids.
+    assert _faiss_state(ns) == (3, {0, 1, 2})
+    assert {m["source"]: m["id"] for m in store.get_metadata(ns)} == {"a": ids["a"], "c": ids["c"]}
+    hits = store.search(ns, vecs[1:2], top_k=2, threshold=-1.0)
+    assert [h["source"] for h in hits] and "b" not in {h["source"] for h in hits}
+    assert len(hits) == 2
+
+    writer = store.writer(ns)
+    writer.add(np.eye(3, dtype="float32")[:1], [{"chunk_id": "d_chunk_0", "source": "d", "text": "d"}])
+    writer.remove_sources(["a", "c"])
+    writer.commit()
+
+    # Three tombstones out of four: compacted down to the live vector, id kept.
+    assert _faiss_state(ns) == (1, {3})
+    assert [h["source"] for h in store.search(ns, vecs[:1], top_k=5, threshold=-1.0)] == ["d"]
+
+
+def test_faiss_commit_crashing_before_the_chunk_table_keeps_search_consistent(ns, monkeypatch):
+    import os
+
+    from rag import chunk_store
+    from rag.user_store import paths_for
+    from rag.vector_store import get_store
+
+    store = get_store()
+    vecs = np.eye(3, dtype="float32")
+    store.upsert(ns, vecs[:2], [{"chunk_id": f"{s}_chunk_0", "source": s, "text": s} for s in ("a", "b")])
+
+    written: list[str] = []
+    real_write = store._faiss.write_index
+    monkeypatch.setattr(store._faiss, "write_index", lambda index, path: written.append(path) or real_write(index, path))
+
+    def _crash(self):
+        raise OSError("killed between the two renames")
+
+    real_commit = chunk_store.ChunkTableWriter.commit
+    monkeypatch.setattr(chunk_store.ChunkTableWriter, "commit", _crash)
+    writer = store.writer(ns)
+    writer.add(vecs[2:], [{"chunk_id": "c_chunk_0", "source": "c", "text": "c"}])
+    with pytest.raises(OSError):
+        writer.commit()
+    monkeypatch.setattr(chunk_store.ChunkTableWriter, "commit", real_commit)
+
+    paths = paths_for(ns)
+    assert written[0] != paths.faiss_index + ".tmp" and os.path.dirname(written[0]) == paths.dir
+    assert not [f for f in os.listdir(paths.dir) if f.endswith(".tmp")]
+    # The new vector is in the index, but no chunk names it: skipped, not an error.
+    assert _faiss_state(ns) == (3, {0, 1, 2})
+    assert sorted(h["source"] for h in store.search(ns, vecs[2:], top_k=3, threshold=-1.0)) == ["a", "b"]
+
+    writer = store.writer(ns)  # the retry never reuses the orphaned id
+    writer.add(vecs[2:], [{"chunk_id": "c_chunk_0", "source": "c", "text": "c"}])
+    writer.commit()
+    assert {m["source"]: m["id"] for m in store.get_metadata(ns)} == {"a": 0, "b": 1, "c": 3}
+    assert store.search(ns, vecs[2:], top_k=1, threshold=-1.0)[0]["source"] == "c"
+
+
+def test_faiss_migrates_positional_indexes_to_stable_ids(ns):
+    import json
+    import os
+
+    import faiss
+
+    from rag.user_store import paths_for
+    from rag.vector_store import get_store
+
+    paths = paths_for(ns)
+    legacy = faiss.IndexHNSWFlat(3, 32, faiss.METRIC_INNER_PRODUCT)
+    legacy.add(np.eye(3, dtype="float32")[:2])
+    os.makedirs(paths.dir, exist_ok=True)
+    faiss.write_index(legacy, paths.faiss_index)
+    with open(paths.metadata, "w", encoding="utf-8") as f:
+        json.dump([{"chunk_id": f"{s}_chunk_0", "source": s, "text": s} for s in ("a", "b")], f)
+
+    store = get_store()
+    assert [h["source"] for h in store.search(ns, np.eye(3, dtype="float32")[1:2], 1, -1.0)] == ["b"]
+
+    writer = store.writer(ns)
+    writer.add(np.eye(3, dtype="float32")[2:], [{"chunk_id": "c_chunk_0", "source": "c", "text": "c"}])
+    writer.commit()
+    assert {m["source"]: m["id"] for m in store.get_metadata(ns)} == {"a": 0, "b": 1, "c": 2}
+    assert _faiss_state(ns) == (3, {0, 1, 2})
+    assert os.path.exists(paths.chunks) and not os.path.exists(paths.metadata)
+
+
+def test_faiss_loads_namespaces_memory_mapped(ns, monkeypatch):
+    from rag import vector_store
+    from rag.vector_store import get_store
+
+    monkeypatch.setattr(vector_store, "_LOAD_MODE", "mmap")
+    store = get_store()
+    store.upsert(ns, np.eye(3, dtype="float32"), [
+        {"chunk_id": f"{s}_chunk_0", "source": s, "text": s} for s in ("a", "b", "c")
+    ])
+
+    from rag.chunk_store import load_chunks
+    from rag.user_store import paths_for
+
+    assert load_chunks(paths_for(ns))._buffer is not None  # mapped, not copied to the heap
+    assert [h["text"] for h in store.search(ns, np.eye(3, dtype="float32")[2:], 1, -1.0)] == ["c"]
+
+
+class _LengthEncoder:
+    """Vectors of (chars, 1, 0); records each forward pass's text lengths."""
+
+    def __init__(self) -> None:
+        self.batches: list[list[int]] = []
+
+    def encode(self, texts, *, batch_size, normalize_embeddings):
+        assert batch_size == len(texts)
+        self.batches.append([len(t) for t in texts])
+        return np.array([[len(t), 1.0, 0.0] for t in texts], dtype="float32")
+
+
+def test_length_bucketed_batches_fit_the_budget_and_keep_input_order():
+    from rag.embed_batches import encode_bucketed, plan_batches
+
+    rng = np.random.default_rng(0)
+    texts = ["x" * int(n) for n in rng.integers(4, 400, size=60)]
+    encoder = _LengthEncoder()
+
+    out = encode_bucketed(encoder, texts, token_budget=400, max_batch=16)
+    np.testing.assert_array_equal(out[:, 0], [len(t) for t in texts])
+    assert sum(len(b) for b in encoder.batches) == len(texts)
+    for batch in encoder.batches:
+        tokens = [n // 4 + 2 for n in batch]  # no tokenizer: chars/4 estimate
+        assert len(batch) <= 16 and (len(batch) * max(tokens) <= 400 or len(batch) == 1)
+    flat = [n // 4 for b in encoder.batches for n in b]
+    assert flat == sorted(flat)
+
+    oversized = plan_batches(np.array([5, 900, 5]), token_budget=100, max_batch=8)
+    assert [b.tolist() for b in oversized] == [[0, 2], [1]]
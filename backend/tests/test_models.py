@@ -0,0 +1,287 @@
+"""Model registry tests: lazy loading, one shared instance per process, load
+stats, preload-and-fork and the micro-batching model server. Models are the
+conftest sentence-transformers stubs or small fakes.
+"""
+from __future__ import annotations
+
+import gc
+import os
+import runpy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    from rag import models
+
+    models.reset_for_tests()
+    yield models
+    models.reset_for_tests()
+
+
+def test_importing_pipeline_modules_does_not_load_models(registry):
+    import rag.ingest  # noqa: F401
+    import rag.retrieve  # noqa: F401
+
+    assert not registry.is_loaded(registry.EMBEDDER)
+
+
+def test_ingest_and_retrieve_share_one_embedder(registry, monkeypatch):
+    from rag import ingest, retrieve
+
+    built: list[object] = []
+    real_factory = registry._new_embedder
+
+    def _counting_factory():
+        built.append(1)
+        return real_factory()
+
+    monkeypatch.setattr(registry, "_new_embedder", _counting_factory)
+
+    retrieve.embed(["query"])
+    ingest.embed(["chunk"])
+    assert len(built) == 1
+    assert registry.loaded_models()[registry.EMBEDDER].load_seconds >= 0
+
+
+def test_disabled_reranker_is_never_loaded(registry, monkeypatch):
+    monkeypatch.setattr(registry, "RERANK_DISABLED", True)
+    monkeypatch.setattr(registry, "_new_reranker", lambda: pytest.fail("loaded a disabled reranker"))
+
+    stats = registry.warmup()
+    assert registry.get_reranker() is None
+    assert set(stats) == {registry.EMBEDDER}
+
+
+class _FakeServer:
+    class log:  # noqa: N801 - mimics gunicorn's server.log
+        @staticmethod
+        def info(_msg):
+            pass
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_preloaded_workers_do_not_reload_weights(registry, monkeypatch):
+    monkeypatch.setenv("GUNICORN_PRELOAD", "1")
+    conf = runpy.run_path(str(Path(__file__).resolve().parents[1] / "gunicorn.conf.py"))
+
+    built: list[int] = []
+    real_factory = registry._new_embedder
+
+    def _counting_factory():
+        built.append(1)
+        return real_factory()
+
+    monkeypatch.setattr(registry, "_new_embedder", _counting_factory)
+
+    try:
+        conf["when_ready"](_FakeServer())
+        assert len(built) == 1
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # gunicorn worker
+            code = 1
+            try:
+                conf["post_fork"](_FakeServer(), None)
+                from rag import ingest, retrieve
+
+                retrieve.embed(["query"])
+                ingest.embed(["chunk"])
+                os.write(write_fd, str(len(built)).encode())
+                code = 0
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        _, status = os.waitpid(pid, 0)
+        assert os.WEXITSTATUS(status) == 0
+        assert os.read(read_fd, 16) == b"1"
+        os.close(read_fd)
+    finally:
+        gc.unfreeze()
+
+
+class _RecordingEncoder:
+    def __init__(self):
+        self.calls: list[int] = []
+
+    def encode(self, texts, **_kw):
+        self.calls.append(len(texts))
+        return np.array([[float(len(t)), 0.0, 1.0] for t in texts], dtype="float32")
+
+
+class _LengthReranker:
+    def predict(self, pairs, **_kw):
+        return np.array([float(len(p[1])) for p in pairs], dtype="float32")
+
+
+@pytest.fixture
+def model_server():
+    from rag import model_server
+
+    servers = []
+
+    def _start(bind, **kw):
+        server = model_server.make_server(bind, **kw)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield _start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_model_server_merges_concurrent_requests_into_batches(model_server):
+    from rag.model_server import ModelClient, RemoteEmbedder
+
+    encoder = _RecordingEncoder()
+    server = model_server("127.0.0.1:0", embedder=encoder, reranker=None, window_ms=100, max_batch=64)
+    host, port = server.server_address
+    client = RemoteEmbedder(ModelClient(f"http://{host}:{port}"))
+
+    texts = ["a" * n for n in range(1, 9)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda t: client.encode([t]), texts))
+
+    for text, vec in zip(texts, results):
+        assert vec.shape == (1, 3) and vec[0, 0] == len(text)
+    assert sum(encoder.calls) == 8
+    assert len(encoder.calls) < 8
+
+
+def test_a_failing_input_only_fails_its_own_request():
+    from rag.model_server import MicroBatcher
+
+    calls: list[list] = []
+
+    def _encode(items):
+        calls.append(list(items))
+        if "bad" in items:
+            raise ValueError("cannot encode 'bad'")
+        return [len(t) for t in items]
+
+    # Three one-item requests fill max_batch, so they share one merged call.
+    batcher = MicroBatcher(_encode, name="test", window_s=10, max_batch=3)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = {t: pool.submit(batcher.submit, [t]) for t in ("ok", "bad", "fine")}
+
+    assert futures["ok"].result() == [2] and futures["fine"].result() == [4]
+    with pytest.raises(ValueError, match="bad"):
+        futures["bad"].result()
+    assert sorted(calls[0]) == ["bad", "fine", "ok"] and sorted(calls[1:]) == [["bad"], ["fine"], ["ok"]]
+
+
+def test_registry_uses_model_server_clients_over_unix_socket(registry, model_server, monkeypatch, tmp_path):
+    from rag import rerank, retrieve
+
+    sock = str(tmp_path / "models.sock")
+    model_server(f"unix:{sock}", embedder=_RecordingEncoder(), reranker=_LengthReranker(), window_ms=1)
+    monkeypatch.setattr(registry, "MODEL_SERVER_URL", f"unix:{sock}")
+    monkeypatch.setattr(registry, "RERANK_DISABLED", False)
+
+    assert retrieve.embed(["abcd"])[0, 0] == 4
+    ranked = rerank.rerank("q", [{"text": "x"}, {"text": "xxx"}, {"text": "xx"}], top_k=2)
+    assert [c["text"] for c in ranked] == ["xxx", "xx"]
+
+
+class _Encoding:
+    def __init__(self, ids: list[int], pad_to: int, type_ids: list[int] | None = None) -> None:
+        self.ids = ids + [0] * (pad_to - len(ids))
+        self.attention_mask = [1] * len(ids) + [0] * (pad_to - len(ids))
+        self.type_ids = (type_ids or [0] * len(ids)) + [0] * (pad_to - len(ids))
+
+
+class _FakeTokenizer:
+    """One token per character; pairs become query chars then passage chars."""
+
+    def encode_batch(self, inputs):
+        seqs = [[ord(c) for c in (x if isinstance(x, str) else x[0] + x[1])] for x in inputs]
+        width = max(len(s) for s in seqs)
+        return [_Encoding(s, width) for s in seqs]
+
+
+class _FakeSession:
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+
+    def run(self, _outputs, feed):
+        ids = feed["input_ids"].astype("float32")
+        if self.kind == "embedder":  # token vector = (id, 1, padding marker)
+            hidden = np.stack([ids, np.ones_like(ids), (ids == 0) * 100.0], axis=-1)
+            return [hidden]
+        return [feed["attention_mask"].sum(axis=1, keepdims=True).astype("float32") - 3.0]
+
+
+def _onnx_model(cls, kind: str, config: dict):
+    model = object.__new__(cls)
+    model.config = config
+    model.tokenizer = _FakeTokenizer()
+    model.session = _FakeSession(kind)
+    model._input_names = {"input_ids", "attention_mask", "token_type_ids"}
+    return model
+
+
+def test_onnx_embedder_mean_pools_over_real_tokens_only():
+    from rag.onnx_models import OnnxEmbedder
+
+    model = _onnx_model(OnnxEmbedder, "embedder", {"dim": 3})
+    out = model.encode(["ab", "abcd"], batch_size=1)
+    np.testing.assert_allclose(out[0], [(97 + 98) / 2, 1.0, 0.0])
+
+    normed = model.encode(["ab", "abcd"], normalize_embeddings=True)  # one padded batch
+    np.testing.assert_allclose(np.linalg.norm(normed, axis=1), 1.0, rtol=1e-6)
+    np.testing.assert_allclose(normed[0], out[0] / np.linalg.norm(out[0]), rtol=1e-6)
+
+
+def test_onnx_cross_encoder_applies_the_exported_activation():
+    from rag.onnx_models import OnnxCrossEncoder
+
+    pairs = [("q", "ab"), ("q", "abcdef")]
+    raw = _onnx_model(OnnxCrossEncoder, "reranker", {"activation": "identity"}).predict(pairs)
+    np.testing.assert_allclose(raw, [0.0, 4.0])
+    sig = _onnx_model(OnnxCrossEncoder, "reranker", {"activation": "sigmoid"}).predict(pairs, batch_size=1)
+    np.testing.assert_allclose(sig, 1 / (1 + np.exp(-raw)), rtol=1e-6)
+    assert _onnx_model(OnnxCrossEncoder, "reranker", {}).predict([]).shape == (0,)
+
+
+def test_onnx_backend_is_selected_per_role(registry, monkeypatch):
+    from rag import onnx_models
+
+    class _Fake:
+        def __init__(self, path, **kw):
+            self.path = path
+
+        def nbytes(self):
+            return 1234
+
+    monkeypatch.setattr(onnx_models, "OnnxEmbedder", _Fake)
+    monkeypatch.setattr(registry, "EMBEDDING_BACKEND", "onnx")
+    monkeypatch.setattr(registry, "EMBEDDING_MODEL_ID", "all-MiniLM-L6-v2@onnx-int8")
+
+    embedder = registry.get_embedder()
+    assert embedder.path == onnx_models.model_dir("all-MiniLM-L6-v2")
+    stats = registry.loaded_models()[registry.EMBEDDER]
+    assert (stats.name, stats.resident_bytes) == ("all-MiniLM-L6-v2@onnx-int8", 1234)
+    assert onnx_models.model_dir("cross-encoder/ms-marco-MiniLM-L-6-v2").name == "cross-encoder__ms-marco-MiniLM-L-6-v2"
+
+
+def test_model_id_tags_the_quantized_backend(registry):
+    assert registry._model_id("m", "torch") == "m"
+    assert registry._model_id("m", "onnx") == "m@onnx-int8"
+    with pytest.raises(ValueError):
+        registry._model_id("m", "tensorrt")
+
+
+def test_missing_onnx_export_names_the_export_command(tmp_path):
+    pytest.importorskip("onnxruntime")
+    from rag.onnx_models import OnnxEmbedder
+
+    with pytest.raises(FileNotFoundError, match="rag.onnx_models export"):
+        OnnxEmbedder(tmp_path)
@@ -0,0 +1,45 @@
+"""Namespace cache: byte-budgeted LRU that evicts a namespace's FAISS and BM25
+entries together."""
+from __future__ import annotations
+
+from rag.namespace_cache import NamespaceCache
+
+
+def test_evicts_least_recently_used_namespace_as_a_unit():
+    cache = NamespaceCache(budget=100)
+    cache.put("a", "faiss", "A-faiss", 30)
+    cache.put("a", "bm25", "A-bm25", 20)
+    cache.put("b", "faiss", "B-faiss", 40)
+    assert cache.get("a", "faiss") == "A-faiss"  # "b" is now the coldest
+
+    cache.put("c", "faiss", "C-faiss", 30)
+
+    assert cache.namespaces() == ["a", "c"]
+    assert cache.get("b", "faiss") is None
+    assert cache.nbytes == 80
+
+    cache.put("d", "faiss", "D-faiss", 60)
+    # Both of "a"'s entries go at once, never just one of them.
+    assert cache.get("a", "faiss") is None and cache.get("a", "bm25") is None
+    assert cache.namespaces() == ["c", "d"]
+
+
+def test_oversized_namespace_still_stays_resident():
+    cache = NamespaceCache(budget=10)
+    cache.put("a", "faiss", "small", 5)
+    cache.put("big", "faiss", "huge", 50)
+    assert cache.namespaces() == ["big"]
+    assert cache.get("big", "faiss") == "huge"
+
+
+def test_replacing_and_invalidating_entries_keeps_byte_count():
+    cache = NamespaceCache(budget=100)
+    cache.put("a", "faiss", 1, 30)
+    cache.put("a", "faiss", 2, 10)
+    cache.put("a", "bm25", 3, 5)
+    assert cache.nbytes == 15
+
+    cache.invalidate("a", "faiss")
+    assert cache.nbytes == 5 and cache.get("a", "bm25") == 3
+    cache.invalidate("a")
+    assert cache.nbytes == 0 and cache.namespaces() == []
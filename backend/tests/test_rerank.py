@@ -0,0 +1,134 @@
+"""Rerank score cache (only unseen (query, passage) pairs reach the
+cross-encoder) and the adaptive rerank-depth policy. The model is a counting
+stub; the conftest disables the real one.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+from rag import rerank
+from rag.chunk_store import ChunkTable
+
+
+class _CountingReranker:
+    def __init__(self) -> None:
+        self.pairs: list[tuple[str, str]] = []
+
+    def predict(self, pairs, **_kw):
+        self.pairs.extend(pairs)
+        return np.array([len(p[1]) for p in pairs], dtype="float32")
+
+
+@pytest.fixture
+def model(monkeypatch):
+    stub = _CountingReranker()
+    monkeypatch.setattr(rerank, "get_reranker", lambda: stub)
+    rerank._cache.clear()
+    yield stub
+    rerank._cache.clear()
+
+
+def test_only_cache_misses_reach_the_model(model):
+    first = rerank.rerank_scores("What is BM25?", ["a", "bbb", "cc"])
+    assert len(model.pairs) == 3
+
+    model.pairs.clear()
+    second = rerank.rerank_scores("  what is   bm25? ", ["cc", "dddd", "a"])
+    assert model.pairs == [("  what is   bm25? ", "dddd")]
+    np.testing.assert_array_equal(second, [2, 4, 1])
+    np.testing.assert_array_equal(first, [1, 3, 2])
+
+
+def test_cache_is_keyed_by_query_and_bounded(model, monkeypatch):
+    monkeypatch.setattr(rerank._cache, "max_entries", 2)
+    rerank.rerank_scores("q1", ["a", "b"])
+    rerank.rerank_scores("q2", ["a"])  # other query: miss, and evicts ("q1", "a")
+    model.pairs.clear()
+
+    rerank.rerank_scores("q1", ["a", "b"])
+    assert model.pairs == [("q1", "a")]
+
+
+def test_rerank_orders_dicts_by_cached_scores(model):
+    chunks = [{"chunk_id": str(i), "text": "x" * n} for i, n in enumerate([2, 5, 1])]
+    rerank.rerank("q", [dict(c) for c in chunks], top_k=2)
+    model.pairs.clear()
+
+    out = rerank.rerank("q", [dict(c) for c in chunks], top_k=2)
+    assert model.pairs == []
+    assert [c["chunk_id"] for c in out] == ["1", "0"]
+    assert out[0]["rerank_score"] == 5.0
+
+
+def _ranked(ids):
+    ids = np.asarray(ids, dtype="int64")
+    return ids, np.linspace(1.0, 0.5, len(ids)).astype("float32")
+
+
+def test_depth_skips_when_both_legs_agree_on_a_clear_winner(model):
+    from rag.candidates import fuse_rrf
+
+    # Both legs rank 7 first and 8 thirtieth; everything between is single-leg.
+    batch = fuse_rrf(
+        _ranked([7, *range(100, 128), 8]), _ranked([7, *range(200, 228), 8]), top_k=50
+    )
+    assert list(batch.ids[:2]) == [7, 8]
+    decision = rerank.rerank_depth(batch, top_k=2, namespace_size=1000)
+    assert (decision.decision, decision.depth) == ("skip", 0)
+
+
+def test_depth_reranks_the_head_when_the_runner_up_is_single_leg(model):
+    from rag.candidates import fuse_rrf
+
+    # Agreement on #1 alone: ranks 2..top_k would otherwise stay in raw RRF order.
+    batch = fuse_rrf(_ranked([7, 1, 2]), _ranked([7, 30, 31]), top_k=50)
+    decision = rerank.rerank_depth(batch, top_k=2, namespace_size=1000)
+    assert (decision.decision, decision.depth) == ("full", 5)
+
+
+def test_depth_follows_namespace_size_and_fused_gap(model):
+    from rag.candidates import fuse_rrf
+
+    # Disagreeing legs: every candidate is single-leg, no gap → only size caps depth.
+    batch = fuse_rrf(_ranked(range(0, 30)), _ranked(range(100, 130)), top_k=50)
+    assert rerank.rerank_depth(batch, top_k=5, namespace_size=10_000).decision == "full"
+    small = rerank.rerank_depth(batch, top_k=5, namespace_size=120)
+    assert (small.decision, small.reason, small.depth) == ("partial", "namespace", 12)
+
+    # Legs agree on ten chunks (in a different order): the single-leg tail is cut.
+    agreed = list(range(10))
+    batch = fuse_rrf(_ranked(agreed + list(range(10, 30))), _ranked(agreed[::-1] + list(range(100, 120))), top_k=50)
+    gap = rerank.rerank_depth(batch, top_k=5, namespace_size=10_000)
+    assert (gap.decision, gap.reason, gap.depth) == ("partial", "gap", 10)
+
+
+def test_gap_cut_keeps_a_leg_top_hit_the_other_leg_missed(model):
+    from rag.candidates import fuse_rrf
+
+    rows = [{"id": i, "chunk_id": f"c{i}", "source": "a.txt", "text": "x"} for i in range(130)]
+    rows[99]["text"] = "x" * 50  # the stub scores by length: c99 is the best passage
+    chunks = ChunkTable.from_dicts(rows)
+    agreed = list(range(10))
+    # c99 is the vector leg's #1; BM25 never saw it, so it fuses below all ten agreed chunks.
+    batch = fuse_rrf(_ranked([99] + agreed + list(range(10, 29))), _ranked(agreed[::-1] + list(range(100, 120))), top_k=50)
+    assert list(batch.ids[:10]) != [99] and 99 in batch.ids[10:12]
+
+    decision = rerank.rerank_depth(batch, top_k=5, namespace_size=10_000)
+    assert (decision.decision, decision.reason) == ("partial", "gap")
+    assert 99 in batch.ids[: decision.depth]
+    out = rerank.rerank_batch("q", batch, chunks, top_k=5, depth=decision.depth)
+    assert out.ids[0] == 99
+
+
+def test_partial_rerank_keeps_the_unscored_tail_in_fused_order(model):
+    from rag.candidates import CandidateBatch
+
+    rows = [{"id": i, "chunk_id": f"c{i}", "source": "a.txt", "text": "x" * (i + 1)} for i in range(6)]
+    chunks = ChunkTable.from_dicts(rows)
+    batch = CandidateBatch.from_ranked(_ranked([0, 1, 2, 3, 4, 5]))
+
+    out = rerank.rerank_batch("q", batch, chunks, top_k=5, depth=3).to_dicts(chunks)
+    assert [c["chunk_id"] for c in out] == ["c2", "c1", "c0", "c3", "c4"]
+    assert len(model.pairs) == 3
+    assert "rerank_score" in out[0] and "rerank_score" not in out[3]
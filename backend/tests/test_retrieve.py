@@ -0,0 +1,92 @@
+"""Retrieval pipeline tests: the vector and BM25 legs run concurrently, a leg
+that misses its timeout is dropped instead of failing the request, and the
+id-based candidate pipeline returns what the dict-based one did. Both legs are
+stubbed; reranking is disabled by the conftest env.
+"""
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+import pytest
+
+from rag import retrieve
+from rag.candidates import CandidateBatch, fuse_rrf
+from rag.chunk_store import ChunkTable
+from rag.hybrid import rrf_fuse
+
+_ROWS = [{"id": i, "chunk_id": f"c{i}", "source": f"s{i % 3}.txt", "text": f"text {i}"} for i in range(40)]
+
+
+class _Store:
+    """Vector leg that calls ``gate`` before answering."""
+
+    def __init__(self, gate) -> None:
+        self.gate = gate
+
+    def search_ids(self, namespace, q_emb, top_k, threshold):
+        self.gate()
+        return np.array([1], dtype="int64"), np.array([0.9], dtype="float32")
+
+
+@pytest.fixture
+def legs(monkeypatch, tmp_path):
+    """Both legs wait on one barrier: it only opens if they run at the same time."""
+    from rag import user_store
+
+    monkeypatch.setattr(user_store, "_USERS_ROOT", tmp_path)
+    monkeypatch.setattr(retrieve, "paths_for", user_store.paths_for)
+    ChunkTable.from_dicts(_ROWS).write(user_store.paths_for("u").chunks)
+    barrier = threading.Barrier(2, timeout=10)
+
+    def _bm25(query, *, user_id, top_k):
+        barrier.wait()
+        return np.array([2], dtype="int64"), np.array([3.0], dtype="float32")
+
+    monkeypatch.setattr(retrieve, "bm25_search_ids", _bm25)
+    return barrier
+
+
+def test_legs_overlap_instead_of_adding_up(legs, monkeypatch):
+    monkeypatch.setattr(retrieve, "get_store", lambda: _Store(legs.wait))
+
+    hits = retrieve.retrieve("q", user_id="u", query_embedding=np.zeros((1, 3), dtype="float32"), top_k=5)
+
+    # Run one after the other, each leg would break the barrier and drop out.
+    assert {h["chunk_id"] for h in hits} == {"c1", "c2"}
+    assert not legs.broken
+
+
+def test_a_leg_past_its_timeout_is_dropped(legs, monkeypatch):
+    release = threading.Event()
+
+    def _stuck():
+        legs.wait()  # start together with the BM25 leg, then hang
+        release.wait(10)
+
+    monkeypatch.setattr(retrieve, "get_store", lambda: _Store(_stuck))
+    monkeypatch.setattr(retrieve, "_LEG_TIMEOUT", 1.0)
+    try:
+        hits = retrieve.retrieve("q", user_id="u", query_embedding=np.zeros((1, 3), dtype="float32"), top_k=5)
+    finally:
+        release.set()
+
+    assert [h["chunk_id"] for h in hits] == ["c2"]
+    assert hits[0]["score"] == 3.0
+
+
+def test_batch_fusion_matches_dict_fusion():
+    chunks = ChunkTable.from_dicts(_ROWS)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        vec_ids = rng.choice(40, size=rng.integers(0, 25), replace=False).astype("int64")
+        bm25_ids = rng.choice(40, size=rng.integers(1, 25), replace=False).astype("int64")
+        vector = (vec_ids, np.sort(rng.random(len(vec_ids)).astype("float32"))[::-1])
+        bm25 = (bm25_ids, np.sort(rng.random(len(bm25_ids)).astype("float32") * 10)[::-1])
+
+        want = rrf_fuse(
+            CandidateBatch.from_ranked(vector).to_dicts(chunks),
+            CandidateBatch.from_ranked(bm25, leg="bm25").to_dicts(chunks),
+            top_k=15,
+        )
+        assert fuse_rrf(vector, bm25, top_k=15).to_dicts(chunks) == want
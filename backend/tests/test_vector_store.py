@@ -0,0 +1,132 @@
+"""Qdrant backend against a recording fake client: payloads carry ids, not
+text; searches hydrate text from the local chunk table, re-read when another
+process replaced it; points written before the chunk store (text in the
+payload) still search."""
+from __future__ import annotations
+
+import threading
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from rag import vector_store
+
+
+class _FakeQdrant:
+    def __init__(self) -> None:
+        self.points: dict[str, SimpleNamespace] = {}
+
+    def get_collections(self):
+        return SimpleNamespace(collections=[])
+
+    def create_collection(self, **kw): ...
+    def create_payload_index(self, **kw): ...
+    def delete(self, **kw): ...
+
+    def upsert(self, *, collection_name, points):
+        self.points.update({p.id: p for p in points})
+
+    def search(self, *, query_vector, limit, **kw):
+        scored = [
+            SimpleNamespace(payload=p.payload, score=float(np.dot(p.vector, query_vector)))
+            for p in self.points.values()
+        ]
+        return sorted(scored, key=lambda h: -h.score)[:limit]
+
+
+def _record(**kw):
+    return SimpleNamespace(**kw)
+
+
+_MODELS = SimpleNamespace(
+    PointStruct=_record,
+    Filter=_record,
+    FieldCondition=_record,
+    MatchValue=_record,
+    MatchAny=_record,
+    FilterSelector=_record,
+    VectorParams=_record,
+    Distance=SimpleNamespace(COSINE="Cosine"),
+    PayloadSchemaType=SimpleNamespace(KEYWORD="keyword"),
+)
+
+
+@pytest.fixture
+def qdrant(monkeypatch, tmp_path):
+    from rag import user_store
+
+    monkeypatch.setattr(user_store, "_USERS_ROOT", tmp_path / "users")
+    store = object.__new__(vector_store._QdrantStore)
+    store._client, store._models = _FakeQdrant(), _MODELS
+    store._lock, store._ensured_dim = threading.Lock(), None
+    return store
+
+
+def _ingest(store, namespace: str = "u") -> None:
+    vecs = np.eye(3, dtype="float32")
+    meta = [
+        {"chunk_id": f"doc.txt::{i}", "source": "doc.txt", "text": f"chunk number {i}"}
+        for i in range(3)
+    ]
+    writer = store.writer(namespace, replace=True)
+    writer.add(vecs, meta)
+    writer.commit()
+
+
+def test_upserted_payloads_carry_ids_not_text(qdrant):
+    _ingest(qdrant)
+
+    points = list(qdrant._client.points.values())
+    assert len(points) == 3
+    for p in points:
+        assert set(p.payload) == {"user_id", "id", "chunk_id", "source"}
+        assert p.id == str(uuid.uuid5(uuid.NAMESPACE_URL, f"u:{p.payload['id']}"))
+
+
+def test_search_hydrates_text_from_the_chunk_table(qdrant):
+    _ingest(qdrant)
+    q = np.array([[0.0, 1.0, 0.0]], dtype="float32")
+
+    hits = qdrant.search("u", q, top_k=1, threshold=0.0)
+    assert [(h["chunk_id"], h["text"]) for h in hits] == [("doc.txt::1", "chunk number 1")]
+    ids, scores = qdrant.search_ids("u", q, top_k=3, threshold=0.0)
+    assert len(ids) == 3 and scores[0] == pytest.approx(1.0)
+
+
+def test_legacy_points_with_text_still_search(qdrant):
+    qdrant._client.points["legacy"] = SimpleNamespace(
+        id="legacy",
+        vector=[1.0, 0.0, 0.0],
+        payload={"user_id": "u", "chunk_id": "old.txt::0", "source": "old.txt", "text": "from the payload"},
+    )
+    q = np.array([[1.0, 0.0, 0.0]], dtype="float32")
+
+    assert qdrant.search_ids("u", q, top_k=5, threshold=0.0) is None  # caller falls back to search()
+    hits = qdrant.search("u", q, top_k=5, threshold=0.0)
+    assert [(h["source"], h["text"]) for h in hits] == [("old.txt", "from the payload")]
+
+
+def test_search_sees_chunks_another_process_committed(qdrant):
+    from rag.chunk_store import ChunkTable, load_chunks
+    from rag.user_store import paths_for
+
+    _ingest(qdrant)
+    q = np.array([[0.0, 0.0, 1.0]], dtype="float32")
+    assert len(qdrant.search("u", q, top_k=3, threshold=0.0)) == 3  # table now cached here
+
+    # The Celery worker ingests a fourth chunk: new Qdrant point, new chunks.bin.
+    paths = paths_for("u")
+    rows = load_chunks(paths).to_dicts()
+    rows.append({"id": 3, "chunk_id": "new.txt::0", "source": "new.txt", "text": "from the worker"})
+    ChunkTable.from_dicts(rows).write(paths.chunks)
+    qdrant._client.points["p3"] = SimpleNamespace(
+        id="p3",
+        vector=[0.0, 0.0, 2.0],
+        payload={"user_id": "u", "id": 3, "chunk_id": "new.txt::0", "source": "new.txt"},
+    )
+
+    ids, _ = qdrant.search_ids("u", q, top_k=4, threshold=0.0)
+    assert ids[0] == 3 and len(ids) == 4
+    assert qdrant.search("u", q, top_k=1, threshold=0.0)[0]["text"] == "from the worker"